@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.db.models.functions import Length
 from django import forms
-from xml.etree import ElementTree
 from .models import Entry, Tag, Quotation, Blogmark, Series, Photo
+from .models import body_xml_error, format_xml_error
 
 
 class BaseAdmin(admin.ModelAdmin):
@@ -18,10 +18,9 @@ class MyEntryForm(forms.ModelForm):
     def clean_body(self):
         # Ensure this is valid XML
         body = self.cleaned_data["body"]
-        try:
-            ElementTree.fromstring("<entry>%s</entry>" % body)
-        except Exception as e:
-            raise forms.ValidationError(str(e))
+        error = body_xml_error(body)
+        if error:
+            raise forms.ValidationError(format_xml_error(error))
         return body
 
 
@@ -0,0 +1,247 @@
+"""
+The blog JSON format, used by import_blog_json and export_blog_json.
+
+Each item is a JSON object with a "type" ("entry", "quotation" or
+"blogmark"), a "datetime", a "slug", a list of "tags", an optional
+"import_ref", and the type's own fields. Items may also carry "metadata" (or
+else the whole item is kept as the object's metadata), "latitude",
+"longitude", an entry's "summary", "tweet_html", "extra_head_html" and
+"series" (its slug, title and description), all of which export_blog_json
+writes so that an export is a complete copy. A file is either a JSON array of
+items or newline-delimited JSON (one item per line), optionally compressed
+with gzip (.gz) or, if the zstandard package is installed, zstd (.zst).
+"""
+
+import gzip
+import io
+import json
+from dateutil import parser
+from django.utils.timezone import utc
+from blog.models import Entry, Blogmark, Quotation, Series
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_SIZE = 64 * 1024
+EXPORT_CHUNK_SIZE = 1000
+
+# The fields of each type that make it into an item, besides the common ones
+ITEM_FIELDS = {
+    Entry: ["title", "body"],
+    Quotation: ["quotation", "source", "source_url"],
+    Blogmark: ["link_url", "link_title", "via_url", "via_title", "commentary"],
+}
+
+# Fields that are exported, and imported if they're there
+OPTIONAL_FIELDS = ["latitude", "longitude"]
+OPTIONAL_ITEM_FIELDS = {
+    Entry: ["summary", "tweet_html", "extra_head_html"],
+    Quotation: [],
+    Blogmark: [],
+}
+SERIES_FIELDS = ["slug", "title", "description"]
+
+
+def open_json(path, mode="r"):
+    """
+    Opens a blog JSON file for reading or writing text ("r" or "w"),
+    compressed or not depending on its extension.
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("reading or writing .zst files needs zstandard")
+        fp = open(path, mode + "b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(fp, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(fp, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf8")
+    return open(path, mode, encoding="utf8")
+
+
+def iter_json_items(fp):
+    """
+    Yields items one at a time from a file-like object containing either a
+    JSON array or newline-delimited JSON, without reading it all into memory.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    in_array = None
+
+    while True:
+        # Skip separators: whitespace, and commas between array items
+        while True:
+            while pos < len(buf) and (
+                buf[pos].isspace() or (in_array and buf[pos] == ",")
+            ):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = fp.read(READ_SIZE), 0
+            eof = not buf
+
+        if pos >= len(buf):
+            if in_array:
+                raise ValueError("unexpected end of file: unterminated JSON array")
+            return
+        if in_array is None:
+            in_array = buf[pos] == "["
+            if in_array:
+                pos += 1
+                continue
+        if in_array and buf[pos] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = fp.read(READ_SIZE)
+            eof = not more
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield item
+        pos = end
+
+
+def item_to_fields(item):
+    """
+    Returns (model class, field values) for one item. The item's series, if
+    it has one, is left to the caller (see get_series).
+    """
+    klass, fields = _item_to_fields(item)
+    for name in OPTIONAL_FIELDS + OPTIONAL_ITEM_FIELDS[klass]:
+        if name in item:
+            fields[name] = item[name]
+    if "metadata" in item:
+        fields["metadata"] = item["metadata"]
+    return klass, fields
+
+
+def get_series(series):
+    """
+    Returns the Series for an item's "series" (creating it if need be), or
+    None.
+    """
+    if not series:
+        return None
+    obj, _ = Series.objects.get_or_create(
+        slug=series["slug"],
+        defaults={
+            "title": series["title"],
+            "description": series.get("description", ""),
+        },
+    )
+    return obj
+
+
+def _item_to_fields(item):
+    created = parser.parse(item["datetime"]).replace(tzinfo=utc)
+    slug = item["slug"][:64].strip("-")
+    if item["type"] == "entry":
+        return (
+            Entry,
+            dict(
+                body=item["body"],
+                title=item["title"],
+                created=created,
+                slug=slug,
+                metadata=item,
+            ),
+        )
+    elif item["type"] == "quotation":
+        return (
+            Quotation,
+            dict(
+                quotation=item["quotation"],
+                source=item["source"],
+                source_url=item["source_url"],
+                created=created,
+                slug=slug,
+                metadata=item,
+            ),
+        )
+    elif item["type"] == "blogmark":
+        return (
+            Blogmark,
+            dict(
+                slug=slug,
+                link_url=item["link_url"],
+                link_title=item["link_title"],
+                via_url=item.get("via_url") or "",
+                via_title=item.get("via_title") or "",
+                commentary=item["commentary"] or "",
+                created=created,
+                metadata=item,
+            ),
+        )
+    else:
+        assert False, "type should be known, %s" % item["type"]
+
+
+def iter_export_items(klass, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields every object of `klass` (changed on or after `since`, if given) as
+    an item, oldest first, streaming rows with .iterator() and looking up tags
+    a chunk at a time.
+
+    Objects that weren't imported get an import_ref made from their type and
+    pk, so that importing the same export twice updates rather than
+    duplicates them. import_blog_json matches such a ref to the object it was
+    made from, if it's still there (same pk and slug, and no import_ref).
+    """
+    type_name = klass._meta.model_name
+    fields = (
+        ["pk", "created", "slug", "import_ref", "metadata"]
+        + OPTIONAL_FIELDS
+        + ITEM_FIELDS[klass]
+        + OPTIONAL_ITEM_FIELDS[klass]
+    )
+    if klass is Entry:
+        fields += ["series__" + name for name in SERIES_FIELDS]
+    qs = klass.objects.order_by("created", "pk")
+    if since:
+        qs = qs.filter(updated__gte=since)
+    rows = qs.values(*fields).iterator(chunk_size=chunk_size)
+
+    through = klass.tags.through
+    column = "%s_id" % type_name
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from _chunk_items(type_name, chunk, through, column)
+            chunk = []
+    yield from _chunk_items(type_name, chunk, through, column)
+
+
+def _chunk_items(type_name, rows, through, column):
+    tags = {}
+    pairs = through.objects.filter(**{column + "__in": [r["pk"] for r in rows]})
+    for pk, tag in pairs.order_by("tag__tag").values_list(column, "tag__tag"):
+        tags.setdefault(pk, []).append(tag)
+    for row in rows:
+        pk = row.pop("pk")
+        created = row.pop("created")
+        item = {
+            "type": type_name,
+            "datetime": created.astimezone(utc).replace(tzinfo=None).isoformat(),
+            "tags": tags.get(pk, []),
+        }
+        if type_name == "entry":
+            series = {name: row.pop("series__" + name) for name in SERIES_FIELDS}
+            item["series"] = series if series["slug"] is not None else None
+        item.update(row)
+        item["import_ref"] = item["import_ref"] or synthesized_ref(type_name, pk)
+        yield item
+
+
+def synthesized_ref(type_name, pk):
+    return "%s:%d" % (type_name, pk)
@@ -0,0 +1,439 @@
+"""
+A two-tier cache backend: a small in-process LRU in front of a shared cache
+(Redis, in production).
+
+Reads are served from the local tier when they can be, and otherwise from the
+shared cache (and then kept locally). Writes go to the shared cache, and
+update or evict the local copy. Local copies are kept for at most
+LOCAL_TIMEOUT seconds, never past the value's own expiry (which is stored
+alongside values set with a timeout), and LOCAL_MAX_ENTRIES of them at most.
+Anything but strings and numbers is kept pickled, so that every read gets its
+own copy, as it would from any other backend.
+
+To keep processes coherent, every write is also recorded in a change log in
+the shared cache: a counter, moved on by each write, and which key was written
+under each of its values. Each process checks the counter at most every
+CHECK_INTERVAL seconds, on a read, and evicts the keys that other processes
+have written since it last looked -- so a value changed by another process is
+seen within CHECK_INTERVAL seconds, and a stream of writes to pages and
+counters doesn't cost every other process its copies of the hot keys. A
+process more than MAX_CHANGES behind, or that finds a change it can't read,
+empties its local tier instead. invalidate_local() empties it immediately, for
+anything that finds out about changes sooner (like blog.invalidation).
+
+Values of COMPRESS_MIN_SIZE bytes or more (pickled) are compressed on their
+way to the shared cache -- with zstd if the zstandard package is installed,
+otherwise zlib -- and decompressed on the way back, so the local tier holds
+them as they were. Rendered pages and feeds compress several times over, and
+that's memory and transfer time saved on every read from Redis.
+
+    CACHES = {
+        "shared": {"BACKEND": "redis_cache.RedisCache", ...},
+        "default": {
+            "BACKEND": "blog.cache_backends.TwoTierCache",
+            "LOCATION": "default",
+            "OPTIONS": {"SHARED": "shared"},
+        },
+    }
+"""
+
+import collections
+import os
+import pickle
+import threading
+import time
+import zlib
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# The change log: a counter, and the key written for each of its values
+CHANGES_KEY = "two-tier-changes"
+CHANGE_KEY = "two-tier-change:%d"
+CHANGE_TIMEOUT = 10 * 60
+
+# Further behind than this, a process empties its local tier rather than
+# catching up
+MAX_CHANGES = 1000
+
+# Prefix for the key holding when a value expires, as a timestamp
+EXPIRES_PREFIX = "two-tier-expires:"
+
+# Values the local tier can hand out as they are, since they can't be changed
+IMMUTABLE = (type(None), bool, int, float, str, bytes)
+
+# Values smaller than this (pickled) aren't worth compressing
+COMPRESS_MIN_SIZE = 1024
+
+# Nor are values that compress to more than this fraction of their size
+COMPRESS_MAX_RATIO = 0.9
+
+_missing = object()
+
+# A compressed, pickled value, as stored in the shared cache
+Compressed = collections.namedtuple("Compressed", "algorithm data")
+
+# A pickled value, as kept in the local tier
+Pickled = collections.namedtuple("Pickled", "data")
+
+
+class Codec:
+    """
+    Compresses values above a size threshold, and keeps count of how well
+    that's going: see report().
+    """
+
+    def __init__(self, min_size=COMPRESS_MIN_SIZE, algorithm=None, level=None):
+        self.min_size = min_size
+        self.algorithm = algorithm or ("zstd" if zstandard else "zlib")
+        if self.algorithm == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=level or 3)
+            self.compress = self.compressor.compress
+        else:
+            self.compress = lambda data: zlib.compress(data, level or 6)
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+
+    def count(self, **stats):
+        with self.lock:
+            self.stats.update(stats)
+
+    def pack(self, value):
+        # Numbers are left alone, so that incr() still works
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, (bytes, str)) and len(value) < self.min_size:
+            return value
+        start = time.perf_counter()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) < self.min_size:
+            return value
+        compressed = self.compress(data)
+        elapsed = time.perf_counter() - start
+        if len(compressed) > len(data) * COMPRESS_MAX_RATIO:
+            self.count(incompressible=1, pack_time=elapsed)
+            return value
+        self.count(
+            packed=1, bytes_in=len(data), bytes_out=len(compressed), pack_time=elapsed
+        )
+        return Compressed(self.algorithm, compressed)
+
+    def unpack(self, value):
+        if not isinstance(value, Compressed):
+            return value
+        start = time.perf_counter()
+        if value.algorithm == "zstd":
+            data = zstandard.ZstdDecompressor().decompress(value.data)
+        else:
+            data = zlib.decompress(value.data)
+        value = pickle.loads(data)
+        self.count(unpacked=1, unpack_time=time.perf_counter() - start)
+        return value
+
+    def report(self):
+        """
+        Returns how many values were compressed, the overall compression ratio
+        (compressed size / original size), and the average milliseconds taken
+        to compress and decompress a value.
+        """
+        stats = self.stats
+        return {
+            "algorithm": self.algorithm,
+            "packed": stats["packed"],
+            "incompressible": stats["incompressible"],
+            "ratio": stats["bytes_out"] / stats["bytes_in"]
+            if stats["bytes_in"]
+            else 1.0,
+            "pack_ms": 1000 * stats["pack_time"] / (stats["packed"] or 1),
+            "unpack_ms": 1000 * stats["unpack_time"] / (stats["unpacked"] or 1),
+        }
+
+
+class LocalTier:
+    """
+    The in-process tier. Django creates cache backends per thread, so this is
+    shared between all the TwoTierCache instances with the same LOCATION.
+    """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        # The last change read from the change log, and one that's been
+        # counted but couldn't be read (yet)
+        self.seen = _missing
+        self.stuck = None
+        self.checked = 0
+        self.stats = collections.Counter()
+
+    @property
+    def writer(self):
+        """Identifies this tier's writes in the change log."""
+        # The pid too, since forked processes inherit the tier
+        return (os.getpid(), id(self))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.stats["local_hits"] += 1
+                value = entry[0]
+            else:
+                if entry is not None:
+                    del self.entries[key]
+                self.stats["local_misses"] += 1
+                return _missing
+        if isinstance(value, Pickled):
+            return pickle.loads(value.data)
+        return value
+
+    def set(self, key, value, timeout):
+        if timeout is not None and timeout <= 0:
+            return self.delete(key)
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        if not isinstance(value, IMMUTABLE):
+            value = Pickled(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            if self.entries:
+                self.entries.clear()
+                self.stats["flushes"] += 1
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+def clear_local_tiers():
+    """Empties every local tier in this process."""
+    with _local_tiers_lock:
+        tiers = list(_local_tiers.values())
+    for tier in tiers:
+        tier.clear()
+
+
+_codecs = {}
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED", "shared")
+        self.check_interval = options.get("CHECK_INTERVAL", 1)
+        with _local_tiers_lock:
+            if location not in _local_tiers:
+                _local_tiers[location] = LocalTier(
+                    options.get("LOCAL_MAX_ENTRIES", 1000),
+                    options.get("LOCAL_TIMEOUT", 60),
+                )
+                _codecs[location] = Codec(
+                    options.get("COMPRESS_MIN_SIZE", COMPRESS_MIN_SIZE),
+                    options.get("COMPRESS_ALGORITHM"),
+                )
+            self.local = _local_tiers[location]
+            self.codec = _codecs[location]
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias]
+
+    def local_key(self, key, version):
+        return self.make_key(key, version)
+
+    def check_changes(self):
+        """Evicts the keys other processes have written since we last looked."""
+        local = self.local
+        now = time.monotonic()
+        if now - local.checked < self.check_interval:
+            return
+        local.checked = now
+        latest = self.shared.get(CHANGES_KEY)
+        seen = local.seen
+        if latest == seen:
+            return
+        if not (
+            isinstance(latest, int)
+            and isinstance(seen, int)
+            and 0 < latest - seen <= MAX_CHANGES
+        ):
+            # Our first look, the counter was lost, or we're too far behind
+            local.clear()
+            local.seen = latest
+            return
+        numbers = range(seen + 1, latest + 1)
+        changes = self.shared.get_many([CHANGE_KEY % n for n in numbers])
+        for n in numbers:
+            change = changes.get(CHANGE_KEY % n)
+            if change is None and local.stuck != n:
+                # Counted, but maybe not recorded yet: look again next time
+                local.stuck = n
+                break
+            if change is None:
+                # Never recorded, or expired: there's no telling what changed
+                local.clear()
+                seen = latest
+                break
+            writer, key = change
+            if writer != local.writer:
+                local.delete(key)
+                local.count("remote_changes")
+            seen = n
+        local.seen = seen
+
+    def changed(self, key, version):
+        """Tells every process that `key` has changed."""
+        self.check_changes()
+        local_key = self.local_key(key, version)
+        self.local.delete(local_key)
+        try:
+            n = self.shared.incr(CHANGES_KEY)
+        except ValueError:
+            # Nobody else can tell what changed before this, so they'll empty
+            # their local tiers: see check_changes()
+            self.local.clear()
+            self.local.seen = int(time.time() * 1000)
+            self.shared.set(CHANGES_KEY, self.local.seen, None)
+            return
+        self.shared.set(CHANGE_KEY % n, (self.local.writer, local_key), CHANGE_TIMEOUT)
+        # Our own writes don't need reading back -- unless someone else has
+        # written since we last looked
+        if n - 1 == self.local.seen:
+            self.local.seen = n
+
+    def invalidate_local(self):
+        self.local.clear()
+
+    def backend_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            return self.shared.default_timeout
+        return timeout
+
+    def set_expires(self, key, timeout, version):
+        """Records when `key` expires, for other processes' local tiers."""
+        if timeout is not None:
+            self.shared.set(
+                EXPIRES_PREFIX + key, time.time() + timeout, timeout, version=version
+            )
+
+    def keep(self, key, value, expires, version):
+        """Keeps a value read from the shared cache in the local tier."""
+        timeout = self.local.timeout if expires is None else expires - time.time()
+        self.local.set(self.local_key(key, version), value, timeout)
+
+    def get(self, key, default=None, version=None):
+        self.check_changes()
+        value = self.local.get(self.local_key(key, version))
+        if value is not _missing:
+            return value
+        found = self.shared.get_many([key, EXPIRES_PREFIX + key], version=version)
+        if key not in found:
+            self.local.count("shared_misses")
+            return default
+        self.local.count("shared_hits")
+        value = self.codec.unpack(found[key])
+        self.keep(key, value, found.get(EXPIRES_PREFIX + key), version)
+        return value
+
+    def get_many(self, keys, version=None):
+        self.check_changes()
+        found = {}
+        for key in keys:
+            value = self.local.get(self.local_key(key, version))
+            if value is not _missing:
+                found[key] = value
+        rest = [key for key in keys if key not in found]
+        if rest:
+            shared = self.shared.get_many(
+                rest + [EXPIRES_PREFIX + key for key in rest], version=version
+            )
+            hits = 0
+            for key in rest:
+                if key in shared:
+                    found[key] = self.codec.unpack(shared[key])
+                    self.keep(
+                        key, found[key], shared.get(EXPIRES_PREFIX + key), version
+                    )
+                    hits += 1
+            self.local.count("shared_hits", hits)
+            self.local.count("shared_misses", len(rest) - hits)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.backend_timeout(timeout)
+        self.shared.set(key, self.codec.pack(value), timeout, version=version)
+        self.set_expires(key, timeout, version)
+        self.changed(key, version)
+        self.local.set(self.local_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout, version)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Always decided by the shared cache, since it must be atomic
+        timeout = self.backend_timeout(timeout)
+        added = self.shared.add(key, self.codec.pack(value), timeout, version=version)
+        if added:
+            self.set_expires(key, timeout, version)
+            self.changed(key, version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.backend_timeout(timeout)
+        touched = self.shared.touch(key, timeout, version=version)
+        if touched:
+            self.set_expires(key, timeout, version)
+            self.changed(key, version)
+        return touched
+
+    def delete(self, key, version=None):
+        self.shared.delete_many([key, EXPIRES_PREFIX + key], version=version)
+        self.changed(key, version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self.changed(key, version)
+        return value
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def clear(self):
+        self.shared.clear()
+        self.local.clear()
+
+    def hit_ratios(self):
+        """Returns the fraction of reads answered by each tier."""
+        stats = self.local.stats
+        local = stats["local_hits"] + stats["local_misses"]
+        shared = stats["shared_hits"] + stats["shared_misses"]
+        return {
+            "local": stats["local_hits"] / local if local else 0.0,
+            "shared": stats["shared_hits"] / shared if shared else 0.0,
+        }
+
+    def compression_stats(self):
+        return self.codec.report()
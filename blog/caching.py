@@ -0,0 +1,132 @@
+import threading
+import time
+from django.core.cache import cache
+
+CONTENT_VERSION_KEY = "content-version"
+
+
+def content_version():
+    """
+    Returns the current content version: the timestamp of the last change to
+    any blog content. Anything derived from content (feeds, rendered pages) can
+    be cached under a key including this version, and will be naturally
+    invalidated when something changes.
+    """
+    return cache.get_or_set(CONTENT_VERSION_KEY, time.time, None)
+
+
+def bump_content_version():
+    cache.set(CONTENT_VERSION_KEY, time.time(), None)
+
+
+# How long a thread recomputing a value may hold its lock, and so how long
+# anyone else waits for a value that isn't in the cache at all.
+LOCK_TIMEOUT = 30
+
+_missing = object()
+
+
+class StaleWhileRevalidate:
+    """
+    Read-through caching that serves stale values while exactly one thread
+    recomputes them, rather than letting every thread that sees an expired key
+    regenerate it at once.
+
+    Values are stored with a soft timeout (how long they're fresh) and a hard
+    one (how long the cache keeps them at all), and optionally a version:
+    a value with the wrong version is stale, like an expired one. Whoever finds
+    a stale value first takes the key's lock and recomputes it; meanwhile
+    everyone else gets the stale value. Only if there's no value at all do
+    other threads wait, for the lock holder to finish.
+
+    Locks are per key, held both in-process (so threads in this process don't
+    hammer the cache) and in the cache itself with add() (so other processes
+    see them too).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "computed": 0, "waits": 0}
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def acquire(self, key):
+        lock = self.key_lock(key)
+        if not lock.acquire(blocking=False):
+            return False
+        if not cache.add("lock:" + key, 1, LOCK_TIMEOUT):
+            lock.release()
+            return False
+        return True
+
+    def release(self, key):
+        cache.delete("lock:" + key)
+        self.key_lock(key).release()
+
+    def compute(self, key, compute, soft_timeout, hard_timeout, version):
+        self.count("computed")
+        value = compute()
+        entry = (value, time.time() + soft_timeout, version)
+        cache.set(key, entry, hard_timeout)
+        return value
+
+    def get(self, key, compute, soft_timeout, hard_timeout, version=None):
+        key = "swr:" + key
+        entry = cache.get(key)
+        if entry is not None:
+            value, fresh_until, entry_version = entry
+            if time.time() < fresh_until and entry_version == version:
+                self.count("hits")
+                return value
+            self.count("stale")
+            if self.acquire(key):
+                try:
+                    return self.compute(
+                        key, compute, soft_timeout, hard_timeout, version
+                    )
+                finally:
+                    self.release(key)
+            return value
+
+        self.count("misses")
+        deadline = time.time() + LOCK_TIMEOUT
+        while time.time() < deadline:
+            if self.acquire(key):
+                try:
+                    return self.compute(
+                        key, compute, soft_timeout, hard_timeout, version
+                    )
+                finally:
+                    self.release(key)
+            # Someone else is computing it: wait for them to finish -- on the
+            # key's lock if they're in this process, or by polling if not.
+            self.count("waits")
+            lock = self.key_lock(key)
+            if lock.acquire(timeout=LOCK_TIMEOUT):
+                lock.release()
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+            time.sleep(0.05)
+        # Whoever held the lock must have died; do it ourselves
+        return self.compute(key, compute, soft_timeout, hard_timeout, version)
+
+
+swr = StaleWhileRevalidate()
+
+
+def cached(key, compute, soft_timeout, hard_timeout=24 * 60 * 60, version=None):
+    """
+    Returns the cached value for `key`, calling compute() for a new one when
+    it's missing, older than `soft_timeout` seconds, or from another `version`
+    -- with a single thread recomputing at a time, and stale values served in
+    the meantime; see StaleWhileRevalidate.
+    """
+    return swr.get(key, compute, soft_timeout, hard_timeout, version)
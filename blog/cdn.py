@@ -0,0 +1,75 @@
+"""
+Purging Cloudflare's cache of pages affected by content changes.
+
+Saving (or deleting, or retagging) content queues the URLs it appears on --
+see blog.dependencies -- and once the transaction commits they're purged from
+Cloudflare, at most PURGE_BATCH_SIZE URLs per API call (Cloudflare's limit),
+in a worker thread so that saves never wait on the API. Nothing is purged
+unless CLOUDFLARE_ZONE_ID is set.
+"""
+
+import logging
+import CloudFlare
+from django.conf import settings
+from blog.commit_queue import CommitQueue
+
+log = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 30
+
+
+def cloudflare():
+    return CloudFlare.CloudFlare(
+        email=settings.CLOUDFLARE_EMAIL,
+        token=settings.CLOUDFLARE_TOKEN,
+        base_url=settings.CLOUDFLARE_API_URL,
+    )
+
+
+def purge_everything():
+    cloudflare().zones.purge_cache.post(
+        settings.CLOUDFLARE_ZONE_ID, data={"purge_everything": True}
+    )
+
+
+def purge_urls(paths, batch_size=PURGE_BATCH_SIZE):
+    """
+    Purges the given paths (e.g. "/2019/mar/4/") on SITE_URL from Cloudflare.
+    Returns the number of API calls made.
+    """
+    urls = sorted(settings.SITE_URL + path for path in set(paths))
+    cf = cloudflare()
+    for i in range(0, len(urls), batch_size):
+        cf.zones.purge_cache.post(
+            settings.CLOUDFLARE_ZONE_ID, data={"files": urls[i : i + batch_size]}
+        )
+    return (len(urls) + batch_size - 1) // batch_size
+
+
+class PurgeQueue(CommitQueue):
+    """
+    URLs waiting to be purged once the transaction that changed them commits.
+    The purge runs in a worker thread unless CLOUDFLARE_PURGE_IN_BACKGROUND
+    is off.
+    """
+
+    title = "Cloudflare purge queue"
+    thread_name = "cloudflare-purge"
+    background_setting = "CLOUDFLARE_PURGE_IN_BACKGROUND"
+    initial_stats = {"purged": 0, "requests": 0}
+
+    @property
+    def enabled(self):
+        return bool(settings.CLOUDFLARE_ZONE_ID)
+
+    def add(self, urls):
+        if self.enabled:
+            self.enqueue(urls)
+
+    def process(self, urls):
+        requests = purge_urls(urls)
+        self.count(purged=len(urls), requests=requests)
+        log.info("purged %d URLs in %d requests", len(urls), requests)
+
+
+purge_queue = PurgeQueue()
@@ -0,0 +1,113 @@
+"""
+Coalescing of identical concurrent requests.
+
+Crawlers and feed readers often send the same expensive request several times
+within a few milliseconds. RequestCoalescingMiddleware lets the first of a set
+of identical anonymous GETs (the leader) run the view, and has the rest (the
+followers) wait for the leader's response and get a copy of it, rather than
+each running the view again. Only paths under REQUEST_COALESCING_PATHS are
+coalesced, and only within a process.
+
+Requests are identical if they have the same host, scheme, path, query (with
+parameters in any order) and conditional headers -- and, for feed readers that
+report subscriber counts (see feedstats), the same user agent, so that every
+count still gets recorded.
+"""
+
+import threading
+import urllib.parse
+from django.conf import settings
+from django.http import HttpResponse
+from blog import metrics
+from feedstats.utils import subscribers_re
+
+
+class InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        # (status, headers, content), if the leader's response can be shared
+        self.response = None
+
+
+class RequestCoalescingMiddleware:
+    """
+    See the module docstring. Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.stats = metrics.register(
+            "Request coalescing",
+            {"leaders": 0, "coalesced": 0, "timeouts": 0, "not_shared": 0},
+        )
+
+    def __call__(self, request):
+        key = self.key(request)
+        if key is None:
+            return self.get_response(request)
+
+        with self.lock:
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = InFlight()
+                self.stats["leaders"] += 1
+
+        if not leader:
+            if flight.done.wait(settings.REQUEST_COALESCING_TIMEOUT):
+                if flight.response is not None:
+                    self.count("coalesced")
+                    return self.copy(flight.response)
+                self.count("not_shared")
+            else:
+                self.count("timeouts")
+            # No response to share, so run the view after all
+            return self.get_response(request)
+
+        try:
+            response = self.get_response(request)
+            if self.shareable(response):
+                flight.response = (
+                    response.status_code,
+                    list(response.items()),
+                    response.content,
+                )
+            return response
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            flight.done.set()
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def key(self, request):
+        """Returns the key identical requests share, or None for no coalescing."""
+        if request.method != "GET" or request.user.is_authenticated:
+            return None
+        if not request.path.startswith(tuple(settings.REQUEST_COALESCING_PATHS)):
+            return None
+        user_agent = request.META.get("HTTP_USER_AGENT", "")
+        return (
+            request.scheme,
+            request.get_host(),
+            request.path,
+            urllib.parse.urlencode(sorted(request.GET.lists()), doseq=True),
+            request.META.get("HTTP_IF_NONE_MATCH"),
+            request.META.get("HTTP_IF_MODIFIED_SINCE"),
+            user_agent if subscribers_re.search(user_agent) else None,
+        )
+
+    def shareable(self, response):
+        return not response.streaming and not response.cookies
+
+    def copy(self, shared):
+        status, headers, content = shared
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        response["X-Coalesced"] = "1"
+        return response
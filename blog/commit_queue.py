@@ -0,0 +1,104 @@
+"""
+Work that's queued while a transaction is open, and done in batches once it
+commits: search reindexing (blog.search), Cloudflare purges (blog.cdn) and
+oEmbed fetches (speaking_portfolio.oembed).
+
+A CommitQueue collects what add() is given into a pending batch, and asks for
+a flush when the transaction commits. Transactions are per-thread, so pending
+batches are too: a flush only ever picks up work from the transaction that
+just committed. The flush does the work straight away, or -- if the queue's
+`background_setting` is on -- hands the batch to a worker thread, which folds
+together whatever batches are waiting when it gets to them, so that it does
+fewer, bigger batches when it's falling behind.
+
+Each queue's counters are shown on the tools page (see blog.metrics), along
+with how many batches failed in the worker thread.
+"""
+
+import logging
+import queue
+import threading
+from django.conf import settings
+from django.db import connection, transaction
+from blog import metrics
+
+
+class CommitQueue:
+    """
+    Subclasses set `title` (for the tools page), `thread_name`, the
+    `background_setting` that moves the work to a worker thread (and its
+    `background_default`), and the counters they keep in `initial_stats`.
+    They do the work in process(batch). Batches are sets, unless new_batch()
+    and merge() say otherwise.
+    """
+
+    title = None
+    thread_name = None
+    background_setting = None
+    background_default = True
+    initial_stats = {}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.work = queue.Queue()
+        self.worker = None
+        self.log = logging.getLogger(type(self).__module__)
+        self.stats = metrics.register(self.title, dict(self.initial_stats, failures=0))
+
+    def new_batch(self):
+        return set()
+
+    def merge(self, batch, other):
+        """Adds the work in `other` to `batch`."""
+        batch.update(other)
+
+    @property
+    def pending(self):
+        if not hasattr(self.local, "pending"):
+            self.local.pending = self.new_batch()
+        return self.local.pending
+
+    def enqueue(self, batch):
+        """Adds `batch` to the work to do once the transaction commits."""
+        self.merge(self.pending, batch)
+        transaction.on_commit(self.flush)
+
+    def count(self, **stats):
+        with self.lock:
+            for stat, n in stats.items():
+                self.stats[stat] += n
+
+    def flush(self):
+        batch, self.local.pending = self.pending, self.new_batch()
+        if not batch:
+            return
+        if getattr(settings, self.background_setting, self.background_default):
+            self.start()
+            self.work.put(batch)
+        else:
+            self.process(batch)
+
+    def process(self, batch):
+        raise NotImplementedError
+
+    def start(self):
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(
+                    target=self.run, name=self.thread_name, daemon=True
+                )
+                self.worker.start()
+
+    def run(self):
+        while True:
+            batch = self.work.get()
+            while not self.work.empty():
+                self.merge(batch, self.work.get())
+            try:
+                self.process(batch)
+            except Exception:
+                self.count(failures=1)
+                self.log.exception("%s failed", self.thread_name)
+            finally:
+                connection.close()
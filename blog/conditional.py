@@ -0,0 +1,104 @@
+"""
+Conditional GETs (If-None-Match, If-Modified-Since) for content pages.
+
+Archive, permalink and tag views are wrapped with content_condition(), given a
+function from the view's arguments to the lookups selecting the objects the
+page shows: a date range, a date and slug, some tags. Before the view runs,
+one query finds how many of those objects there are and when the newest of
+them last changed (BaseModel.updated, which blog.signals also moves on when an
+object's tags change). That, the list of years every page links to, and the
+deployed release make the ETag, and a matching If-None-Match gets a 304
+without running the view at all.
+
+An entry's permalink lists every entry in its series, so with `series` those
+count too (and blog.signals moves on their `updated` when the series itself
+changes).
+
+The count is what catches deletions, which don't change anyone's `updated`.
+Last-Modified can't, so it's only sent for permalinks, where a deleted object
+means a 404 anyway. Pages that can change with any content at all -- search
+results, the tag index -- use the content version (see blog.caching) for both
+validators instead.
+"""
+
+import datetime
+import hashlib
+import os
+from django.db.models import Count, IntegerField, Max, Value
+from django.utils.timezone import utc
+from django.views.decorators.http import condition
+from blog.caching import content_version
+from blog.context_processors import years_with_content
+from blog.models import Blogmark, Entry, Quotation
+
+RELEASE = os.environ.get("HEROKU_SLUG_COMMIT", "")
+
+CONTENT_MODELS = [Entry, Blogmark, Quotation]
+
+
+def content_state(lookups, series=False):
+    """
+    Returns the number of objects matching `lookups`, and when the newest of
+    them was last updated (None if there aren't any), in one query. With
+    `series`, entries in the same series as a matching entry count too.
+    """
+    querysets = [model.objects.filter(**lookups) for model in CONTENT_MODELS]
+    if series:
+        querysets.append(
+            Entry.objects.filter(
+                **{"series__entries__" + key: value for key, value in lookups.items()}
+            )
+        )
+    parts = [
+        queryset.order_by()
+        .annotate(one=Value(1, output_field=IntegerField()))
+        .values("one")
+        .annotate(n=Count("pk", distinct=True), newest=Max("updated"))
+        .values_list("n", "newest")
+        for queryset in querysets
+    ]
+    rows = list(parts[0].union(*parts[1:], all=True))
+    updated = [newest for _, newest in rows if newest is not None]
+    return sum(n for n, _ in rows), max(updated, default=None)
+
+
+def make_etag(*state):
+    state = (RELEASE, years_with_content()) + state
+    return hashlib.md5(repr(state).encode("utf8")).hexdigest()
+
+
+def content_condition(lookups, last_modified=False, series=False):
+    """
+    Decorator: answers conditional requests for a view showing the objects
+    selected by `lookups(*args, **kwargs)`, given the view's arguments. With
+    `last_modified`, sends Last-Modified too; with `series`, the page shows
+    the other entries in an entry's series as well.
+    """
+
+    def state(request, *args, **kwargs):
+        # Computed once, for both validators
+        if not hasattr(request, "content_state"):
+            request.content_state = content_state(lookups(*args, **kwargs), series)
+        return request.content_state
+
+    def etag(request, *args, **kwargs):
+        return make_etag(*state(request, *args, **kwargs))
+
+    def newest(request, *args, **kwargs):
+        return state(request, *args, **kwargs)[1]
+
+    return condition(
+        etag_func=etag, last_modified_func=newest if last_modified else None
+    )
+
+
+def content_version_condition():
+    """Decorator: answers conditional requests by the content version."""
+
+    def etag(request, *args, **kwargs):
+        return make_etag(content_version())
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.datetime.fromtimestamp(content_version(), utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
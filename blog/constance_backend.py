@@ -0,0 +1,67 @@
+"""
+A constance backend that reads from an in-process snapshot of every setting.
+
+constance's DatabaseBackend looks each key up separately -- a query (or a
+cache round-trip) per key, per request. SnapshotBackend loads every key with
+one query instead, and answers reads from that snapshot. Changes move on a
+version in the cache once they commit; each process checks it at most every
+CHECK_INTERVAL seconds, and reloads when it's moved. Changes are also
+announced on the invalidation bus (see blog.invalidation), so listening
+processes reload at once.
+
+    CONSTANCE_BACKEND = "blog.constance_backend.SnapshotBackend"
+"""
+
+import threading
+import time
+from constance import settings as constance_settings
+from constance.backends.database import DatabaseBackend
+from django.core.cache import cache
+from django.db import transaction
+from blog import invalidation
+
+VERSION_KEY = "constance-version"
+CHECK_INTERVAL = 1
+
+
+class SnapshotBackend(DatabaseBackend):
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.version = None
+        self.checked = 0
+        self.stats = {"loads": 0}
+        invalidation.register(self.on_invalidation)
+
+    def get(self, key):
+        return self.load().get(key)
+
+    def load(self):
+        now = time.monotonic()
+        snapshot = self.snapshot
+        if snapshot is not None and now - self.checked < CHECK_INTERVAL:
+            return snapshot
+        version = cache.get_or_set(VERSION_KEY, time.time, None)
+        with self.lock:
+            if self.snapshot is None or version != self.version:
+                # One query for every key
+                self.snapshot = dict(self.mget(constance_settings.CONFIG))
+                self.version = version
+                self.stats["loads"] += 1
+            self.checked = now
+            return self.snapshot
+
+    def clear(self, sender, instance, created, **kwargs):
+        # Called whenever a setting is saved
+        super().clear(sender, instance, created, **kwargs)
+        self.snapshot = None
+        transaction.on_commit(lambda: cache.set(VERSION_KEY, time.time(), None))
+        invalidation.notify(instance, "save")
+
+    def on_invalidation(self, event):
+        if (
+            event.get("kind") == "reset"
+            or event.get("model") == self._model._meta.label_lower
+        ):
+            self.snapshot = None
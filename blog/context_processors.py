@@ -1,6 +1,6 @@
 from blog.models import Entry, Blogmark, Quotation
 from django.conf import settings
-from django.core.cache import cache
+from blog.caching import cached, content_version
 
 
 def all(request):
@@ -11,16 +11,18 @@ def all(request):
 
 
 def years_with_content():
-    cache_key = "years-with-content"
-    years = cache.get(cache_key)
-    if not years:
-        years = list(
-            set(
-                list(Entry.objects.datetimes("created", "year"))
-                + list(Blogmark.objects.datetimes("created", "year"))
-                + list(Quotation.objects.datetimes("created", "year"))
-            )
+    return cached(
+        "years-with-content", content_years, 60 * 60, version=content_version()
+    )
+
+
+def content_years():
+    years = list(
+        set(
+            list(Entry.objects.datetimes("created", "year"))
+            + list(Blogmark.objects.datetimes("created", "year"))
+            + list(Quotation.objects.datetimes("created", "year"))
         )
-        years.sort()
-        cache.set(cache_key, years, 24 * 60 * 60)
+    )
+    years.sort()
     return years
@@ -0,0 +1,112 @@
+"""
+Which public URLs depend on which objects.
+
+Every object that appears on the public site -- entries, blogmarks and
+quotations, and speaking presentations -- maps to the URLs whose output
+includes it: its own page, the homepage, the date archives and tag pages it's
+listed on, feeds, sitemaps, and so on. build_static uses this to re-render
+only the pages affected by a change, and anything else that needs to know what
+a change touched (cache purges, say) can use it too.
+
+fingerprints() summarises the current state of every object as an md5 of its
+row (and its tags, or its coverage and conference), computed in the database,
+so that changes can be found without loading any objects.
+"""
+
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+
+# Pages that list content, but aren't tied to particular objects, or that
+# depend on the time as well as content; these are always rendered.
+ALWAYS = ["/", "/speaking/"]
+
+FEEDS = {
+    "entry": ["/atom/entries/", "/atom/everything/"],
+    "blogmark": ["/atom/links/", "/atom/everything/"],
+    "quotation": ["/atom/everything/"],
+}
+
+ITEM_FINGERPRINT_SQL = """
+    SELECT t.id, t.created, t.slug,
+           md5(t::text || COALESCE(tags.names, '')),
+           COALESCE(tags.names, '')
+      FROM blog_%(type)s t
+      LEFT JOIN (
+          SELECT x.%(type)s_id AS id, string_agg(tag.tag, ' ' ORDER BY tag.tag) AS names
+            FROM blog_%(type)s_tags x JOIN blog_tag tag ON tag.id = x.tag_id
+           GROUP BY x.%(type)s_id
+      ) tags ON tags.id = t.id
+"""
+
+PRESENTATION_FINGERPRINT_SQL = """
+    SELECT p.id, p.slug, md5(p::text || c::text || COALESCE(cov.rows, ''))
+      FROM speaking_portfolio_presentation p
+      JOIN speaking_portfolio_conference c ON c.id = p.conference_id
+      LEFT JOIN (
+          SELECT presentation_id AS id, string_agg(cov::text, '' ORDER BY cov.id) AS rows
+            FROM speaking_portfolio_coverage cov
+           GROUP BY presentation_id
+      ) cov ON cov.id = p.id
+"""
+
+
+def item_urls(type_name, created, slug, tags):
+    """
+    Returns the URLs that an entry, blogmark or quotation appears on, given
+    its type, creation time, slug, and tag names.
+    """
+    d = timezone.localdate(created)
+    urls = [
+        "/",
+        reverse("blog_archive_item", args=[d.year, d.month, d.day, slug]),
+        reverse("blog_archive_day", args=[d.year, d.month, d.day]),
+        reverse("blog_archive_month", args=[d.year, d.month]),
+        reverse("blog_archive_year", args=[d.year]),
+        "/tags/",
+        "/sitemap.xml",
+        reverse("sitemap_section", args=[type_name, d.year]),
+    ]
+    urls.extend(reverse("tag_detail", args=[tag]) for tag in tags)
+    urls.extend(FEEDS[type_name])
+    if type_name == "entry":
+        urls.append(reverse("entry_archive"))
+    return urls
+
+
+def presentation_urls(slug):
+    return [reverse("speaking_portfolio_detail", args=[slug]), "/speaking/", "/"]
+
+
+def urls_for_object(obj):
+    """Returns the URLs that a model instance appears on."""
+    if obj._meta.label == "speaking_portfolio.Presentation":
+        return presentation_urls(obj.slug)
+    if obj._meta.label == "speaking_portfolio.Coverage":
+        return presentation_urls(obj.presentation.slug)
+    return item_urls(
+        obj._meta.model_name,
+        obj.created,
+        obj.slug,
+        [t.tag for t in obj.tags.all()],
+    )
+
+
+def fingerprints():
+    """
+    Returns {key: (fingerprint, urls)} for every public object, where key is
+    "<type>:<pk>" and urls are the URLs it currently appears on.
+    """
+    result = {}
+    with connection.cursor() as cursor:
+        for type_name in ("entry", "blogmark", "quotation"):
+            cursor.execute(ITEM_FINGERPRINT_SQL % {"type": type_name})
+            for pk, created, slug, fingerprint, tags in cursor:
+                result["%s:%d" % (type_name, pk)] = (
+                    fingerprint,
+                    item_urls(type_name, created, slug, tags.split()),
+                )
+        cursor.execute(PRESENTATION_FINGERPRINT_SQL)
+        for pk, slug, fingerprint in cursor:
+            result["presentation:%d" % pk] = (fingerprint, presentation_urls(slug))
+    return result
@@ -0,0 +1,72 @@
+"""
+A local stand-in for Cloudflare's purge_cache API, for testing blog.cdn
+without a network or a Cloudflare account:
+
+    with FakeCloudflare() as cloudflare:
+        with override_settings(CLOUDFLARE_API_URL=cloudflare.url, ...):
+            purge_urls(["/"])
+        assert cloudflare.purged == ["https://jacobian.org/"]
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeCloudflare:
+    def __init__(self):
+        # (zone id, request body) for every purge request
+        self.requests = []
+        self.server = None
+
+    @property
+    def purged(self):
+        """Every URL purged so far, in order."""
+        return [url for _, data in self.requests for url in data.get("files", [])]
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                parts = self.path.strip("/").split("/")
+                data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if parts[-3] != "zones" or parts[-1] != "purge_cache":
+                    return self.send_error(404)
+                if len(data.get("files", [])) > 30:
+                    return self.send_error(400)
+                fake.requests.append((parts[-2], data))
+                body = json.dumps(
+                    {
+                        "success": True,
+                        "errors": [],
+                        "messages": [],
+                        "result": {"id": parts[-2]},
+                    }
+                ).encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/client/v4" % self.server.server_address[1]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
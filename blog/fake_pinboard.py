@@ -0,0 +1,106 @@
+"""
+A local stand-in for the Pinboard API, for testing and benchmarking
+blog.pinboard_sync without a network or a Pinboard account:
+
+    with FakePinboard() as pinboard:
+        pinboard.add("https://example.com/", "Example", tags=["example"])
+        sync(PinboardClient(base_url=pinboard.url))
+"""
+
+import hashlib
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.utils import timezone
+
+
+class FakePinboard:
+    def __init__(self):
+        self.posts = {}
+        self.update_time = timezone.now()
+        self.requests = []
+        self.server = None
+
+    def touch(self):
+        # Pinboard's update time has one-second resolution
+        self.update_time = max(
+            timezone.now(), self.update_time + timezone.timedelta(seconds=1)
+        )
+
+    def add(self, url, description, extended="", tags=(), shared=True, time=None):
+        """Adds (or replaces) a bookmark, and returns its url hash."""
+        url_hash = hashlib.md5(url.encode("utf8")).hexdigest()
+        self.posts[url_hash] = {
+            "href": url,
+            "description": description,
+            "extended": extended,
+            "hash": url_hash,
+            "time": (time or timezone.now()).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "shared": "yes" if shared else "no",
+            "toread": "no",
+            "tags": " ".join(tags),
+        }
+        self.edit(url_hash)
+        return url_hash
+
+    def edit(self, url_hash, **changes):
+        post = self.posts[url_hash]
+        post.update(changes)
+        post.pop("meta", None)
+        post["meta"] = hashlib.md5(
+            json.dumps(post, sort_keys=True).encode("utf8")
+        ).hexdigest()
+        self.touch()
+
+    def delete(self, url_hash):
+        del self.posts[url_hash]
+        self.touch()
+
+    def respond(self, path, params):
+        self.requests.append(path)
+        if path.endswith("/posts/update"):
+            return {"update_time": self.update_time.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        elif path.endswith("/posts/all"):
+            return list(self.posts.values())
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                params = urllib.parse.parse_qs(url.query)
+                body = fake.respond(url.path, params)
+                if not params.get("auth_token"):
+                    self.send_error(401)
+                elif body is None:
+                    self.send_error(404)
+                else:
+                    data = json.dumps(body).encode("utf8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/v1/" % self.server.server_address[1]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,20 +1,62 @@
+import gzip
 from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django.utils.feedgenerator import Atom1Feed
-from django.http import HttpResponse
-from blog.models import Entry, Blogmark, Quotation
+from django.utils.http import http_date, quote_etag
+from django.db.models import Max
+from django.db.models.functions import ExtractYear
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.timezone import localdate
+from blog.models import Entry, Blogmark, Quotation, recent_item_dicts, recent_items
+from blog.caching import cached, content_version
 
 
 class Base(Feed):
     feed_type = Atom1Feed
     link = "/"
     author_name = "Jacob Kaplan-Moss"
+    num_items = 15
 
     def __call__(self, request, *args, **kwargs):
-        response = super(Base, self).__call__(request, *args, **kwargs)
+        # Feed readers poll constantly, so answer conditional requests without
+        # generating anything. Validators come from the newest item and the
+        # content version (which changes on any edit), and the serialized feed
+        # is cached until the next content change.
+        version = content_version()
+        newest = recent_item_dicts(1, self.item_models)
+        last_modified = max([version] + [d["created"].timestamp() for d in newest])
+        etag = quote_etag("%s-%d" % (self.ga_source, last_modified * 1000))
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified)
+        )
+        if response is None:
+            # After a change, one thread regenerates the feed while the rest
+            # serve the previous one -- with that one's validators, so that
+            # readers come back for the new one.
+            content, last_modified = cached(
+                "feed:%s:%s" % (self.ga_source, request.scheme),
+                lambda: (
+                    super(Base, self).__call__(request, *args, **kwargs).content,
+                    last_modified,
+                ),
+                24 * 60 * 60,
+                version=last_modified,
+            )
+            etag = quote_etag("%s-%d" % (self.ga_source, last_modified * 1000))
+            response = HttpResponse(content, content_type=self.feed_type.content_type)
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
         # Tell CloudFlare to cache my feeds for 2 minutes
         response["Cache-Control"] = "s-maxage=%d" % (2 * 60)
         return response
 
+    def items(self):
+        return recent_items(self.num_items, self.item_models)
+
     def item_link(self, item):
         return item.get_absolute_url() + "#atom-%s" % self.ga_source
 
@@ -31,9 +73,7 @@ class Base(Feed):
 class Entries(Base):
     title = "Jacob Kaplan-Moss: Writing"
     ga_source = "entries"
-
-    def items(self):
-        return Entry.objects.prefetch_related("tags").order_by("-created")[:15]
+    item_models = (Entry,)
 
     def item_title(self, item):
         return item.title
@@ -46,9 +86,7 @@ class Blogmarks(Base):
     title = "Jacob Kaplan-Moss: Blogmarks"
     description_template = "feeds/blogmark.html"
     ga_source = "blogmarks"
-
-    def items(self):
-        return Blogmark.objects.prefetch_related("tags").order_by("-created")[:15]
+    item_models = (Blogmark,)
 
     def item_title(self, item):
         return item.link_title
@@ -58,22 +96,8 @@ class Everything(Base):
     title = "Jacob Kaplan-Moss"
     description_template = "feeds/everything.html"
     ga_source = "everything"
-
-    def items(self):
-        # Pretty dumb implementation: pull top 30 of entries/blogmarks/quotations
-        # then sort them together and return most recent 30 combined
-        last_30_entries = list(
-            Entry.objects.prefetch_related("tags").order_by("-created")[:30]
-        )
-        last_30_blogmarks = list(
-            Blogmark.objects.prefetch_related("tags").order_by("-created")[:30]
-        )
-        last_30_quotations = list(
-            Quotation.objects.prefetch_related("tags").order_by("-created")[:30]
-        )
-        combined = last_30_blogmarks + last_30_entries + last_30_quotations
-        combined.sort(key=lambda e: e.created, reverse=True)
-        return combined[:30]
+    item_models = (Entry, Blogmark, Quotation)
+    num_items = 30
 
     def item_title(self, item):
         if isinstance(item, Entry):
@@ -84,14 +108,150 @@ class Everything(Base):
             return "Quoting %s" % item.source
 
 
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+SITEMAP_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+SITEMAP_SECTIONS = {"entry": Entry, "blogmark": Blogmark, "quotation": Quotation}
+
+
 def sitemap(request):
-    xml = [
-        '<?xml version="1.0" encoding="UTF-8"?>'
-        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
-    ]
-    for klass in (Entry, Blogmark, Quotation):
-        for obj in klass.objects.only("slug", "created"):
-            url = request.build_absolute_uri(obj.get_absolute_url())
-            xml.append(f"<url><loc>{url}</loc></url>")
-    xml.append("</urlset>")
-    return HttpResponse("\n".join(xml), content_type="application/xml")
+    """
+    Sitemap index, pointing at one child sitemap per content type per year.
+    """
+    cache_key = "sitemap-index:%s:%s" % (
+        request.build_absolute_uri("/"),
+        content_version(),
+    )
+    xml = cache.get(cache_key)
+    if xml is None:
+        xml = [
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<sitemapindex xmlns="%s">' % SITEMAP_NS
+        ]
+        for section, klass in SITEMAP_SECTIONS.items():
+            years = (
+                klass.objects.annotate(year=ExtractYear("created"))
+                .values("year")
+                .annotate(latest=Max("created"))
+                .order_by("year")
+            )
+            for row in years:
+                url = request.build_absolute_uri(
+                    reverse("sitemap_section", args=[section, row["year"]])
+                )
+                lastmod = localdate(row["latest"]).isoformat()
+                xml.append(
+                    f"<sitemap><loc>{url}</loc><lastmod>{lastmod}</lastmod></sitemap>"
+                )
+        xml.append("</sitemapindex>")
+        xml = "\n".join(xml)
+        cache.set(cache_key, xml, 24 * 60 * 60)
+    return HttpResponse(xml, content_type="application/xml")
+
+
+def sitemap_section(request, section, year, gzipped=False):
+    """
+    Child sitemap listing every item of one type from one year.
+
+    Past years hardly ever change, so they're cached (here and downstream) for
+    a long time, independent of the content version. The current year is cached
+    until the next content change.
+    """
+    klass = SITEMAP_SECTIONS.get(section)
+    if klass is None:
+        raise Http404
+    is_past = year < localdate().year
+    cache_key = "sitemap:%s:%s:%d" % (request.build_absolute_uri("/"), section, year)
+    if not is_past:
+        cache_key += ":%s" % content_version()
+
+    if is_past:
+        cache_control = "public, max-age=%d, immutable" % SITEMAP_CACHE_TIMEOUT
+    else:
+        cache_control = "s-maxage=%d" % (60 * 60)
+
+    accepts_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    compressed = cache.get(cache_key + ":gz") if accepts_gzip else None
+    if gzipped:
+        response = HttpResponse(
+            _sitemap_section_gzipped(request, klass, year, cache_key),
+            content_type="application/x-gzip",
+        )
+    elif compressed is not None:
+        # Serve the pre-compressed copy rather than compressing again.
+        response = HttpResponse(compressed, content_type="application/xml")
+        response["Content-Encoding"] = "gzip"
+    else:
+        xml = cache.get(cache_key)
+        if xml is not None:
+            response = HttpResponse(xml, content_type="application/xml")
+        else:
+            response = StreamingHttpResponse(
+                _stream_and_cache(
+                    _sitemap_section_xml(request, klass, year), cache_key
+                ),
+                content_type="application/xml",
+            )
+    response["Cache-Control"] = cache_control
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+def _sitemap_section_xml(request, klass, year):
+    """
+    Yields the child sitemap for `klass` items in `year`, a chunk at a time.
+
+    Item URLs are built from their day's archive URL, so reverse() runs once
+    per day rather than once per item.
+    """
+    base_url = request.build_absolute_uri("/")[:-1]
+    day_urls = {}
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="%s">\n' % SITEMAP_NS
+    items = (
+        klass.objects.filter(created__year=year)
+        .order_by("created")
+        .values_list("slug", "created")
+        .iterator(chunk_size=1000)
+    )
+    chunk = []
+    for slug, created in items:
+        day = localdate(created)
+        if day not in day_urls:
+            day_urls[day] = base_url + reverse(
+                "blog_archive_day", args=[day.year, day.month, day.day]
+            )
+        chunk.append(
+            f"<url><loc>{day_urls[day]}{slug}/</loc>"
+            f"<lastmod>{day.isoformat()}</lastmod></url>\n"
+        )
+        if len(chunk) >= 500:
+            yield "".join(chunk)
+            chunk = []
+    chunk.append("</urlset>")
+    yield "".join(chunk)
+
+
+def _stream_and_cache(chunks, cache_key):
+    """
+    Passes `chunks` through to a streaming response, then caches the whole
+    document (and a gzipped copy) once it has been fully sent.
+    """
+    sent = []
+    for chunk in chunks:
+        sent.append(chunk)
+        yield chunk
+    xml = "".join(sent)
+    cache.set(cache_key, xml, SITEMAP_CACHE_TIMEOUT)
+    cache.set(
+        cache_key + ":gz", gzip.compress(xml.encode("utf8")), SITEMAP_CACHE_TIMEOUT
+    )
+
+
+def _sitemap_section_gzipped(request, klass, year, cache_key):
+    compressed = cache.get(cache_key + ":gz")
+    if compressed is None:
+        for _ in _stream_and_cache(
+            _sitemap_section_xml(request, klass, year), cache_key
+        ):
+            pass
+        compressed = cache.get(cache_key + ":gz")
+    return compressed
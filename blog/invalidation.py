@@ -0,0 +1,217 @@
+"""
+A cross-process invalidation bus, over Postgres LISTEN/NOTIFY.
+
+Content changes are announced with notify(), which sends a NOTIFY on CHANNEL
+with the changed object's model, pk and the kind of change ("save", "delete",
+"tags"); notify_pages() announces the paths of pages that changed (see
+blog.static_build). NOTIFY is transactional: the message is only delivered if (and when)
+the transaction commits, and identical messages in one transaction are
+delivered once.
+
+Each process runs a Listener thread, started from config/wsgi.py, that
+receives the messages and passes them to every registered handler -- which
+evict whatever in-process state they keep (by default, the local tier of any
+TwoTierCache; see blog.cache_backends).
+
+Messages sent while a listener is disconnected are lost, so every
+notification also moves on a version counter (a Postgres sequence). A listener
+that reconnects, or hasn't heard anything for INVALIDATION_POLL_INTERVAL
+seconds, checks the counter and, if it's moved on without it, sends handlers
+a "reset" event: evict everything. With INVALIDATION_BUS = "poll" that's all listeners
+do, for databases (or poolers, like pgbouncer in transaction mode) where
+LISTEN doesn't work.
+"""
+
+import json
+import logging
+import select
+import threading
+import psycopg2
+from django.conf import settings
+from django.db import connection, connections
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "blog_invalidation"
+VERSION_SEQUENCE = "blog_invalidation_version"
+
+# NOTIFY payloads must be under 8000 bytes; this leaves room for the rest
+MAX_PATHS_SIZE = 7000
+
+# Backoff between reconnection attempts, doubling up to the maximum
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+
+
+def notify(obj, kind):
+    """
+    Announces a change to model instance `obj`, once the current transaction
+    commits. Does nothing unless INVALIDATION_BUS is set.
+    """
+    if settings.INVALIDATION_BUS:
+        send({"model": obj._meta.label_lower, "pk": obj.pk, "kind": kind})
+
+
+def notify_pages(paths):
+    """
+    Announces that the pages at `paths` have changed, once the current
+    transaction commits, in as many messages as it takes to stay under
+    NOTIFY's payload limit. Does nothing unless INVALIDATION_BUS is set.
+    """
+    if not settings.INVALIDATION_BUS:
+        return
+    chunk, size = [], 0
+    for path in paths:
+        if chunk and size + len(path) > MAX_PATHS_SIZE:
+            send({"kind": "pages", "paths": chunk})
+            chunk, size = [], 0
+        chunk.append(path)
+        size += len(path) + 4
+    if chunk:
+        send({"kind": "pages", "paths": chunk})
+
+
+def send(event):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(%s), pg_notify(%s, %s)",
+            [VERSION_SEQUENCE, CHANNEL, json.dumps(event)],
+        )
+
+
+def clear_local_caches(event):
+    from blog.cache_backends import clear_local_tiers
+
+    clear_local_tiers()
+
+
+# Called with each event: {"model": "blog.entry", "pk": 12, "kind": "save"},
+# {"kind": "pages", "paths": ["/2019/", ...]}, or {"kind": "reset"}
+handlers = [clear_local_caches]
+
+
+def register(handler):
+    if handler not in handlers:
+        handlers.append(handler)
+    return handler
+
+
+class Listener:
+    """
+    Receives invalidation events and dispatches them to `handlers`, in a
+    thread; see the module docstring. `mode` is "listen" or "poll".
+    """
+
+    def __init__(self, mode="listen", poll_interval=None):
+        self.mode = mode
+        self.poll_interval = poll_interval or settings.INVALIDATION_POLL_INTERVAL
+        self.conn = None
+        self.version = None
+        self.thread = None
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {"events": 0, "resets": 0, "reconnects": 0, "errors": 0}
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="invalidation-listener", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.close()
+
+    def run(self):
+        delay = RECONNECT_MIN_DELAY
+        while not self.stopping.is_set():
+            try:
+                self.connect()
+                delay = RECONNECT_MIN_DELAY
+                while not self.stopping.is_set():
+                    self.wait()
+            except Exception:
+                self.count("errors")
+                log.exception("invalidation listener failed; reconnecting")
+                self.close()
+                self.stopping.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def connect(self):
+        params = connections["default"].get_connection_params()
+        self.conn = psycopg2.connect(**params)
+        self.conn.autocommit = True
+        if self.mode == "listen":
+            with self.conn.cursor() as cursor:
+                cursor.execute("LISTEN %s" % CHANNEL)
+        if self.version is not None:
+            self.count("reconnects")
+        # Catch up on anything missed while disconnected
+        self.check_version()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
+
+    def wait(self):
+        if self.mode != "listen":
+            if not self.stopping.wait(self.poll_interval):
+                self.check_version()
+            return
+        ready, _, _ = select.select([self.conn], [], [], self.poll_interval)
+        if not ready:
+            # Quiet for a while: make sure the connection's alive, and nothing
+            # was missed
+            self.check_version()
+            return
+        self.conn.poll()
+        events = []
+        while self.conn.notifies:
+            events.append(json.loads(self.conn.notifies.pop(0).payload))
+        if events:
+            # Everything up to now has been (or is about to be) announced
+            self.version = self.current_version()
+            for event in events:
+                self.dispatch(event)
+
+    def current_version(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT last_value FROM %s" % VERSION_SEQUENCE)
+            return cursor.fetchone()[0]
+
+    def check_version(self):
+        version = self.current_version()
+        if self.version is not None and version != self.version:
+            self.count("resets")
+            self.dispatch({"kind": "reset"})
+        self.version = version
+
+    def dispatch(self, event):
+        self.count("events")
+        for handler in list(handlers):
+            try:
+                handler(event)
+            except Exception:
+                log.exception("invalidation handler %r failed", handler)
+
+
+listener = None
+
+
+def start():
+    """Starts this process's listener, if INVALIDATION_BUS is set."""
+    global listener
+    if settings.INVALIDATION_BUS and listener is None:
+        listener = Listener(settings.INVALIDATION_BUS).start()
+    return listener
@@ -0,0 +1,51 @@
+import time
+from django.core.management.base import BaseCommand
+from blog.cache_backends import COMPRESS_MIN_SIZE, Codec, zstandard
+from blog.dependencies import ALWAYS, fingerprints
+from blog.rendering import SiteClient
+
+
+class Command(BaseCommand):
+    help = """
+        Renders up to --pages of the site's pages, and reports how well each
+        compression algorithm the cache can use (see blog.cache_backends)
+        shrinks them, and how long compressing and decompressing takes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--min-size", type=int, default=COMPRESS_MIN_SIZE)
+
+    def handle(self, *args, **kwargs):
+        urls = list(ALWAYS)
+        urls += sorted(
+            {url for _, page_urls in fingerprints().values() for url in page_urls}
+        )
+        client = SiteClient(bypass_page_cache=True)
+        pages = []
+        for url in urls[: kwargs["pages"]]:
+            page = client.get(url)
+            if page.status == 200:
+                pages.append(
+                    {"headers": list(page.headers.items()), "content": page.content}
+                )
+        raw = sum(len(page["content"]) for page in pages)
+        self.stdout.write(f"{len(pages)} pages, {raw / 1024:.0f}KB")
+
+        for algorithm in ["zlib"] + (["zstd"] if zstandard else []):
+            codec = Codec(kwargs["min_size"], algorithm)
+            start = time.perf_counter()
+            for _ in range(kwargs["repeat"]):
+                for page in pages:
+                    codec.unpack(codec.pack(page))
+            elapsed = time.perf_counter() - start
+            report = codec.report()
+            self.stdout.write(
+                f"{algorithm}: ratio {report['ratio']:.2f}, "
+                f"{report['packed'] // kwargs['repeat']} compressed, "
+                f"{report['incompressible'] // kwargs['repeat']} incompressible; "
+                f"{report['pack_ms']:.2f}ms to compress, "
+                f"{report['unpack_ms']:.2f}ms to decompress; "
+                f"{elapsed:.2f}s in all"
+            )
@@ -0,0 +1,83 @@
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from blog.models import Entry, Blogmark, Quotation, Tag
+
+BENCHMARK_REF_PREFIX = "benchmark:"
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod".split()
+
+
+def synthetic_item(i, tags):
+    created = datetime.datetime(2000, 1, 1) + datetime.timedelta(hours=i)
+    words = " ".join(random.choice(WORDS) for _ in range(50))
+    item = {
+        "type": ("entry", "blogmark", "quotation")[i % 3],
+        "datetime": created.isoformat(),
+        "slug": "benchmark-%d" % i,
+        "import_ref": "%s%d" % (BENCHMARK_REF_PREFIX, i),
+        "tags": random.sample(tags, 3),
+    }
+    if item["type"] == "entry":
+        item.update(title="Benchmark entry %d" % i, body="<p>%s</p>" % words)
+    elif item["type"] == "blogmark":
+        item.update(
+            link_url="https://example.com/%d" % i,
+            link_title="Benchmark link %d" % i,
+            commentary=words,
+        )
+    else:
+        item.update(quotation=words, source="Benchmark", source_url=None)
+    return item
+
+
+class Command(BaseCommand):
+    help = """
+        Times import_blog_json against a synthetic file of --items items,
+        then deletes what it imported (unless --keep).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=100000)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--copy", action="store_true", help="Use the COPY path")
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **kwargs):
+        tags = ["benchmark-tag-%d" % i for i in range(200)]
+        fd, path = tempfile.mkstemp(suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write("[\n")
+                for i in range(kwargs["items"]):
+                    if i:
+                        fp.write(",\n")
+                    json.dump(synthetic_item(i, tags), fp)
+                fp.write("\n]\n")
+            self.stdout.write(
+                "wrote %d items (%.1f MB)"
+                % (kwargs["items"], os.path.getsize(path) / 1024 / 1024)
+            )
+
+            start = time.perf_counter()
+            options = ["--batch-size=%d" % kwargs["batch_size"]]
+            if kwargs["copy"]:
+                options.append("--copy")
+            call_command("import_blog_json", path, *options, stdout=self.stdout)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                "benchmark: %d items in %.1fs, %.0f items/sec"
+                % (kwargs["items"], elapsed, kwargs["items"] / elapsed)
+            )
+        finally:
+            os.unlink(path)
+            if not kwargs["keep"]:
+                for klass in (Entry, Blogmark, Quotation):
+                    klass.objects.filter(
+                        import_ref__startswith=BENCHMARK_REF_PREFIX
+                    ).delete()
+                Tag.objects.filter(tag__startswith="benchmark-tag-").delete()
@@ -0,0 +1,57 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.fake_pinboard import FakePinboard
+from blog.models import PinboardCursor
+from blog.pinboard_sync import BATCH_SIZE, PinboardClient, sync
+
+
+class Command(BaseCommand):
+    help = """
+        Times Pinboard syncs against a local fake Pinboard holding --posts
+        bookmarks: the first full sync, a sync with nothing to do, and a sync
+        after editing and deleting a few. Everything runs in one transaction
+        that's rolled back at the end.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=20000)
+        parser.add_argument("--changes", type=int, default=100)
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **kwargs):
+        with FakePinboard() as pinboard:
+            tags = ["benchmark-tag-%d" % i for i in range(200)]
+            for i in range(kwargs["posts"]):
+                pinboard.add(
+                    "https://example.com/benchmark/%d" % i,
+                    "Benchmark bookmark %d" % i,
+                    extended="Some commentary about bookmark %d" % i,
+                    tags=random.sample(tags, 3),
+                )
+            client = PinboardClient(base_url=pinboard.url, api_key="benchmark")
+
+            with transaction.atomic():
+                # Start from an empty cursor rather than the real one
+                PinboardCursor.objects.update_or_create(
+                    pk=1, defaults={"posts": {}, "last_update": None}
+                )
+                self.timed("initial sync", client, kwargs)
+                self.timed("no-op sync", client, kwargs)
+                hashes = random.sample(list(pinboard.posts), kwargs["changes"] * 2)
+                for url_hash in hashes[: kwargs["changes"]]:
+                    pinboard.edit(url_hash, description="Edited")
+                for url_hash in hashes[kwargs["changes"] :]:
+                    pinboard.delete(url_hash)
+                self.timed("incremental sync", client, kwargs)
+                transaction.set_rollback(True)
+
+    def timed(self, label, client, kwargs):
+        start = time.perf_counter()
+        stats = sync(client, batch_size=kwargs["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label}: {elapsed:.2f}s; "
+            + ", ".join(f"{n} {what}" for what, n in stats.items())
+        )
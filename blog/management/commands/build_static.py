@@ -0,0 +1,166 @@
+import gzip
+import json
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from blog.context_processors import content_years
+from blog.dependencies import ALWAYS, fingerprints
+from blog.parallel import run_chunks
+from blog.rendering import SiteClient
+from blog.static_build import (
+    MANIFEST,
+    is_static,
+    output_path,
+    remove_file,
+    write_file,
+)
+
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 50
+
+
+def render_chunk(urls, output_dir, base_url):
+    """
+    Renders `urls` through the full Django stack and writes each page, plus a
+    gzipped copy, under `output_dir`. Runs in a worker process. Returns a
+    list of (url, status, path) -- path is None for pages that weren't written.
+    """
+    # Always render afresh, rather than from the page cache
+    client = SiteClient(base_url, bypass_page_cache=True)
+    results = []
+    for url in urls:
+        page = client.get(url)
+        path = None
+        if page.status == 200:
+            path = output_path(url, page.headers["Content-Type"])
+            full_path = os.path.join(output_dir, path)
+            write_file(full_path, page.content)
+            # mtime=0 so that unchanged pages give byte-identical .gz files
+            write_file(full_path + ".gz", gzip.compress(page.content, 9, mtime=0))
+        results.append((url, page.status, path))
+    return results
+
+
+class Command(BaseCommand):
+    help = """
+        Renders every public page (archives, permalinks, tag pages,
+        sitemaps, speaking pages; not feeds) to files under OUTPUT_DIR, by
+        default STATIC_BUILD_ROOT, each with a pre-compressed .gz copy, for
+        nginx to serve directly. See blog.static_build.
+
+        A manifest records a fingerprint of every object and the pages it
+        appears on (see blog.dependencies), so later builds only re-render
+        pages whose content changed, or whose file was removed because it
+        did. Use --full after template or code changes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output_dir",
+            nargs="?",
+            default=settings.STATIC_BUILD_ROOT,
+            help="Directory to write the site to (default STATIC_BUILD_ROOT)",
+        )
+        parser.add_argument("--full", action="store_true", help="Re-render every page")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--base-url",
+            default=settings.SITE_URL,
+            help="Scheme and host the site is served from (default %s)"
+            % settings.SITE_URL,
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["workers"] < 1:
+            raise CommandError("--workers must be positive")
+        if not kwargs["output_dir"]:
+            raise CommandError("give an output directory, or set STATIC_BUILD_ROOT")
+        output_dir = os.path.abspath(kwargs["output_dir"])
+        manifest_path = os.path.join(output_dir, MANIFEST)
+        start = time.perf_counter()
+
+        old = {"version": MANIFEST_VERSION, "objects": {}, "files": {}, "years": []}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as fp:
+                old = json.load(fp)
+
+        objects = {key: list(value) for key, value in fingerprints().items()}
+        years = [d.year for d in content_years()]
+        all_urls = set(ALWAYS).union(*(urls for _, urls in objects.values()))
+        all_urls = {url for url in all_urls if is_static(url)}
+
+        # Every page shows the list of years, so a new (or newly empty) year
+        # means rendering everything.
+        full = (
+            kwargs["full"]
+            or old.get("version") != MANIFEST_VERSION
+            or old["years"] != years
+        )
+        if full:
+            urls = all_urls | {url for url in old["files"] if is_static(url)}
+        else:
+            urls = set(ALWAYS)
+            for key in objects.keys() | old["objects"].keys():
+                fingerprint, new_urls = objects.get(key, (None, []))
+                old_fingerprint, old_urls = old["objects"].get(key, (None, []))
+                if fingerprint != old_fingerprint:
+                    urls.update(new_urls, old_urls)
+            # Pages that haven't been written yet (e.g. after a failure), or
+            # were removed when their content changed
+            urls.update(all_urls - set(old["files"]))
+            urls.update(
+                url
+                for url, path in old["files"].items()
+                if is_static(url) and not os.path.exists(os.path.join(output_dir, path))
+            )
+            urls = {url for url in urls if is_static(url)}
+
+        files = {} if full else dict(old["files"])
+        rendered = removed = failed = 0
+        # Built by an older version, but served by Django now
+        for url in [url for url in old["files"] if not is_static(url)]:
+            remove_file(os.path.join(output_dir, old["files"][url]))
+            files.pop(url, None)
+            removed += 1
+        for url, status, path in self.render(sorted(urls), output_dir, kwargs):
+            if path:
+                rendered += 1
+                files[url] = path
+            elif status >= 500:
+                # Leave any old copy in place, but forget it so that the next
+                # build tries again
+                self.stderr.write(f"{url}: {status}")
+                files.pop(url, None)
+                failed += 1
+            elif url in old["files"]:
+                # Gone (or now a redirect): stop serving the old copy
+                remove_file(os.path.join(output_dir, old["files"][url]))
+                files.pop(url, None)
+                removed += 1
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "years": years,
+            "objects": objects,
+            "files": files,
+        }
+        write_file(manifest_path, json.dumps(manifest).encode("utf8"))
+
+        self.stdout.write(
+            f"rendered {rendered} of {len(all_urls)} pages, removed {removed}, "
+            f"failed {failed}, in {time.perf_counter() - start:.1f}s"
+            + (" (full build)" if full else "")
+        )
+
+    def render(self, urls, output_dir, kwargs):
+        """Yields (url, status, path) for each URL as it's rendered."""
+        chunks = [urls[i : i + CHUNK_SIZE] for i in range(0, len(urls), CHUNK_SIZE)]
+        args = (output_dir, kwargs["base_url"])
+        for _, results in run_chunks(render_chunk, chunks, kwargs["workers"], *args):
+            yield from results
@@ -1,14 +1,39 @@
-from django.core.management.base import BaseCommand
-from django.utils.timezone import utc
-from blog.models import Entry, Blogmark, Tag, Quotation
-import requests
-from dateutil import parser
+import io
 import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from blog.blog_json import (
+    get_series,
+    item_to_fields,
+    iter_json_items,
+    open_json,
+    synthesized_ref,
+)
+from blog.caching import bump_content_version
+from blog.models import tag_ids
+from blog.search import reindex
+from blog.signals import bulk_pages_changed
+import requests
 
 
 class Command(BaseCommand):
     help = """
         ./manage.py import_blog_json URL-or-path-to-JSON
+
+        Paths ending .gz or .zst are decompressed on the fly.
+
+        Items are streamed from the file and written in batches: each batch
+        is one transaction, inserting new items with bulk_create (or COPY,
+        with --copy) and updating existing ones -- matched by import_ref --
+        with bulk_update. Search documents are rebuilt once, at the end.
+
+        Items from export_blog_json for objects that had no import_ref (with
+        a ref like "entry:123") update that object, if it's still there
+        without an import_ref and with the same slug, rather than
+        duplicating it.
     """
 
     def add_arguments(self, parser):
@@ -22,68 +47,256 @@ class Command(BaseCommand):
             default=False,
             help="Tag to apply to all imported items",
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Items per batch/transaction (default 1000)",
+        )
+        parser.add_argument(
+            "--copy",
+            action="store_true",
+            help="Load with Postgres COPY; faster, but only for items that "
+            "aren't in the database yet",
+        )
 
     def handle(self, *args, **kwargs):
         url_or_path_to_json = kwargs["url_or_path_to_json"]
-        tag_with = kwargs["tag_with"]
-        tag_with_tag = None
-        if tag_with:
-            tag_with_tag = Tag.objects.get_or_create(tag=tag_with)[0]
+        self.tag_ids = {}
+        self.series = {}
+        self.tag_with = kwargs["tag_with"]
+        self.use_copy = kwargs["copy"]
+        batch_size = kwargs["batch_size"]
+        if batch_size < 1:
+            raise CommandError("--batch-size must be positive")
 
         is_url = url_or_path_to_json.startswith(
             "http://"
         ) or url_or_path_to_json.startswith("https://")
 
         if is_url:
-            items = requests.get(url_or_path_to_json).json()
+            response = requests.get(url_or_path_to_json, stream=True)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            fp = io.TextIOWrapper(response.raw, encoding="utf8")
         else:
-            items = json.load(open(url_or_path_to_json))
+            try:
+                fp = open_json(url_or_path_to_json)
+            except ValueError as e:
+                raise CommandError(str(e))
 
+        self.touched = {}
+        start = time.perf_counter()
+        count = 0
+        with fp:
+            batch = []
+            for item in iter_json_items(fp):
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    count += self.import_batch(batch)
+                    batch = []
+                    self.report(count, start)
+            if batch:
+                count += self.import_batch(batch)
+        self.report(count, start)
+
+        # Search documents are rebuilt in one pass once everything's in,
+        # rather than item by item (and triggers will already have done it).
+        if not settings.SEARCH_DOCUMENT_TRIGGERS:
+            start = time.perf_counter()
+            reindexed = sum(reindex(klass, pks) for klass, pks in self.touched.items())
+            self.stdout.write(
+                f"rebuilt {reindexed} search documents in "
+                f"{time.perf_counter() - start:.1f}s"
+            )
+        bump_content_version()
+
+    def report(self, count, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"imported {count} items in {elapsed:.1f}s "
+            f"({count / elapsed if elapsed else 0:.0f} items/sec)"
+        )
+
+    def import_batch(self, items):
+        by_class = {}
         for item in items:
-            created = parser.parse(item["datetime"]).replace(tzinfo=utc)
-            was_created = False
-            slug = item["slug"][:64].strip("-")
-            if item["type"] == "entry":
-                klass = Entry
-                kwargs = dict(
-                    body=item["body"],
-                    title=item["title"],
-                    created=created,
-                    slug=slug,
-                    metadata=item,
-                )
-            elif item["type"] == "quotation":
-                klass = Quotation
-                kwargs = dict(
-                    quotation=item["quotation"],
-                    source=item["source"],
-                    source_url=item["source_url"],
-                    created=created,
-                    slug=slug,
-                    metadata=item,
-                )
-            elif item["type"] == "blogmark":
-                klass = Blogmark
-                kwargs = dict(
-                    slug=slug,
-                    link_url=item["link_url"],
-                    link_title=item["link_title"],
-                    via_url=item.get("via_url") or "",
-                    via_title=item.get("via_title") or "",
-                    commentary=item["commentary"] or "",
-                    created=created,
-                    metadata=item,
-                )
+            klass, fields = item_to_fields(item)
+            if "series" in item:
+                fields["series"] = self.get_series(item["series"])
+            tags = list(item["tags"])
+            if self.tag_with:
+                tags.append(self.tag_with)
+            by_class.setdefault(klass, []).append(
+                (item.get("import_ref"), fields, tags)
+            )
+
+        with transaction.atomic():
+            self.resolve_tags(
+                {
+                    tag
+                    for rows in by_class.values()
+                    for (_, _, tags) in rows
+                    for tag in tags
+                }
+            )
+            for klass, rows in by_class.items():
+                if self.use_copy:
+                    objects, updated = self.copy_objects(klass, rows), []
+                else:
+                    objects, updated = self.upsert_objects(klass, rows)
+                self.set_tags(klass, objects, updated)
+                bulk_pages_changed(klass, [o.pk for o, _ in objects])
+                self.touched.setdefault(klass, set()).update(o.pk for o, _ in objects)
+        return len(items)
+
+    def get_series(self, series):
+        slug = series and series["slug"]
+        if slug not in self.series:
+            self.series[slug] = get_series(series)
+        return self.series[slug]
+
+    def resolve_tags(self, tags):
+        """
+        Makes sure every tag exists, and self.tag_ids knows its id, in at most
+        two queries however many tags there are.
+        """
+        self.tag_ids.update(tag_ids(tag for tag in tags if tag not in self.tag_ids))
+
+    def upsert_objects(self, klass, rows):
+        """
+        Creates or updates (by import_ref) objects for `rows`. Returns a list
+        of (object, tags), and the pks of the objects that already existed.
+        """
+        # If an import_ref appears more than once, the last one wins
+        by_ref = {}
+        without_ref = []
+        for import_ref, fields, tags in rows:
+            if import_ref:
+                by_ref[import_ref] = (fields, tags)
             else:
-                assert False, "type should be known, %s" % item["type"]
-            if item.get("import_ref"):
-                obj, was_created = klass.objects.update_or_create(
-                    import_ref=item["import_ref"], defaults=kwargs
-                )
+                without_ref.append((klass(**fields), tags))
+
+        existing = dict(
+            klass.objects.filter(import_ref__in=by_ref).values_list("import_ref", "pk")
+        )
+        existing.update(self.match_synthesized_refs(klass, by_ref, existing))
+        to_create, to_update = list(without_ref), []
+        for import_ref, (fields, tags) in by_ref.items():
+            obj = klass(import_ref=import_ref, **fields)
+            if import_ref in existing:
+                obj.pk = existing[import_ref]
+                to_update.append((obj, tags))
             else:
-                obj = klass.objects.create(**kwargs)
-            tags = [Tag.objects.get_or_create(tag=tag)[0] for tag in item["tags"]]
-            if tag_with_tag:
-                tags.append(tag_with_tag)
-            obj.tags.set(tags)
-            print(was_created, obj, obj.get_absolute_url())
+                to_create.append((obj, tags))
+
+        # Where the objects being updated were, in case their dates, slugs or
+        # tags change
+        bulk_pages_changed(klass, [obj.pk for obj, _ in to_update])
+        klass.objects.bulk_create([obj for obj, _ in to_create])
+        # Items can leave out optional fields, so update the objects with the
+        # same fields together
+        by_fields = {}
+        for import_ref, (fields, _) in by_ref.items():
+            if import_ref in existing:
+                by_fields.setdefault(tuple(fields), []).append(import_ref)
+        updates = {obj.import_ref: obj for obj, _ in to_update}
+        # bulk_update() doesn't set auto_now fields itself
+        now = timezone.now()
+        for field_names, refs in by_fields.items():
+            objects = [updates[ref] for ref in refs]
+            for obj in objects:
+                obj.updated = now
+            klass.objects.bulk_update(
+                objects, list(field_names) + ["import_ref", "updated"]
+            )
+        return to_create + to_update, [obj.pk for obj, _ in to_update]
+
+    def match_synthesized_refs(self, klass, by_ref, existing):
+        """
+        Returns {import_ref: pk} for the refs export_blog_json made up for
+        objects without one, where the object is still here: the same pk and
+        slug, and still no import_ref.
+        """
+        type_name = klass._meta.model_name
+        candidates = {}
+        for import_ref, (fields, _) in by_ref.items():
+            prefix, _, pk = import_ref.partition(":")
+            if import_ref not in existing and prefix == type_name and pk.isdigit():
+                if import_ref == synthesized_ref(type_name, int(pk)):
+                    candidates[int(pk)] = (import_ref, fields["slug"])
+        matches = klass.objects.filter(pk__in=candidates, import_ref=None).values_list(
+            "pk", "slug"
+        )
+        return {
+            candidates[pk][0]: pk for pk, slug in matches if slug == candidates[pk][1]
+        }
+
+    def copy_objects(self, klass, rows):
+        """
+        Inserts `rows` with COPY, allocating ids from the table's sequence
+        first so that tags can be attached. Returns a list of (object, tags).
+        """
+        table = klass._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                "FROM generate_series(1, %s)",
+                [table, len(rows)],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+
+        fields = [f for f in klass._meta.concrete_fields if f.name != "search_document"]
+        objects = []
+        buf = io.StringIO()
+        for pk, (import_ref, values, tags) in zip(ids, rows):
+            obj = klass(pk=pk, import_ref=import_ref or None, **values)
+            objects.append((obj, tags))
+            # pre_save() fills in auto_now fields
+            buf.write("\t".join(copy_value(f, f.pre_save(obj, True)) for f in fields))
+            buf.write("\n")
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                "COPY %s (%s) FROM STDIN"
+                % (table, ", ".join(f.column for f in fields)),
+                buf,
+            )
+        return objects
+
+    def set_tags(self, klass, objects, updated):
+        through = klass.tags.through
+        column = "%s_id" % klass._meta.model_name
+        if updated:
+            # Objects that already existed get their tags replaced
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM %s WHERE %s = ANY(%%s)"
+                    % (through._meta.db_table, column),
+                    [updated],
+                )
+        through.objects.bulk_create(
+            [
+                through(**{column: obj.pk, "tag_id": self.tag_ids[tag]})
+                for obj, tags in objects
+                for tag in set(tags)
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def copy_value(field, value):
+    """Formats one value for COPY's text format."""
+    if value is None:
+        return "\\N"
+    if field.get_internal_type() == "JSONField":
+        value = json.dumps(value)
+    elif hasattr(value, "isoformat"):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
@@ -1,15 +1,132 @@
-from django.core.management.base import BaseCommand
+import datetime
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import make_aware
 from blog.models import Entry, Blogmark, Quotation
+from blog.parallel import run_chunks
+from blog.search import update_search_documents
+
+TYPES = {"entry": Entry, "blogmark": Blogmark, "quotation": Quotation}
+
+
+def reindex_chunk(chunk):
+    """
+    Rebuilds search_document for one (type, first pk, last pk, since) range;
+    runs in a worker process, on that process's own database connection.
+    """
+    type_name, first_pk, last_pk, since = chunk
+    model = TYPES[type_name]
+    qs = model.objects.filter(pk__gte=first_pk, pk__lte=last_pk)
+    if since:
+        qs = qs.filter(created__gte=since)
+    return update_search_documents(model, qs.prefetch_related("tags"))
 
 
 class Command(BaseCommand):
-    help = "Re-indexes all entries, blogmarks, quotations"
+    help = """
+        Re-indexes all entries, blogmarks, quotations.
+
+        Objects are split into chunks of consecutive pks; each chunk is
+        reindexed with a single UPDATE, and chunks run in parallel across a
+        pool of worker processes. With --checkpoint, finished chunks are
+        recorded in a file so an interrupted run can pick up where it left off;
+        the file is removed once the run completes. A checkpoint is only
+        resumed by a run with the same --since and --chunk-size, and a chunk is
+        only skipped if it still covers exactly the same pks.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--type",
+            action="append",
+            choices=sorted(TYPES),
+            dest="types",
+            help="Only reindex this type (may be given more than once)",
+        )
+        parser.add_argument(
+            "--since",
+            type=datetime.date.fromisoformat,
+            help="Only reindex items created on or after this date (YYYY-MM-DD)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Objects per chunk (default 1000)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="Path to a checkpoint file; finished chunks listed there are "
+            "skipped",
+        )
 
     def handle(self, *args, **kwargs):
-        for klass in (Entry, Blogmark, Quotation):
-            i = 0
-            for obj in klass.objects.prefetch_related("tags").all():
-                obj.save()
-                i += 1
-                if i % 100 == 0:
-                    print(klass, i)
+        types = kwargs["types"] or list(TYPES)
+        since = kwargs["since"]
+        if since:
+            since = make_aware(datetime.datetime.combine(since, datetime.time()))
+        chunk_size = kwargs["chunk_size"]
+        if chunk_size < 1 or kwargs["workers"] < 1:
+            raise CommandError("--chunk-size and --workers must be positive")
+
+        checkpoint_path = kwargs["checkpoint"]
+        options = {"since": since and since.isoformat(), "chunk_size": chunk_size}
+        checkpoint = {"options": options, "done": {t: [] for t in TYPES}}
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as fp:
+                saved = json.load(fp)
+            if saved.get("options") == options:
+                checkpoint["done"].update(saved["done"])
+            else:
+                self.stdout.write(
+                    f"{checkpoint_path} is from a run with different options; "
+                    "starting from scratch"
+                )
+        done = checkpoint["done"]
+
+        chunks = []
+        for type_name in types:
+            qs = TYPES[type_name].objects.order_by("pk")
+            if since:
+                qs = qs.filter(created__gte=since)
+            pks = list(qs.values_list("pk", flat=True))
+            for i in range(0, len(pks), chunk_size):
+                first_pk, last_pk = pks[i], pks[min(i + chunk_size, len(pks)) - 1]
+                if [first_pk, last_pk] not in done[type_name]:
+                    chunks.append((type_name, first_pk, last_pk, since))
+
+        start = time.perf_counter()
+        counts = {type_name: 0 for type_name in types}
+        results = run_chunks(reindex_chunk, chunks, kwargs["workers"])
+        for (type_name, first_pk, last_pk, _), count in results:
+            counts[type_name] += count
+            done[type_name].append([first_pk, last_pk])
+            if checkpoint_path:
+                with open(checkpoint_path, "w") as fp:
+                    json.dump(checkpoint, fp)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{type_name} {first_pk}-{last_pk}: {sum(counts.values())} rows, "
+                f"{sum(counts.values()) / elapsed:.0f} rows/sec"
+            )
+
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            # Finished, so there's nothing to resume
+            os.remove(checkpoint_path)
+
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+        for type_name, count in counts.items():
+            self.stdout.write(f"{type_name}: {count} rows")
+        self.stdout.write(
+            f"reindexed {total} rows in {elapsed:.1f}s "
+            f"({total / elapsed if elapsed else 0:.0f} rows/sec)"
+        )
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from blog.search import disable_triggers, enable_triggers, installed_triggers
+
+
+class Command(BaseCommand):
+    help = """
+        Installs (or removes) database triggers that maintain search_document.
+
+        Pair with SEARCH_DOCUMENT_TRIGGERS=1, which stops the Python side
+        reindexing on save.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["enable", "disable", "status"])
+
+    def handle(self, *args, **kwargs):
+        if kwargs["action"] == "enable":
+            enable_triggers()
+        elif kwargs["action"] == "disable":
+            disable_triggers()
+
+        triggers = installed_triggers()
+        self.stdout.write("installed triggers: %s" % (", ".join(triggers) or "none"))
+        if bool(triggers) != settings.SEARCH_DOCUMENT_TRIGGERS:
+            self.stderr.write(
+                "warning: SEARCH_DOCUMENT_TRIGGERS is %s; set it to %s"
+                % (settings.SEARCH_DOCUMENT_TRIGGERS, bool(triggers))
+            )
@@ -0,0 +1,174 @@
+import datetime
+import os
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.urls import reverse
+from django.utils import timezone
+from blog.cache_backends import TwoTierCache
+from blog.dependencies import FEEDS
+from blog.models import Tag
+from blog.parallel import run_chunks
+from blog.popularity import popular_pages
+from blog.rendering import SiteClient
+
+
+def warm_chunk(urls, base_url, deadline):
+    """
+    Requests each of `urls` through the full Django stack, as an anonymous
+    visitor, so that the page cache (and the caches behind it: tag clouds,
+    feeds, the homepage) are filled. Runs in a worker process. Returns a list
+    of (url, status, cache, seconds); status is None for URLs skipped because
+    the deadline passed.
+    """
+    client = SiteClient(base_url)
+    results = []
+    for url in urls:
+        if time.time() > deadline:
+            results.append((url, None, None, 0))
+            continue
+        start = time.perf_counter()
+        page = client.get(url)
+        results.append(
+            (
+                url,
+                page.status,
+                page.headers.get("X-Page-Cache", "-"),
+                time.perf_counter() - start,
+            )
+        )
+    return results
+
+
+def is_shared(cache):
+    """Whether `cache` is seen by every process, rather than just this one."""
+    if isinstance(cache, TwoTierCache):
+        cache = cache.shared
+    return not isinstance(cache, (LocMemCache, DummyCache))
+
+
+def popular_tags(n):
+    """
+    The `n` most requested tag pages, topped up with the most used tags if
+    there's not enough to go on.
+    """
+    urls = popular_pages.top(reverse("tag_index"), n)
+    if len(urls) < n:
+        most_used = (
+            Tag.objects.annotate(
+                n=models.Count("entry", distinct=True)
+                + models.Count("blogmark", distinct=True)
+                + models.Count("quotation", distinct=True)
+            )
+            .order_by("-n", "tag")
+            .values_list("tag", flat=True)
+        )
+        for tag in most_used[: n * 2]:
+            url = reverse("tag_detail", args=[tag])
+            if url not in urls:
+                urls.append(url)
+    return urls[:n]
+
+
+def recent_archives(today):
+    last_month = today.replace(day=1) - datetime.timedelta(days=1)
+    return [
+        reverse("blog_archive_year", args=[today.year]),
+        reverse("blog_archive_year", args=[today.year - 1]),
+        reverse("blog_archive_month", args=[today.year, today.month]),
+        reverse("blog_archive_month", args=[last_month.year, last_month.month]),
+    ]
+
+
+class Command(BaseCommand):
+    help = """
+        Fills the shared cache after a deploy or a purge, by requesting the
+        pages the first visitors are likely to want: the homepage, feeds, the
+        tag index, the most popular tag pages and searches (see
+        blog.popularity), and this and last year's and month's archives.
+        Stops starting new pages once --budget seconds have passed.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tags", type=int, default=20, help="Number of tag pages (default 20)"
+        )
+        parser.add_argument(
+            "--searches", type=int, default=10, help="Number of searches (default 10)"
+        )
+        parser.add_argument(
+            "--budget",
+            type=float,
+            default=60,
+            help="Seconds to spend, at most (default 60)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes (default: one per CPU)",
+        )
+        parser.add_argument(
+            "--base-url",
+            default=settings.SITE_URL,
+            help="Scheme and host the site is served from (default %s)"
+            % settings.SITE_URL,
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs["workers"] < 1:
+            raise CommandError("--workers must be positive")
+        if not is_shared(caches["default"]):
+            # Whatever we filled would go when we exit
+            raise CommandError(
+                "The default cache isn't shared between processes (is REDIS_URL "
+                "set?), so there's nothing to warm"
+            )
+        start = time.perf_counter()
+        deadline = time.time() + kwargs["budget"]
+
+        # Most important first, since the budget may not stretch to everything
+        urls = ["/"]
+        urls += sorted(set(url for feed_urls in FEEDS.values() for url in feed_urls))
+        urls.append(reverse("tag_index"))
+        urls += recent_archives(timezone.localdate())
+        urls += popular_tags(kwargs["tags"])
+        urls += popular_pages.top(reverse("search"), kwargs["searches"])
+        urls = list(dict.fromkeys(urls))
+
+        counts = dict.fromkeys(
+            ["warmed", "already cached", "not found", "failed", "skipped"], 0
+        )
+        for url, status, cache, seconds in self.warm(urls, deadline, kwargs):
+            if status is None:
+                counts["skipped"] += 1
+                self.stdout.write(f"{url}: skipped, out of time")
+                continue
+            if status == 404:
+                # An archive with nothing in it yet, or a tag gone out of use
+                counts["not found"] += 1
+            elif status != 200:
+                counts["failed"] += 1
+            elif cache == "hit":
+                counts["already cached"] += 1
+            else:
+                counts["warmed"] += 1
+            self.stdout.write(f"{url}: {status} {cache} {seconds:.2f}s")
+
+        self.stdout.write(
+            ", ".join(f"{n} {what}" for what, n in counts.items())
+            + f", in {time.perf_counter() - start:.1f}s"
+        )
+
+    def warm(self, urls, deadline, kwargs):
+        """Yields (url, status, cache, seconds) for each URL as it's warmed."""
+        workers = min(kwargs["workers"], len(urls))
+        # Round-robin, so every worker gets some of the most important pages
+        chunks = [urls[i::workers] for i in range(workers)]
+        args = (kwargs["base_url"], deadline)
+        for _, results in run_chunks(warm_chunk, chunks, workers, *args):
+            yield from results
@@ -0,0 +1,20 @@
+"""
+This process's counters, for the staff tools page.
+
+Components that keep a `stats` dict (the after-commit queues in
+blog.commit_queue, request coalescing) register it here under a name, and
+/tools/ shows each of them.
+The counts are per process, since the last restart.
+"""
+
+sources = {}
+
+
+def register(name, stats):
+    """Shows the dict `stats` on the tools page, as `name`."""
+    sources[name] = stats
+    return stats
+
+
+def snapshot():
+    return {name: dict(stats) for name, stats in sorted(sources.items())}
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.14 on 2026-10-19 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0020_entry_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="blogmark",
+            index=models.Index(
+                fields=["created"], name="blog_blogma_created_4273c0_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="entry",
+            index=models.Index(
+                fields=["created"], name="blog_entry_created_57ff41_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                fields=["created"], name="blog_photo_created_a546a7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="quotation",
+            index=models.Index(
+                fields=["created"], name="blog_quotat_created_2e6c38_idx"
+            ),
+        ),
+    ]
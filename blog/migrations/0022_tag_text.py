@@ -0,0 +1,33 @@
+# Generated by Django 3.0.14 on 2026-10-19 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0021_created_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="blogmark",
+            name="tag_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="entry",
+            name="tag_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="tag_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="quotation",
+            name="tag_text",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.14 on 2026-10-19 19:08
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0022_tag_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PinboardCursor",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_update", models.DateTimeField(null=True)),
+                ("posts", django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-19 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0023_pinboard_cursor"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entry",
+            name="body_error",
+            field=models.TextField(blank=True, default="", editable=False),
+        ),
+        migrations.AddField(
+            model_name="entry",
+            name="body_valid",
+            field=models.BooleanField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0024_entry_body_valid"),
+    ]
+
+    operations = [
+        # Moved on by every change announced on the invalidation bus, so that
+        # listeners can tell if they've missed any; see blog.invalidation.
+        migrations.RunSQL(
+            "CREATE SEQUENCE blog_invalidation_version",
+            "DROP SEQUENCE blog_invalidation_version",
+        ),
+    ]
@@ -2,6 +2,7 @@ import re
 import datetime as dt
 from collections import Counter
 from xml.etree import ElementTree
+from xml.parsers import expat
 from django.contrib.postgres.fields import JSONField
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchVectorField
@@ -83,12 +84,18 @@ class Tag(models.Model):
 
 class BaseModel(models.Model):
     created = models.DateTimeField(default=timezone.now)
+    # When the object last changed -- including its tags, see blog.signals --
+    # for conditional GETs (see blog.conditional)
+    updated = models.DateTimeField(auto_now=True)
     tags = models.ManyToManyField(Tag, blank=True)
     slug = models.SlugField(max_length=64)
     latitude = models.FloatField(blank=True, null=True)
     longitude = models.FloatField(blank=True, null=True)
     metadata = JSONField(blank=True, default=dict)
     search_document = SearchVectorField(null=True)
+    # Space-separated tags, kept up to date by database triggers when
+    # SEARCH_DOCUMENT_TRIGGERS is on (see blog.search).
+    tag_text = models.TextField(blank=True, default="", editable=False)
     import_ref = models.TextField(max_length=64, null=True, unique=True)
 
     @property
@@ -111,7 +118,10 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
         ordering = ("-created",)
-        indexes = [GinIndex(fields=["search_document"])]
+        indexes = [
+            GinIndex(fields=["search_document"]),
+            models.Index(fields=["created"]),
+        ]
 
 
 class Series(models.Model):
@@ -132,9 +142,34 @@ class Series(models.Model):
         return self.entries.order_by("created")
 
 
+def body_xml_error(body):
+    """
+    Checks that `body` is well-formed XML content (what the entry_tags filters
+    parse). Returns None if it is, or else a (message, line, column) tuple.
+    """
+    try:
+        ElementTree.fromstring("<entry>%s</entry>" % body)
+    except ElementTree.ParseError as e:
+        line, column = e.position
+        if line == 1:
+            column -= len("<entry>")
+        return expat.ErrorString(e.code), line, column
+    return None
+
+
+def format_xml_error(error):
+    message, line, column = error
+    return "line %d, column %d: %s" % (line, column, message)
+
+
 class Entry(BaseModel):
     title = models.CharField(max_length=255, blank=True)
     body = models.TextField()
+    # Whether body is well-formed XML -- None if it hasn't been checked -- and
+    # if not, where it goes wrong. Kept up to date by save() and
+    # validate_entries_xml.
+    body_valid = models.BooleanField(null=True, editable=False)
+    body_error = models.TextField(blank=True, default="", editable=False)
     summary = models.TextField(blank=True)
     tweet_html = models.TextField(
         blank=True,
@@ -157,6 +192,12 @@ class Entry(BaseModel):
 
     is_entry = True
 
+    def save(self, *args, **kwargs):
+        error = body_xml_error(self.body)
+        self.body_valid = error is None
+        self.body_error = format_xml_error(error) if error else ""
+        super().save(*args, **kwargs)
+
     def images(self):
         """Extracts images from entry.body"""
         et = ElementTree.fromstring("<entry>%s</entry>" % self.body)
@@ -166,9 +207,16 @@ class Entry(BaseModel):
         return {
             "A": self.title,
             "C": strip_tags(self.body),
-            "B": " ".join(self.tags.values_list("tag", flat=True)),
+            "B": self.tag_summary(),
         }
 
+    # The same as index_components(), in SQL, for the database triggers
+    index_components_sql = {
+        "A": "NEW.title",
+        "C": "regexp_replace(NEW.body, '<[^>]*>', '', 'g')",
+        "B": "NEW.tag_text",
+    }
+
     def __str__(self):
         return (
             self.title
@@ -194,10 +242,16 @@ class Quotation(BaseModel):
     def index_components(self):
         return {
             "A": self.quotation,
-            "B": " ".join(self.tags.values_list("tag", flat=True)),
+            "B": self.tag_summary(),
             "C": self.source,
         }
 
+    index_components_sql = {
+        "A": "NEW.quotation",
+        "B": "NEW.tag_text",
+        "C": "NEW.source",
+    }
+
     def __str__(self):
         return self.quotation
 
@@ -214,12 +268,19 @@ class Blogmark(BaseModel):
     def index_components(self):
         return {
             "A": self.link_title,
-            "B": " ".join(self.tags.values_list("tag", flat=True)),
+            "B": self.tag_summary(),
             "C": " ".join(
                 [self.commentary, self.link_domain(), (self.via_title or "")]
             ),
         }
 
+    index_components_sql = {
+        "A": "NEW.link_title",
+        "B": "NEW.tag_text",
+        "C": "concat_ws(' ', NEW.commentary, split_part(NEW.link_url, '/', 3), "
+        "COALESCE(NEW.via_title, ''))",
+    }
+
     def __str__(self):
         return self.link_title
 
@@ -244,10 +305,38 @@ class Photo(BaseModel):
     def index_components(self):
         return {
             "A": self.title,
-            "B": " ".join(self.tags.values_list("tag", flat=True)),
+            "B": self.tag_summary(),
             "C": "",
         }
 
+    index_components_sql = {"A": "NEW.title", "B": "NEW.tag_text", "C": "''"}
+
+
+class PinboardCursor(models.Model):
+    """
+    How far the Pinboard sync (blog.pinboard_sync) has got: Pinboard's update
+    time as of the last sync, and the meta hash of every bookmark synced, keyed
+    by url hash. There's only ever one row.
+    """
+
+    last_update = models.DateTimeField(null=True)
+    posts = JSONField(default=dict)
+
+    def __str__(self):
+        return "%d bookmarks, last updated %s" % (len(self.posts), self.last_update)
+
+
+def tag_ids(names):
+    """
+    Returns a {name: id} dict for the given tag names, creating any tags that
+    don't exist yet -- in two queries, however many tags there are.
+    """
+    names = set(names)
+    if not names:
+        return {}
+    Tag.objects.bulk_create([Tag(tag=name) for name in names], ignore_conflicts=True)
+    return dict(Tag.objects.filter(tag__in=names).values_list("tag", "id"))
+
 
 def load_mixed_objects(dicts):
     """
@@ -277,3 +366,30 @@ def load_mixed_objects(dicts):
             item.original_dict = d
         to_return.append(item)
     return to_return
+
+
+def recent_item_dicts(limit, klasses=(Entry, Blogmark, Quotation)):
+    """
+    Returns the `limit` most recent items across the given models as a list of
+    {'type', 'pk', 'created'} dicts, found with a single UNION query.
+    """
+    querysets = [
+        klass.objects.annotate(
+            type=models.Value(klass._meta.model_name, output_field=models.CharField())
+        )
+        .values("pk", "type", "created")
+        .order_by()
+        for klass in klasses
+    ]
+    qs = querysets[0]
+    if len(querysets) > 1:
+        qs = qs.union(*querysets[1:])
+    return list(qs.order_by("-created")[:limit])
+
+
+def recent_items(limit, klasses=(Entry, Blogmark, Quotation)):
+    """
+    Returns the `limit` most recent ORM objects across the given models, most
+    recent first, with tags prefetched.
+    """
+    return [o for o in load_mixed_objects(recent_item_dicts(limit, klasses)) if o]
@@ -0,0 +1,261 @@
+"""
+Origin page cache for anonymous requests, invalidated by surrogate key.
+
+Public views are wrapped with @surrogate_keys, naming what their output
+depends on: an item ("entry:12"), a date bucket ("day:2019-03-04",
+"month:2019-03", "year:2019"), a tag ("tag:python"), a list of content
+("entries", "home", "search") and so on. Every page also carries "site". The
+keys are sent downstream in a Surrogate-Key header, along with a default
+Cache-Control if the view didn't set one.
+
+PageCacheMiddleware stores rendered pages for anonymous GETs, and serves them
+until they expire or one of their keys is invalidated. Since cache backends
+can't find entries by key, invalidation is generational: each surrogate key
+has a generation in the cache, every stored page remembers the generations of
+its keys, and invalidate() just moves the generations on. blog.signals
+invalidates keys_for_object() when content changes, once the change commits.
+
+Pages of GZIP_MIN_SIZE bytes or more are stored gzipped, and served that way
+(with Content-Encoding: gzip) to clients that accept it, so that hits don't
+compress the same page over and over; other clients get it decompressed. So
+that downstream caches see the same page whether it came from the cache or
+not, such pages vary by Accept-Encoding, and have weak ETags, on misses too.
+"""
+
+import gzip
+import hashlib
+import re
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+from blog.rendering import BYPASS_PAGE_CACHE
+
+# Cache-Control for public pages that don't set their own
+DEFAULT_CACHE_CONTROL = "s-maxage=200"
+
+# Smaller pages are stored as they are
+GZIP_MIN_SIZE = 1024
+
+COMPRESSIBLE_TYPES = re.compile(r"^text/|[/+](xml|json|javascript)\b")
+accepts_gzip = re.compile(r"\bgzip\b")
+
+
+def generation_key(key):
+    return "surrogate:%s" % key
+
+
+def invalidate(keys):
+    """Invalidates every cached page tagged with any of `keys`."""
+    cache.set_many({generation_key(k): time.time() for k in keys}, None)
+
+
+def generations(keys):
+    """Returns {key: generation} for `keys`, starting any that are missing."""
+    found = cache.get_many([generation_key(k) for k in keys])
+    result, missing = {}, {}
+    for key in keys:
+        result[key] = found.get(generation_key(key))
+        if result[key] is None:
+            result[key] = missing[generation_key(key)] = time.time()
+    if missing:
+        cache.set_many(missing, None)
+    return result
+
+
+def date_keys(d):
+    return [
+        "day:%s" % d.isoformat(),
+        "month:%s" % d.strftime("%Y-%m"),
+        "year:%d" % d.year,
+    ]
+
+
+LIST_KEYS = {"entry": "entries", "blogmark": "blogmarks", "quotation": "quotations"}
+
+
+def keys_for_object(obj):
+    """Returns the surrogate keys of the pages a model instance appears on."""
+    if obj._meta.label == "speaking_portfolio.Presentation":
+        return ["presentation:%s" % obj.slug, "speaking", "home"]
+    if obj._meta.label == "speaking_portfolio.Coverage":
+        return keys_for_object(obj.presentation)
+    type_name = obj._meta.model_name
+    return (
+        ["%s:%d" % (type_name, obj.pk), LIST_KEYS[type_name]]
+        + date_keys(timezone.localdate(obj.created))
+        + ["tag:%s" % t.tag for t in obj.tags.all()]
+        + ["tags", "home", "search", "sitemap"]
+    )
+
+
+def add_surrogate_keys(request, *keys):
+    """Adds keys to the current request's page, from inside a view."""
+    request.surrogate_keys = getattr(request, "surrogate_keys", []) + list(keys)
+
+
+def surrogate_keys(keys=(), cache_page=True):
+    """
+    Decorator for public views. `keys` is a list of surrogate keys, or a
+    function taking the view's arguments and returning one. With
+    `cache_page=False` the headers are still set but PageCacheMiddleware
+    doesn't store the page (for views that do their own caching, or count
+    requests).
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            page_keys = list(keys(*args, **kwargs) if callable(keys) else keys)
+            page_keys += getattr(request, "surrogate_keys", [])
+            page_keys.append("site")
+            response.surrogate_keys = list(dict.fromkeys(page_keys))
+            response.cache_page = cache_page
+            response["Surrogate-Key"] = " ".join(response.surrogate_keys)
+            if not response.has_header("Cache-Control"):
+                response["Cache-Control"] = DEFAULT_CACHE_CONTROL
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+class PageCacheMiddleware:
+    """
+    Serves anonymous GET (and HEAD) requests from the page cache; see the
+    module docstring. Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "stored": 0,
+            "gzip_hits": 0,
+        }
+
+    def __call__(self, request):
+        if not self.cacheable_request(request):
+            return self.get_response(request)
+
+        key = self.cache_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            if generations(list(entry["generations"])) == entry["generations"]:
+                self.count("hits")
+                response = self.cached_response(request, entry)
+                # The page's own validators, if it has any (see
+                # blog.conditional)
+                return get_conditional_response(
+                    request,
+                    etag=response.get("ETag"),
+                    last_modified=parse_http_date_safe(
+                        response.get("Last-Modified", "")
+                    ),
+                    response=response,
+                )
+            self.count("stale")
+        self.count("misses")
+
+        start = time.time()
+        response = self.get_response(request)
+        if self.cacheable_response(response):
+            if self.compressible(response):
+                self.patch_encoding_headers(response)
+            if request.method == "GET":
+                self.store(key, response, start)
+        response["X-Page-Cache"] = "miss"
+        return response
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def cacheable_request(self, request):
+        return (
+            settings.PAGE_CACHE_TIMEOUT
+            and request.method in ("GET", "HEAD")
+            and not request.user.is_authenticated
+            and not request.META.get(BYPASS_PAGE_CACHE)
+        )
+
+    def cacheable_response(self, response):
+        return (
+            getattr(response, "cache_page", False)
+            and response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+        )
+
+    def cache_key(self, request):
+        url = "%s://%s%s" % (
+            request.scheme,
+            request.get_host(),
+            request.get_full_path(),
+        )
+        return "page:%s" % hashlib.md5(url.encode("utf8")).hexdigest()
+
+    def store(self, key, response, start):
+        found = cache.get_many([generation_key(k) for k in response.surrogate_keys])
+        if any(generation > start for generation in found.values()):
+            # Invalidated while the page was being rendered, so it may already
+            # be out of date
+            return
+        page_generations = generations(response.surrogate_keys)
+        entry = {
+            "generations": page_generations,
+            "status": response.status_code,
+            "headers": list(response.items()),
+        }
+        if self.compressible(response):
+            # mtime=0, so that the same page always gives the same bytes
+            entry["gzip"] = gzip.compress(response.content, mtime=0)
+        else:
+            entry["content"] = response.content
+        cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT)
+        self.count("stored")
+
+    def compressible(self, response):
+        return (
+            len(response.content) >= GZIP_MIN_SIZE
+            and not response.has_header("Content-Encoding")
+            and COMPRESSIBLE_TYPES.search(response.get("Content-Type", ""))
+        )
+
+    def cached_response(self, request, entry):
+        content, encoding = entry.get("content"), None
+        if "gzip" in entry:
+            if accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+                content, encoding = entry["gzip"], "gzip"
+                self.count("gzip_hits")
+            else:
+                content = gzip.decompress(entry["gzip"])
+        response = HttpResponse(content, status=entry["status"])
+        for header, value in entry["headers"]:
+            response[header] = value
+        if "gzip" in entry:
+            self.patch_encoding_headers(response)
+        if encoding:
+            response["Content-Encoding"] = encoding
+        response["X-Page-Cache"] = "hit"
+        return response
+
+    def patch_encoding_headers(self, response):
+        """
+        For pages that are stored gzipped, and so may be served either way.
+        Both are the same page, so share a weak ETag.
+        """
+        patch_vary_headers(response, ["Accept-Encoding"])
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
@@ -0,0 +1,51 @@
+"""
+Spreading a management command's work over worker processes.
+
+reindex_all, build_static, validate_entries_xml and warm_caches split their
+work into chunks, and run_chunks() hands those to a pool of forked worker
+processes (or, with --workers=1, does them in this one). Forked workers
+inherit everything but can't share the parent's database connections, so
+those are closed first, and every worker opens its own. The workers are all
+started before the first chunk is read, since chunks may come from a cursor
+that's still streaming rows, and at most two chunks per worker are read ahead
+of the results.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.db import connections
+
+
+def run_chunks(function, chunks, workers, *args):
+    """
+    Calls `function(chunk, *args)` for each of `chunks` (any iterable) in
+    `workers` forked processes, and yields (chunk, result) pairs as they
+    finish -- in order only with a single worker. `function` must be defined
+    at module level, so that workers can find it.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield chunk, function(chunk, *args)
+        return
+
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("fork")
+    ) as pool:
+        # The pool forks every worker on its first task
+        pool.submit(os.getpid).result()
+        in_flight = {}
+        for chunk in chunks:
+            in_flight[pool.submit(function, chunk, *args)] = chunk
+            if len(in_flight) >= workers * 2:
+                yield from finished(in_flight)
+        while in_flight:
+            yield from finished(in_flight)
+
+
+def finished(in_flight):
+    """Waits for at least one of `in_flight` ({future: chunk}) to finish."""
+    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+    for future in done:
+        yield in_flight.pop(future), future.result()
@@ -0,0 +1,211 @@
+"""
+Syncs public Pinboard bookmarks into blogmarks.
+
+A sync asks Pinboard for its last update time and stops there if nothing has
+changed since the last sync. Otherwise it fetches every bookmark and compares
+each one's meta hash (which Pinboard changes on every edit) against the cursor
+kept in PinboardCursor: only new and edited bookmarks are written, in batches,
+and bookmarks that have disappeared (or become private) are deleted.
+
+A bookmark list that's empty, or would delete more than MAX_DELETE_FRACTION of
+the bookmarks we know about (and more than MAX_DELETE_ALWAYS of them), is much
+more likely a Pinboard hiccup than a clear-out, so the sync stops there with
+TooManyDeletions, unless it's forced.
+"""
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from .caching import bump_content_version
+from .models import Blogmark, PinboardCursor, tag_ids
+from .search import reindex
+from .signals import bulk_pages_changed
+
+REF_PREFIX = "pinboard:"
+BATCH_SIZE = 500
+MAX_DELETE_FRACTION = 0.1
+MAX_DELETE_ALWAYS = 10
+FIELDS = [
+    "slug",
+    "link_url",
+    "link_title",
+    "commentary",
+    "created",
+    "metadata",
+    "updated",
+]
+
+
+class TooManyDeletions(Exception):
+    pass
+
+
+class PinboardClient:
+    """
+    Just enough of the Pinboard v1 API for syncing. `base_url` defaults to
+    settings.PINBOARD_API_URL, so tests and benchmarks can point it elsewhere.
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout=30):
+        self.api_key = api_key or settings.PINBOARD_API_KEY
+        self.base_url = (base_url or settings.PINBOARD_API_URL).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def get(self, method, **params):
+        params.update(auth_token=self.api_key, format="json")
+        response = self.session.get(
+            f"{self.base_url}/{method}", params=params, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def last_update(self):
+        return parse_datetime(self.get("posts/update")["update_time"])
+
+    def all_posts(self):
+        posts = self.get("posts/all", meta=1)
+        if not isinstance(posts, list):
+            raise ValueError(f"expected a list of bookmarks, got {posts!r:.200}")
+        return posts
+
+
+def load_cursor():
+    """
+    Returns the cursor, creating it on the first sync from blogmarks already
+    imported from Pinboard (by an earlier sync, or import_blog_json).
+    """
+    cursor, created = PinboardCursor.objects.get_or_create(pk=1)
+    if created:
+        refs = Blogmark.objects.filter(import_ref__startswith=REF_PREFIX).values_list(
+            "import_ref", "metadata__pinboard_meta"
+        )
+        cursor.posts = {ref[len(REF_PREFIX) :]: meta for ref, meta in refs}
+        cursor.save()
+    return cursor
+
+
+def blogmark_fields(post):
+    return dict(
+        slug=slugify(post["description"])[:64].strip("-"),
+        link_url=post["href"],
+        link_title=post["description"],
+        commentary=post["extended"],
+        created=parse_datetime(post["time"]),
+        metadata={"pinboard_meta": post["meta"]},
+    )
+
+
+def sync(client=None, batch_size=BATCH_SIZE, force=False, log=None):
+    """
+    Brings blogmarks up to date with Pinboard. Returns a dict of counts:
+    created, updated, deleted, unchanged and private. With `force`, every
+    bookmark is rewritten, whatever Pinboard and the cursor say, and any
+    number of them may be deleted.
+    """
+    client = client or PinboardClient()
+    log = log or (lambda message: None)
+    stats = dict.fromkeys(["created", "updated", "deleted", "unchanged", "private"], 0)
+
+    cursor = load_cursor()
+    last_update = client.last_update()
+    if not force and cursor.last_update and last_update <= cursor.last_update:
+        log(f"no updates since {cursor.last_update}")
+        return stats
+
+    posts = {}
+    for post in client.all_posts():
+        if post["shared"] == "yes":
+            posts[post["hash"]] = post
+        else:
+            stats["private"] += 1
+    changed = [p for h, p in posts.items() if force or cursor.posts.get(h) != p["meta"]]
+    gone = [h for h in cursor.posts if h not in posts]
+    stats["unchanged"] = len(posts) - len(changed)
+    limit = max(MAX_DELETE_ALWAYS, MAX_DELETE_FRACTION * len(cursor.posts))
+    if gone and not force and (not posts or len(gone) > limit):
+        # Before writing anything, and without moving the cursor on, so the
+        # next sync tries again
+        raise TooManyDeletions(
+            f"Pinboard returned {len(posts)} bookmarks, which would delete "
+            f"{len(gone)} of {len(cursor.posts)}; force the sync if that's right"
+        )
+
+    touched = []
+    for i in range(0, len(changed), batch_size):
+        batch = changed[i : i + batch_size]
+        with transaction.atomic():
+            created, updated = upsert_blogmarks(batch)
+            cursor.posts.update((post["hash"], post["meta"]) for post in batch)
+            cursor.save(update_fields=["posts"])
+        stats["created"] += len(created)
+        stats["updated"] += len(updated)
+        touched.extend(created + updated)
+        log(f"{i + len(batch)}/{len(changed)} bookmarks written")
+
+    with transaction.atomic():
+        if gone:
+            doomed = Blogmark.objects.filter(
+                import_ref__in=[REF_PREFIX + h for h in gone]
+            )
+            bulk_pages_changed(Blogmark, doomed.values_list("pk", flat=True))
+            _, deleted = doomed.delete()
+            stats["deleted"] = deleted.get(Blogmark._meta.label, 0)
+            for h in gone:
+                del cursor.posts[h]
+        cursor.last_update = last_update
+        cursor.save()
+
+    if touched and not settings.SEARCH_DOCUMENT_TRIGGERS:
+        reindex(Blogmark, touched)
+    if touched or gone:
+        bump_content_version()
+    return stats
+
+
+def upsert_blogmarks(posts):
+    """
+    Creates or updates (by import_ref) the blogmarks for `posts`, and their
+    tags. Returns the pks of the created and of the updated blogmarks.
+    """
+    refs = [REF_PREFIX + post["hash"] for post in posts]
+    existing = dict(
+        Blogmark.objects.filter(import_ref__in=refs).values_list("import_ref", "pk")
+    )
+    to_create, to_update = [], []
+    # bulk_update() doesn't set auto_now fields itself
+    now = timezone.now()
+    for ref, post in zip(refs, posts):
+        blogmark = Blogmark(
+            import_ref=ref, pk=existing.get(ref), updated=now, **blogmark_fields(post)
+        )
+        (to_update if blogmark.pk else to_create).append((blogmark, post))
+
+    # Where the updated blogmarks were, in case their dates or slugs change
+    bulk_pages_changed(Blogmark, existing.values())
+    Blogmark.objects.bulk_create([b for b, _ in to_create])
+    Blogmark.objects.bulk_update([b for b, _ in to_update], FIELDS)
+
+    through = Blogmark.tags.through
+    updated = [b.pk for b, _ in to_update]
+    if updated:
+        with connection.cursor() as c:
+            c.execute(
+                "DELETE FROM %s WHERE blogmark_id = ANY(%%s)" % through._meta.db_table,
+                [updated],
+            )
+    tags = [(b, set(post["tags"].split())) for b, post in to_create + to_update]
+    ids = tag_ids(tag for _, names in tags for tag in names)
+    through.objects.bulk_create(
+        [
+            through(blogmark_id=b.pk, tag_id=ids[name])
+            for b, names in tags
+            for name in names
+        ]
+    )
+    created = [b.pk for b, _ in to_create]
+    bulk_pages_changed(Blogmark, created + updated)
+    return created, updated
@@ -0,0 +1,88 @@
+"""
+Which tag pages and searches get asked for most.
+
+PopularPagesMiddleware counts successful anonymous requests for paths under
+TRACKED_PATHS (full paths, so each search is counted separately) in memory,
+and every FLUSH_INTERVAL seconds merges the counts into the cache, where every
+process adds to the same tally. Only the MAX_TRACKED most requested paths are
+kept, and the tally expires if nobody's asked for anything for a week.
+warm_caches uses it to decide which pages to render -- so the site's own
+requests (see blog.rendering) aren't counted, or warming a page would make it
+more popular, and so warmed again.
+"""
+
+import collections
+import threading
+import time
+from django.core.cache import cache
+from blog.rendering import is_internal
+
+TRACKED_PATHS = ("/tags/", "/search/")
+POPULAR_KEY = "popular-pages"
+MAX_TRACKED = 500
+FLUSH_INTERVAL = 60
+POPULAR_TIMEOUT = 7 * 24 * 60 * 60
+
+
+class PopularPages:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = collections.Counter()
+        self.flushed = time.monotonic()
+
+    def record(self, path):
+        with self.lock:
+            self.pending[path] += 1
+            due = time.monotonic() - self.flushed >= FLUSH_INTERVAL
+            if due:
+                self.flushed = time.monotonic()
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, collections.Counter()
+        if not pending:
+            return
+        # Not atomic, so counts from another process flushing at just the same
+        # moment can be lost -- which is fine for a popularity contest
+        counts = collections.Counter(cache.get(POPULAR_KEY, {}))
+        counts.update(pending)
+        cache.set(POPULAR_KEY, dict(counts.most_common(MAX_TRACKED)), POPULAR_TIMEOUT)
+
+    def top(self, prefix, n):
+        """Returns the `n` most requested paths under `prefix`."""
+        counts = collections.Counter(cache.get(POPULAR_KEY, {}))
+        with self.lock:
+            counts.update(self.pending)
+        return [
+            path
+            for path, _ in counts.most_common()
+            if path.startswith(prefix) and path != prefix
+        ][:n]
+
+
+popular_pages = PopularPages()
+
+
+class PopularPagesMiddleware:
+    """
+    Counts requests for popular_pages. Must come after
+    AuthenticationMiddleware, and before PageCacheMiddleware (so that pages
+    served from the cache count too).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            request.method == "GET"
+            and response.status_code == 200
+            and request.path.startswith(TRACKED_PATHS)
+            and not request.user.is_authenticated
+            and not is_internal(request)
+        ):
+            popular_pages.record(request.get_full_path())
+        return response
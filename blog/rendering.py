@@ -0,0 +1,72 @@
+"""
+Requesting the site's own pages, in-process, for build_static, warm_caches and
+benchmarks.
+
+SiteClient runs each request through the full Django stack -- middleware and
+all, via the WSGI handler -- as an anonymous visitor to `base_url`, but
+without the request_started and request_finished signals, so that a worker
+keeps its database connection from one page to the next. Requests are
+marked as internal in the WSGI environ (which no HTTP header can set), so
+they aren't counted as visits (see blog.popularity); with `bypass_page_cache`
+they skip the page cache (see blog.page_cache), so pages are always rendered
+afresh.
+"""
+
+import collections
+import io
+import sys
+import urllib.parse
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+
+# WSGI environ keys
+INTERNAL = "blog.internal"
+BYPASS_PAGE_CACHE = "blog.bypass_page_cache"
+
+Page = collections.namedtuple("Page", ["status", "headers", "content"])
+
+
+def is_internal(request):
+    return bool(request.META.get(INTERNAL))
+
+
+class SiteClient:
+    def __init__(self, base_url=None, bypass_page_cache=False):
+        base = urllib.parse.urlsplit(base_url or settings.SITE_URL)
+        self.scheme = base.scheme
+        self.host = base.netloc
+        self.bypass_page_cache = bypass_page_cache
+        self.handler = WSGIHandler()
+
+    def environ(self, url):
+        path, _, query = url.partition("?")
+        host, _, port = self.host.partition(":")
+        return {
+            "REQUEST_METHOD": "GET",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote_to_bytes(path).decode("iso-8859-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": host,
+            "SERVER_PORT": port or ("443" if self.scheme == "https" else "80"),
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "HTTP_HOST": self.host,
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": self.scheme,
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": False,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+            INTERNAL: True,
+            BYPASS_PAGE_CACHE: self.bypass_page_cache,
+        }
+
+    def get(self, url):
+        """Requests `url` (a path, and maybe a query string); returns a Page."""
+        response = self.handler.get_response(WSGIRequest(self.environ(url)))
+        if response.streaming:
+            content = b"".join(response.streaming_content)
+        else:
+            content = response.content
+        return Page(response.status_code, dict(response.items()), content)
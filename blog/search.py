@@ -0,0 +1,267 @@
+"""
+Maintenance of the search_document column.
+
+Saving content (or changing its tags) queues the object for reindexing.
+The queue is de-duplicated by (model, pk), and flushed when the transaction
+commits: search documents for a whole batch of objects are computed from
+their index_components() and written with a single UPDATE ... FROM (VALUES
+...) per batch.
+
+Alternatively (SEARCH_DOCUMENT_TRIGGERS) Postgres can maintain
+search_document itself, using triggers installed by the search_triggers
+command: so writes that bypass signals -- queryset.update(), bulk_create(),
+raw SQL -- are indexed too, and saving never waits on a Python reindex.
+"""
+
+import logging
+import time
+from django.apps import apps
+from django.db import connection, transaction
+from blog.commit_queue import CommitQueue
+
+log = logging.getLogger(__name__)
+
+REINDEX_BATCH_SIZE = 500
+
+
+def reindex(model, pks, batch_size=REINDEX_BATCH_SIZE):
+    """
+    Rebuilds search_document for the `model` objects with the given pks.
+    Returns the number of rows updated.
+    """
+    pks = sorted(pks)
+    updated = 0
+    for i in range(0, len(pks), batch_size):
+        objects = model.objects.filter(pk__in=pks[i : i + batch_size])
+        updated += update_search_documents(model, objects.prefetch_related("tags"))
+    return updated
+
+
+def update_search_documents(model, objects):
+    """
+    Writes search_document for each of `objects` (ideally with tags
+    prefetched) in one statement. Returns the number of rows updated.
+    """
+    rows = [(obj.pk, obj.index_components()) for obj in objects]
+    if not rows:
+        return 0
+
+    # Each component becomes setweight(to_tsvector(...)), concatenated in
+    # index_components() order -- the same vector SearchVector() builds.
+    weights = list(rows[0][1])
+    columns = ["c%d" % i for i in range(len(weights))]
+    vector = " || ".join(
+        "setweight(to_tsvector(COALESCE(v.%s, '')), '%s')" % (column, weight)
+        for column, weight in zip(columns, weights)
+    )
+    row_sql = "(%s::integer" + ", %s::text" * len(weights) + ")"
+    params = []
+    for pk, components in rows:
+        params.append(pk)
+        params.extend(components[weight] for weight in weights)
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    sql = "UPDATE %s SET search_document = %s FROM (VALUES %s) AS v(id, %s) " % (
+        table,
+        vector,
+        ", ".join([row_sql] * len(rows)),
+        ", ".join(columns),
+    ) + ("WHERE %s.id = v.id" % table)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+class ReindexQueue(CommitQueue):
+    """
+    De-duplicated queue of objects waiting for their search_document to be
+    rebuilt: batches are {model: set of pks}. Reindexing runs in a worker
+    thread if SEARCH_REINDEX_IN_BACKGROUND is set.
+    """
+
+    title = "Search reindex queue"
+    thread_name = "search-reindex"
+    background_setting = "SEARCH_REINDEX_IN_BACKGROUND"
+    background_default = False
+    initial_stats = {
+        "queued": 0,
+        "reindexed": 0,
+        "flushes": 0,
+        "max_depth": 0,
+        "last_flush_seconds": 0.0,
+        "total_flush_seconds": 0.0,
+    }
+
+    def new_batch(self):
+        return {}
+
+    def merge(self, batch, other):
+        for model, pks in other.items():
+            batch.setdefault(model, set()).update(pks)
+
+    @property
+    def depth(self):
+        return sum(len(pks) for pks in self.pending.values())
+
+    def add(self, model, pks):
+        pks = set(pks)
+        self.enqueue({model: pks})
+        depth = self.depth
+        with self.lock:
+            self.stats["queued"] += len(pks)
+            self.stats["max_depth"] = max(self.stats["max_depth"], depth)
+
+    def process(self, batch):
+        start = time.perf_counter()
+        reindexed = sum(reindex(model, pks) for model, pks in batch.items())
+        duration = time.perf_counter() - start
+        with self.lock:
+            self.stats["reindexed"] += reindexed
+            self.stats["flushes"] += 1
+            self.stats["last_flush_seconds"] = duration
+            self.stats["total_flush_seconds"] += duration
+        log.info(
+            "reindexed %d objects in %.3fs, %d batches waiting",
+            reindexed,
+            duration,
+            self.work.qsize(),
+        )
+
+
+reindex_queue = ReindexQueue()
+
+
+SEARCH_DOCUMENT_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION %(table)s_search_document() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_document := %(vector)s;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS %(table)s_search_document ON %(table)s;
+    CREATE TRIGGER %(table)s_search_document
+        BEFORE INSERT OR UPDATE ON %(table)s
+        FOR EACH ROW EXECUTE PROCEDURE %(table)s_search_document();
+"""
+
+TAG_TEXT_SQL = """
+    COALESCE((
+        SELECT string_agg(blog_tag.tag, ' ' ORDER BY blog_tag.tag)
+            FROM blog_tag, %(m2m_table)s
+        WHERE blog_tag.id = %(m2m_table)s.tag_id
+            AND %(m2m_table)s.%(m2m_column)s = %(table)s.id
+    ), '')
+"""
+
+TAG_TEXT_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION %(m2m_table)s_tag_text() RETURNS trigger AS $$
+    DECLARE
+        changed_id integer;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            changed_id := OLD.%(m2m_column)s;
+        ELSE
+            changed_id := NEW.%(m2m_column)s;
+        END IF;
+        UPDATE %(table)s SET tag_text = %(tag_text)s WHERE id = changed_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS %(m2m_table)s_tag_text ON %(m2m_table)s;
+    CREATE TRIGGER %(m2m_table)s_tag_text
+        AFTER INSERT OR DELETE ON %(m2m_table)s
+        FOR EACH ROW EXECUTE PROCEDURE %(m2m_table)s_tag_text();
+"""
+
+TAG_RENAME_FUNCTION_SQL = """
+    CREATE OR REPLACE FUNCTION blog_tag_tag_text() RETURNS trigger AS $$
+    BEGIN
+        %(updates)s
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS blog_tag_tag_text ON blog_tag;
+    CREATE TRIGGER blog_tag_tag_text
+        AFTER UPDATE OF tag ON blog_tag
+        FOR EACH ROW WHEN (OLD.tag IS DISTINCT FROM NEW.tag)
+        EXECUTE PROCEDURE blog_tag_tag_text();
+"""
+
+TAG_RENAME_UPDATE_SQL = """
+        UPDATE %(table)s SET tag_text = %(tag_text)s
+        WHERE id IN (
+            SELECT %(m2m_column)s FROM %(m2m_table)s WHERE tag_id = NEW.id
+        );
+"""
+
+
+def _trigger_params(model):
+    m2m = model._meta.get_field("tags").remote_field.through._meta
+    params = {
+        "table": model._meta.db_table,
+        "m2m_table": m2m.db_table,
+        "m2m_column": m2m.get_field(model._meta.model_name).column,
+        "vector": " || ".join(
+            "setweight(to_tsvector(COALESCE(%s, '')), '%s')" % (sql, weight)
+            for weight, sql in model.index_components_sql.items()
+        ),
+    }
+    params["tag_text"] = TAG_TEXT_SQL % params
+    return params
+
+
+def indexed_models():
+    from blog.models import BaseModel
+
+    return [
+        model
+        for model in apps.get_app_config("blog").get_models()
+        if issubclass(model, BaseModel)
+    ]
+
+
+def enable_triggers():
+    """
+    Installs the triggers that maintain search_document and tag_text, then
+    backfills tag_text (which in turn rebuilds every search_document).
+    """
+    updates = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in indexed_models():
+            params = _trigger_params(model)
+            cursor.execute(SEARCH_DOCUMENT_FUNCTION_SQL % params)
+            cursor.execute(TAG_TEXT_FUNCTION_SQL % params)
+            updates.append(TAG_RENAME_UPDATE_SQL % params)
+        cursor.execute(TAG_RENAME_FUNCTION_SQL % {"updates": "".join(updates)})
+        for model in indexed_models():
+            cursor.execute(
+                "UPDATE %(table)s SET tag_text = %(tag_text)s" % _trigger_params(model)
+            )
+
+
+def disable_triggers():
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in indexed_models():
+            params = _trigger_params(model)
+            cursor.execute(
+                "DROP TRIGGER IF EXISTS %(table)s_search_document ON %(table)s;"
+                "DROP FUNCTION IF EXISTS %(table)s_search_document();"
+                "DROP TRIGGER IF EXISTS %(m2m_table)s_tag_text ON %(m2m_table)s;"
+                "DROP FUNCTION IF EXISTS %(m2m_table)s_tag_text();" % params
+            )
+        cursor.execute(
+            "DROP TRIGGER IF EXISTS blog_tag_tag_text ON blog_tag;"
+            "DROP FUNCTION IF EXISTS blog_tag_tag_text();"
+        )
+
+
+def installed_triggers():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tgname FROM pg_trigger WHERE NOT tgisinternal AND tgname LIKE %s",
+            ["blog_%"],
+        )
+        return sorted(row[0] for row in cursor.fetchall())
@@ -1,43 +1,249 @@
+from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import post_save, m2m_changed
-from django.db.models import Value, TextField
-from django.contrib.postgres.search import SearchVector
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
 from django.db import transaction
-from blog.models import BaseModel, Tag
-import operator
-from functools import reduce
+from django.urls import reverse
+from django.utils import timezone
+from blog.models import BaseModel, Blogmark, Entry, Quotation, Series, Tag
+from blog.caching import bump_content_version
+from blog.cdn import purge_everything, purge_queue
+from blog.dependencies import urls_for_object
+from blog.invalidation import notify
+from blog.page_cache import invalidate, keys_for_object
+from blog.search import reindex_queue
+from blog import static_build
+from speaking_portfolio.models import Coverage, Presentation
+
+# Models whose changes are purged from Cloudflare (see blog.cdn), the page
+# cache (blog.page_cache) and the static build (blog.static_build)
+PAGE_MODELS = [Entry, Blogmark, Quotation, Presentation, Coverage]
+
+# Past this many objects changed at once, bulk_pages_changed() purges and
+# invalidates everything rather than page by page
+BULK_CHANGE_LIMIT = 500
 
 
 @receiver(post_save)
 def on_save(sender, **kwargs):
     if not issubclass(sender, BaseModel):
         return
-    transaction.on_commit(make_updater(kwargs["instance"]))
+    if not settings.SEARCH_DOCUMENT_TRIGGERS:
+        reindex_queue.add(sender, [kwargs["instance"].pk])
+    transaction.on_commit(bump_content_version)
+
+
+def on_delete(sender, **kwargs):
+    transaction.on_commit(bump_content_version)
+
+
+# Connected per model, not for every sender: any receiver that could see a
+# model's deletes stops Django from fast-deleting it.
+for model in BaseModel.__subclasses__():
+    post_delete.connect(on_delete, sender=model)
+
+
+def pages_changed(objects, tags=()):
+    """
+    Purges the pages that `objects` (and `tags`, by name) appear on from
+    Cloudflare, invalidates them in the page cache, and removes them from the
+    static build, once the transaction commits.
+    """
+    objects = list(objects)
+    if purge_queue.enabled or settings.STATIC_BUILD_ROOT:
+        urls = {url for obj in objects for url in urls_for_object(obj)}
+        urls.update(reverse("tag_detail", args=[tag]) for tag in tags)
+        purge_queue.add(urls)
+        static_build.pages_changed(urls)
+    if settings.PAGE_CACHE_TIMEOUT:
+        keys = {key for obj in objects for key in keys_for_object(obj)}
+        keys.update("tag:%s" % tag for tag in tags)
+        transaction.on_commit(lambda: invalidate(keys))
+
+
+def bulk_pages_changed(model, pks):
+    """
+    pages_changed() for bulk writes, which skip the model signals (the
+    Pinboard sync, import_blog_json, the Lanyrd import and oEmbed fetches):
+    call it with the pks of the objects of `model` that are about to be
+    updated or deleted, and again once they've been created or updated.
+    """
+    pks = list(pks)
+    if not pks or not tracking_pages():
+        return
+    objects = model.objects.filter(pk__in=pks)
+    if issubclass(model, BaseModel):
+        objects = objects.prefetch_related("tags")
+    if len(pks) <= BULK_CHANGE_LIMIT:
+        pages_changed(objects)
+        return
+    # Too many to go page by page -- except in the static build, where every
+    # page left behind would be served stale
+    if purge_queue.enabled:
+        transaction.on_commit(purge_everything)
+    if settings.PAGE_CACHE_TIMEOUT:
+        transaction.on_commit(lambda: invalidate(["site"]))
+    if settings.STATIC_BUILD_ROOT:
+        static_build.pages_changed(
+            url for obj in objects for url in urls_for_object(obj)
+        )
+
+
+def tracking_pages():
+    return (
+        purge_queue.enabled or settings.PAGE_CACHE_TIMEOUT or settings.STATIC_BUILD_ROOT
+    )
+
+
+def before_save(sender, instance, **kwargs):
+    # The pages the object was on before this save, in case its date, slug
+    # (or presentation) changed
+    if tracking_pages() and instance.pk:
+        pages_changed(sender.objects.filter(pk=instance.pk))
+
+
+def after_save(sender, instance, **kwargs):
+    if tracking_pages():
+        pages_changed([instance])
+
+
+def before_delete(sender, instance, **kwargs):
+    # Before, while the object's tags are still there to be found
+    if tracking_pages():
+        pages_changed([instance])
+
+
+for model in PAGE_MODELS:
+    pre_save.connect(before_save, sender=model)
+    post_save.connect(after_save, sender=model)
+    pre_delete.connect(before_delete, sender=model)
+
+
+def tagged_objects(tag):
+    """Everything on the site tagged with `tag`, with their tags."""
+    for model in PAGE_MODELS:
+        if issubclass(model, BaseModel):
+            yield from model.objects.filter(tags=tag).prefetch_related("tags")
+
+
+@receiver(pre_save, sender=Tag)
+def before_tag_save(sender, instance, **kwargs):
+    # A renamed tag moves its page, and changes every page its objects are on
+    if not instance.pk:
+        return
+    old = Tag.objects.filter(pk=instance.pk).values_list("tag", flat=True).first()
+    if old is not None and old != instance.tag:
+        if tracking_pages():
+            pages_changed(tagged_objects(instance), [old, instance.tag])
+        touch_tag(instance)
+
+
+@receiver(pre_delete, sender=Tag)
+def before_tag_delete(sender, instance, **kwargs):
+    # Before, while the tagged objects can still be found
+    if tracking_pages():
+        pages_changed(tagged_objects(instance), [instance.tag])
+    touch_tag(instance)
+
+
+def touch_tag(tag):
+    """
+    Moves on `updated` for everything tagged with `tag`, since their pages
+    show it (see blog.conditional).
+    """
+    now = timezone.now()
+    for model in BaseModel.__subclasses__():
+        model.objects.filter(tags=tag).update(updated=now)
+
+
+@receiver(post_save, sender=Series)
+@receiver(pre_delete, sender=Series)
+def touch_series(sender, instance, **kwargs):
+    # Every entry in a series lists it (see blog.conditional)
+    instance.entries.update(updated=timezone.now())
+
+
+# Announce changes to other processes; see blog.invalidation
+def announce_save(sender, instance, **kwargs):
+    notify(instance, "save")
+
+
+def announce_delete(sender, instance, **kwargs):
+    notify(instance, "delete")
+
+
+for model in set(BaseModel.__subclasses__() + PAGE_MODELS + [Tag]):
+    post_save.connect(announce_save, sender=model)
+    post_delete.connect(announce_delete, sender=model)
 
 
 @receiver(m2m_changed)
 def on_m2m_changed(sender, **kwargs):
     instance = kwargs["instance"]
     model = kwargs["model"]
-    if model is Tag:
-        transaction.on_commit(make_updater(instance))
+    if model is not Tag and not isinstance(instance, Tag):
+        return
+    if not settings.SEARCH_DOCUMENT_TRIGGERS:
+        queue_tag_change(instance, model, kwargs["action"], kwargs["pk_set"])
+    if tracking_pages():
+        tag_pages_changed(instance, model, kwargs["action"], kwargs["pk_set"])
+    if kwargs["action"].startswith("post_"):
+        notify(instance, "tags")
+    touch_tagged(instance, model, kwargs["action"], kwargs["pk_set"])
+    transaction.on_commit(bump_content_version)
+
+
+def queue_tag_change(instance, model, action, pk_set):
+    if model is Tag and action in ("post_add", "post_remove", "post_clear"):
+        reindex_queue.add(instance.__class__, [instance.pk])
     elif isinstance(instance, Tag):
-        for obj in model.objects.filter(pk__in=kwargs["pk_set"]):
-            transaction.on_commit(make_updater(obj))
+        # Tagging from the Tag side: queue every affected object by pk,
+        # without loading any of them.
+        if action in ("post_add", "post_remove"):
+            reindex_queue.add(model, pk_set)
+        elif action == "pre_clear":
+            reindex_queue.add(
+                model, model.objects.filter(tags=instance).values_list("pk", flat=True)
+            )
 
 
-def make_updater(instance):
-    components = instance.index_components()
-    pk = instance.pk
+def touch_tagged(instance, model, action, pk_set):
+    """
+    Moves on `updated` for objects whose tags changed, since their pages did
+    too (see blog.conditional).
+    """
+    now = timezone.now()
+    if model is Tag and isinstance(instance, BaseModel):
+        if action in ("post_add", "post_remove", "post_clear"):
+            instance.__class__.objects.filter(pk=instance.pk).update(updated=now)
+            instance.updated = now
+    elif isinstance(instance, Tag) and issubclass(model, BaseModel):
+        if action in ("post_add", "post_remove"):
+            model.objects.filter(pk__in=pk_set).update(updated=now)
+        elif action == "pre_clear":
+            model.objects.filter(tags=instance).update(updated=now)
 
-    def on_commit():
-        search_vectors = []
-        for weight, text in list(components.items()):
-            search_vectors.append(
-                SearchVector(Value(text, output_field=TextField()), weight=weight)
-            )
-        instance.__class__.objects.filter(pk=pk).update(
-            search_document=reduce(operator.add, search_vectors)
-        )
 
-    return on_commit
+def tag_pages_changed(instance, model, action, pk_set):
+    if model not in PAGE_MODELS and instance.__class__ not in PAGE_MODELS:
+        return
+    if model is Tag:
+        if action in ("post_add", "post_remove"):
+            # The object's pages, and the pages of the tags added or removed
+            tags = Tag.objects.filter(pk__in=pk_set).values_list("tag", flat=True)
+            pages_changed([instance], tags)
+        elif action == "pre_clear":
+            pages_changed([instance])
+    elif isinstance(instance, Tag):
+        if action in ("post_add", "post_remove"):
+            objects = model.objects.filter(pk__in=pk_set)
+        elif action == "pre_clear":
+            objects = model.objects.filter(tags=instance)
+        else:
+            return
+        pages_changed(objects.prefetch_related("tags"), [instance.tag])
@@ -0,0 +1,90 @@
+"""
+Pages rendered to disk by build_static, for nginx to serve straight from
+STATIC_BUILD_ROOT (see config/nginx.conf.erb).
+
+Feeds (anything under DYNAMIC_PREFIXES) are never built: they count
+subscribers (see feedstats) and answer conditional requests, so they must
+reach Django.
+
+When content changes, blog.signals removes the built copies of the pages it
+appears on once the change commits, and nginx passes those URLs to Django
+until the next build_static re-renders them (an incremental build re-renders
+any page whose file has gone). Since every dyno has its own build, the
+removal is announced on the invalidation bus (see blog.invalidation) for
+every other process to repeat. A dyno that misses announcements -- its
+listener was disconnected, say -- keeps serving what it built until
+build_static next runs, so run it regularly, not just at deploy.
+"""
+
+import os
+from django.conf import settings
+from django.db import transaction
+from blog import invalidation
+from blog.dependencies import ALWAYS
+
+MANIFEST = ".build-manifest.json"
+DYNAMIC_PREFIXES = ("/atom/",)
+
+
+def is_static(url):
+    return not url.startswith(DYNAMIC_PREFIXES)
+
+
+def output_path(url, content_type):
+    """
+    Where the page for `url` is written, relative to the output directory:
+    URLs ending in a slash become index.html (or index.xml for feeds) in the
+    matching directory.
+    """
+    path = url.lstrip("/")
+    if not path or path.endswith("/"):
+        path += "index.xml" if "xml" in content_type else "index.html"
+    return path
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fp:
+        fp.write(content)
+    os.replace(tmp, path)
+
+
+def remove_file(path):
+    for p in (path, path + ".gz"):
+        if os.path.exists(p):
+            os.unlink(p)
+
+
+def remove_pages(urls, root=None):
+    """
+    Removes the built copies of the pages at `urls` from `root` (by default
+    STATIC_BUILD_ROOT). Returns the number of pages removed.
+    """
+    root = os.path.abspath(root or settings.STATIC_BUILD_ROOT)
+    removed = 0
+    for url in urls:
+        for content_type in ("text/html", "application/xml"):
+            path = os.path.normpath(os.path.join(root, output_path(url, content_type)))
+            if path.startswith(root + os.sep) and os.path.exists(path):
+                remove_file(path)
+                removed += 1
+    return removed
+
+
+def pages_changed(urls):
+    """
+    Removes the built copies of `urls`, and the pages that are always built,
+    once the current transaction commits, in this process and every other.
+    """
+    if not settings.STATIC_BUILD_ROOT:
+        return
+    urls = sorted(set(urls).union(ALWAYS))
+    transaction.on_commit(lambda: remove_pages(urls))
+    invalidation.notify_pages(urls)
+
+
+@invalidation.register
+def on_invalidation(event):
+    if event.get("kind") == "pages" and settings.STATIC_BUILD_ROOT:
+        remove_pages(event["paths"])
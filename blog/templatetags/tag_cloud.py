@@ -3,6 +3,7 @@ from django.utils.safestring import mark_safe
 
 register = template.Library()
 
+from blog.caching import cached, content_version
 from blog.models import Tag
 
 # Classes for different levels
@@ -86,6 +87,10 @@ def _tag_cloud_helper(tags):
 
 @register.inclusion_tag("includes/tag_cloud.html")
 def tag_cloud():
+    return cached("tag-cloud", all_tags_cloud, 60 * 60, version=content_version())
+
+
+def all_tags_cloud():
     # We do this with raw SQL for efficiency
     from django.db import connection
 
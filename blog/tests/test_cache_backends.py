@@ -0,0 +1,174 @@
+import os
+import time
+import pytest
+from django.core.cache import caches
+from blog import cache_backends
+from blog.cache_backends import Codec, Compressed, TwoTierCache, _local_tiers, zstandard
+
+
+@pytest.fixture
+def shared(settings):
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "shared": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "shared",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        },
+    }
+    caches["shared"].clear()
+    yield caches["shared"]
+    _local_tiers.clear()
+
+
+def two_tier(location, **options):
+    options.setdefault("CHECK_INTERVAL", 0)
+    return TwoTierCache(location, {"OPTIONS": dict(options, SHARED="shared")})
+
+
+def test_reads_served_locally(shared):
+    cache = two_tier("a")
+    shared.set("k", "v")
+    assert cache.get("k") == "v"
+    shared.set("k", "changed behind its back")
+    assert cache.get("k") == "v"
+    assert cache.get_many(["k", "missing"]) == {"k": "v"}
+    assert cache.local.stats["local_hits"] == 2
+    assert cache.local.stats["shared_hits"] == 1
+    assert cache.hit_ratios() == {"local": 2 / 4, "shared": 1 / 2}
+
+
+def test_writes_in_other_processes_invalidate(shared):
+    a, b = two_tier("a"), two_tier("b")
+    b.set("k", 1)
+    assert a.get("k") == 1
+    b.set("k", 2)
+    assert a.get("k") == 2
+    b.delete("k")
+    assert a.get("k") is None
+    assert a.add("lock", 1) and not b.add("lock", 1)
+
+
+def test_own_writes_keep_local_tier(shared):
+    cache = two_tier("a")
+    cache.set("x", 1)
+    assert cache.get("x") == 1
+    cache.set("y", 2)
+    # Nobody else wrote, so the local tier wasn't emptied
+    assert cache.get("x") == 1
+    assert cache.local.stats["flushes"] == 0
+    assert cache.local.stats["local_hits"] == 2
+
+
+def test_writes_elsewhere_only_evict_what_they_changed(shared):
+    web, worker = two_tier("web"), two_tier("worker")
+    worker.set("content-version", 1, None)
+    assert web.get("content-version") == 1
+    # A stream of writes from the other process, to keys we don't have...
+    for i in range(200):
+        worker.set(f"page:{i}", "<p>page</p>")
+        worker.set(f"feed:{i % 10}", i)
+        web.set(f"ours:{i}", i)
+        assert web.get("content-version") == 1
+        assert web.get(f"ours:{i}") == i
+    # ...doesn't cost us our copies of the keys we do have
+    assert web.local.stats["flushes"] == 0
+    assert web.local.stats["shared_hits"] == 1
+    assert web.local.stats["remote_changes"] == 400
+    assert worker.local.stats["flushes"] == 0
+
+    worker.incr("content-version")
+    assert web.get("content-version") == 2
+
+
+def test_lost_changes_empty_local_tier(shared, monkeypatch):
+    a, b = two_tier("a"), two_tier("b")
+    b.set("k", 1)
+    assert a.get("k") == 1
+    b.set("k", 2)
+    shared.delete(cache_backends.CHANGE_KEY % shared.get(cache_backends.CHANGES_KEY))
+    # It may just not be recorded yet...
+    assert a.get("k") == 1
+    # ...but it's still not there next time
+    assert a.get("k") == 2
+    assert a.local.stats["flushes"] == 1
+
+    monkeypatch.setattr(cache_backends, "MAX_CHANGES", 3)
+    for key in "wxyz":
+        b.set(key, key)
+    assert a.get("k") == 2
+    assert a.local.stats["flushes"] == 2
+
+
+def test_local_copies_expire_with_shared_value(shared):
+    a, b = two_tier("a", LOCAL_TIMEOUT=60), two_tier("b", LOCAL_TIMEOUT=60)
+    a.set("k", "v", 0.05)
+    a.set("forever", "v", None)
+    assert b.get("k") == "v"
+    assert b.get_many(["forever"]) == {"forever": "v"}
+    time.sleep(0.1)
+    assert a.get("k") is None
+    assert b.get("k") is None
+    assert b.get("forever") == "v"
+
+
+def test_reads_get_their_own_copies(shared):
+    a, b = two_tier("a"), two_tier("b")
+    value = {"headers": [("Vary", "Cookie")]}
+    a.set("k", value)
+    value["headers"].append(("Set-Cookie", "x"))
+    for cache in (a, b, a, b):
+        copy = cache.get("k")
+        assert copy == {"headers": [("Vary", "Cookie")]}
+        copy["headers"].clear()
+    assert b.get_many(["k"])["k"]["headers"] == [("Vary", "Cookie")]
+
+
+def test_local_tier_is_bounded(shared):
+    cache = two_tier("a", LOCAL_MAX_ENTRIES=2)
+    for key in "abc":
+        cache.set(key, key)
+    assert list(cache.local.entries) == [cache.make_key("b"), cache.make_key("c")]
+    assert cache.get("a") == "a"
+
+    cache = two_tier("b", LOCAL_TIMEOUT=0.01)
+    cache.set("d", "d")
+    shared.set("d", "changed behind its back")
+    time.sleep(0.02)
+    assert cache.get("d") == "changed behind its back"
+
+
+def test_large_values_compressed_in_shared_cache(shared):
+    a, b = two_tier("a"), two_tier("b")
+    page = {"content": b"<p>Hello, world</p>" * 1000}
+    a.set("page", page)
+    a.set("small", "small")
+    a.set("count", 1)
+    assert isinstance(shared.get("page"), Compressed)
+    assert shared.get("small") == "small"
+    # Values are as they were, both locally and from the shared cache
+    assert a.get("page") == page
+    assert b.get("page") == page
+    assert b.get_many(["page", "small"]) == {"page": page, "small": "small"}
+    assert a.incr("count") == 2
+
+    report = a.compression_stats()
+    assert report["packed"] == 1
+    assert report["ratio"] < 0.1
+    # Decompressed once by the other "process", then kept in its local tier
+    assert b.codec.stats["unpacked"] == 1
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "zstd"])
+def test_codec(algorithm):
+    if algorithm == "zstd" and zstandard is None:
+        pytest.skip("needs zstandard")
+    codec = Codec(min_size=100, algorithm=algorithm)
+    value = ["some text"] * 100
+    packed = codec.pack(value)
+    assert packed.algorithm == algorithm
+    assert codec.unpack(packed) == value
+    # Not worth compressing
+    random_bytes = os.urandom(1024)
+    assert codec.pack(random_bytes) == random_bytes
+    assert codec.report()["incompressible"] == 1
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from blog.caching import cached, swr
+
+
+def test_cached_recomputes_when_stale_or_versioned():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    assert cached("k", compute, 60) == 1
+    assert cached("k", compute, 60) == 1
+    assert cached("k", compute, 60, version=2) == 2
+    # Fresh for no time at all
+    assert cached("k", compute, 0, version=3) == 3
+    assert cached("k", compute, 0, version=3) == 4
+    assert len(calls) == 4
+
+
+def test_single_flight_on_miss():
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        # Hold the lock long enough for everyone else to pile up behind it
+        threading.Event().wait(0.2)
+        return "value"
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: cached("miss", compute, 60), range(8)))
+    assert results == ["value"] * 8
+    assert len(calls) == 1
+
+
+def test_stale_served_while_one_thread_recomputes():
+    cached("stale", lambda: "old", 60)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "new"
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(cached, "stale", compute, 60, version=2)
+        while not calls:
+            threading.Event().wait(0.01)
+        followers = [
+            pool.submit(cached, "stale", compute, 60, version=2) for _ in range(3)
+        ]
+        assert [f.result(timeout=5) for f in followers] == ["old"] * 3
+        release.set()
+        assert leader.result() == "new"
+    assert len(calls) == 1
+    assert cached("stale", compute, 60, version=2) == "new"
+    assert swr.stats["stale"] >= 3
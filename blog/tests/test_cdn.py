@@ -0,0 +1,164 @@
+import datetime
+import io
+import json
+import pytest
+from django.core.management import call_command
+from django.db import transaction
+from django.utils.timezone import utc
+from blog import signals
+from blog.cdn import purge_queue, purge_urls
+from blog.factories import BlogmarkFactory, EntryFactory, QuotationFactory
+from blog.fake_cloudflare import FakeCloudflare
+from blog.models import Tag
+from speaking_portfolio.models import Conference, Presentation
+
+
+@pytest.fixture
+def cloudflare(settings):
+    with FakeCloudflare() as fake:
+        settings.CLOUDFLARE_API_URL = fake.url
+        settings.CLOUDFLARE_ZONE_ID = "zone"
+        settings.CLOUDFLARE_EMAIL = "jacob@example.com"
+        settings.CLOUDFLARE_TOKEN = "token"
+        settings.CLOUDFLARE_PURGE_IN_BACKGROUND = False
+        settings.SITE_URL = "https://example.com"
+        yield fake
+
+
+def test_purge_urls_batches(cloudflare):
+    paths = ["/%d/" % i for i in range(65)]
+    assert purge_urls(paths + paths[:5]) == 3
+    assert [len(data["files"]) for _, data in cloudflare.requests] == [30, 30, 5]
+    assert {zone for zone, _ in cloudflare.requests} == {"zone"}
+    assert sorted(cloudflare.purged) == sorted(
+        "https://example.com" + path for path in paths
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_purge_affected_pages(cloudflare):
+    created = datetime.datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+    with transaction.atomic():
+        entry = EntryFactory(slug="first", created=created)
+        entry.tags.add(Tag.objects.create(tag="python"))
+        # Nothing's purged until the transaction commits
+        assert cloudflare.requests == []
+    purged = set(cloudflare.purged)
+    assert {
+        "https://example.com/2019/mar/4/first/",
+        "https://example.com/2019/mar/4/",
+        "https://example.com/2019/mar/",
+        "https://example.com/2019/",
+        "https://example.com/tags/python/",
+        "https://example.com/atom/entries/",
+        "https://example.com/sitemap-entry-2019.xml",
+    } <= purged
+    assert "https://example.com/atom/links/" not in purged
+
+    # Moving an entry purges where it was as well as where it is
+    cloudflare.requests.clear()
+    entry.created = created + datetime.timedelta(days=40)
+    entry.save()
+    assert {
+        "https://example.com/2019/mar/4/first/",
+        "https://example.com/2019/apr/13/first/",
+    } <= set(cloudflare.purged)
+
+    cloudflare.requests.clear()
+    entry.tags.clear()
+    assert "https://example.com/tags/python/" in cloudflare.purged
+
+    cloudflare.requests.clear()
+    entry.delete()
+    assert "https://example.com/2019/apr/13/first/" in cloudflare.purged
+    assert "https://example.com/" in cloudflare.purged
+
+    cloudflare.requests.clear()
+    conference = Conference.objects.create(title="PyCon")
+    Presentation.objects.create(
+        title="Talk", slug="talk", date=created.date(), conference=conference
+    )
+    assert set(cloudflare.purged) == {
+        "https://example.com/speaking/talk/",
+        "https://example.com/speaking/",
+        "https://example.com/",
+    }
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("factory", [EntryFactory, BlogmarkFactory, QuotationFactory])
+def test_changes_purge_homepage(cloudflare, factory):
+    obj = factory()
+    assert "https://example.com/" in cloudflare.purged
+    cloudflare.requests.clear()
+    obj.save()
+    assert "https://example.com/" in cloudflare.purged
+    cloudflare.requests.clear()
+    obj.delete()
+    assert "https://example.com/" in cloudflare.purged
+
+
+@pytest.mark.django_db(transaction=True)
+def test_tag_renames_and_deletes_purge_tagged_pages(cloudflare):
+    created = datetime.datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+    tag = Tag.objects.create(tag="python")
+    EntryFactory(slug="first", created=created).tags.add(tag)
+
+    cloudflare.requests.clear()
+    tag.tag = "python3"
+    tag.save()
+    assert {
+        "https://example.com/tags/python/",
+        "https://example.com/tags/python3/",
+        "https://example.com/tags/",
+        "https://example.com/2019/mar/4/first/",
+    } <= set(cloudflare.purged)
+
+    cloudflare.requests.clear()
+    tag.save()
+    assert cloudflare.requests == []
+
+    tag.delete()
+    assert {
+        "https://example.com/tags/python3/",
+        "https://example.com/2019/mar/4/first/",
+    } <= set(cloudflare.purged)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_nothing_purged_without_zone(cloudflare, settings):
+    settings.CLOUDFLARE_ZONE_ID = ""
+    EntryFactory().tags.add(Tag.objects.create(tag="python"))
+    assert cloudflare.requests == []
+    assert not purge_queue.pending
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_imports_purge_affected_pages(cloudflare, tmp_path, monkeypatch):
+    items = [
+        {
+            "type": "quotation",
+            "datetime": "2012-01-0%dT12:00:00" % day,
+            "slug": "quote-%d" % day,
+            "import_ref": "test:%d" % day,
+            "tags": ["quotes"],
+            "quotation": "Quoted",
+            "source": "Someone",
+            "source_url": None,
+        }
+        for day in (1, 2, 3)
+    ]
+    path = tmp_path / "items.json"
+    path.write_text(json.dumps(items))
+    call_command("import_blog_json", str(path), stdout=io.StringIO())
+    assert {
+        "https://example.com/2012/jan/1/quote-1/",
+        "https://example.com/2012/jan/3/",
+        "https://example.com/tags/quotes/",
+    } <= set(cloudflare.purged)
+
+    # Too many to purge one by one
+    cloudflare.requests.clear()
+    monkeypatch.setattr(signals, "BULK_CHANGE_LIMIT", 2)
+    call_command("import_blog_json", str(path), stdout=io.StringIO())
+    assert ("zone", {"purge_everything": True}) in cloudflare.requests
@@ -0,0 +1,60 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory
+from blog import metrics
+from blog.coalescing import RequestCoalescingMiddleware
+
+
+def slow_view(calls, release):
+    def view(request):
+        calls.append(request.get_full_path())
+        release.wait(5)
+        return HttpResponse("results for %s" % request.GET.get("q"))
+
+    return view
+
+
+def get(path, **headers):
+    request = RequestFactory().get(path, **headers)
+    request.user = AnonymousUser()
+    return request
+
+
+def test_identical_requests_coalesced():
+    calls, release = [], threading.Event()
+    middleware = RequestCoalescingMiddleware(slow_view(calls, release))
+    paths = ["/search/?q=django&page=1"] * 3 + ["/search/?page=1&q=django"] * 2
+    with ThreadPoolExecutor(len(paths)) as pool:
+        leader = pool.submit(middleware, get(paths[0]))
+        while not calls:
+            threading.Event().wait(0.01)
+        followers = [pool.submit(middleware, get(path)) for path in paths[1:]]
+        while sum(f.running() for f in followers) < len(followers):
+            threading.Event().wait(0.01)
+        threading.Event().wait(0.05)
+        release.set()
+        responses = [leader.result()] + [f.result() for f in followers]
+
+    assert calls == ["/search/?q=django&page=1"]
+    assert [r.content for r in responses] == [b"results for django"] * 5
+    assert [r.has_header("X-Coalesced") for r in responses] == [False] + [True] * 4
+    assert middleware.stats == dict(leaders=1, coalesced=4, timeouts=0, not_shared=0)
+    assert middleware.in_flight == {}
+
+
+def test_different_requests_not_coalesced():
+    calls, release = [], threading.Event()
+    release.set()
+    middleware = RequestCoalescingMiddleware(slow_view(calls, release))
+    for request in (
+        get("/search/?q=one"),
+        get("/search/?q=two"),
+        get("/search/?q=one", HTTP_IF_NONE_MATCH='"x"'),
+        get("/2019/"),
+    ):
+        middleware(request)
+    assert len(calls) == 4
+    assert middleware.stats["leaders"] == 3
+    assert metrics.snapshot()["Request coalescing"]["leaders"] == 3
@@ -0,0 +1,448 @@
+import datetime
+import gzip
+import io
+import json
+import pytest
+from django.contrib.postgres.search import SearchQuery
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.timezone import now, utc
+from blog.factories import EntryFactory, BlogmarkFactory, QuotationFactory
+from blog import blog_json
+from blog.models import Entry, Blogmark, Quotation, Series
+from blog.popularity import popular_pages
+
+
+def searchable(model, term):
+    return model.objects.filter(search_document=SearchQuery(term))
+
+
+@pytest.mark.django_db
+def test_reindex_all():
+    EntryFactory.create_batch(3, title="findme")
+    BlogmarkFactory(link_title="findme")
+    QuotationFactory()
+    assert not searchable(Entry, "findme").exists()
+
+    out = io.StringIO()
+    call_command("reindex_all", "--workers=1", "--chunk-size=2", stdout=out)
+    assert searchable(Entry, "findme").count() == 3
+    assert searchable(Blogmark, "findme").count() == 1
+    assert "reindexed 5 rows" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_reindex_all_type_and_checkpoint(tmp_path):
+    entries = EntryFactory.create_batch(3, title="findme")
+    BlogmarkFactory(link_title="findme")
+    checkpoint = tmp_path / "checkpoint.json"
+    # Pretend the first chunk was done by an earlier, interrupted run
+    first = [entries[0].pk, entries[0].pk]
+    checkpoint.write_text(
+        json.dumps(
+            {
+                "options": {"since": None, "chunk_size": 1},
+                "done": {"entry": [first]},
+            }
+        )
+    )
+
+    call_command(
+        "reindex_all",
+        "--workers=1",
+        "--chunk-size=1",
+        "--type=entry",
+        f"--checkpoint={checkpoint}",
+        stdout=io.StringIO(),
+    )
+    assert set(searchable(Entry, "findme").values_list("pk", flat=True)) == {
+        e.pk for e in entries[1:]
+    }
+    assert not searchable(Blogmark, "findme").exists()
+    # Finished, so a rerun starts from scratch
+    assert not checkpoint.exists()
+
+
+@pytest.mark.django_db
+def test_reindex_all_ignores_checkpoint_from_other_options(tmp_path):
+    entries = EntryFactory.create_batch(3, title="findme")
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(
+        json.dumps(
+            {
+                "options": {"since": None, "chunk_size": 1},
+                "done": {"entry": [[entries[0].pk, entries[0].pk]]},
+            }
+        )
+    )
+    out = io.StringIO()
+    call_command(
+        "reindex_all",
+        "--workers=1",
+        "--chunk-size=2",
+        f"--checkpoint={checkpoint}",
+        stdout=out,
+    )
+    assert "different options" in out.getvalue()
+    assert searchable(Entry, "findme").count() == 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reindex_all_in_parallel(tmp_path):
+    EntryFactory.create_batch(5, title="findme")
+    BlogmarkFactory(link_title="findme")
+    checkpoint = tmp_path / "checkpoint.json"
+    out = io.StringIO()
+    call_command(
+        "reindex_all",
+        "--workers=3",
+        "--chunk-size=2",
+        f"--checkpoint={checkpoint}",
+        stdout=out,
+    )
+    assert searchable(Entry, "findme").count() == 5
+    assert searchable(Blogmark, "findme").count() == 1
+    assert "reindexed 6 rows" in out.getvalue()
+    assert not checkpoint.exists()
+
+
+IMPORT_ITEMS = [
+    {
+        "type": "entry",
+        "datetime": "2010-01-02T03:04:05",
+        "slug": "an-entry",
+        "import_ref": "test:1",
+        "tags": ["one", "two"],
+        "title": "An entry",
+        "body": "<p>Tab\there, backslash \\ there</p>",
+    },
+    {
+        "type": "blogmark",
+        "datetime": "2011-01-02T03:04:05",
+        "slug": "a-link",
+        "import_ref": "test:2",
+        "tags": ["two"],
+        "link_url": "https://example.com/",
+        "link_title": "A link",
+        "commentary": "Nice",
+    },
+    {
+        "type": "quotation",
+        "datetime": "2012-01-02T03:04:05",
+        "slug": "a-quote",
+        "tags": [],
+        "quotation": "Quoted",
+        "source": "Someone",
+        "source_url": None,
+    },
+]
+
+
+def write_items(path, items, ndjson=False):
+    with open(path, "w") as fp:
+        if ndjson:
+            fp.writelines(json.dumps(item) + "\n" for item in items)
+        else:
+            json.dump(items, fp, indent=2)
+    return str(path)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("options", [[], ["--copy"], ["--batch-size=1"]])
+def test_import_blog_json(tmp_path, options):
+    path = write_items(tmp_path / "items.json", IMPORT_ITEMS)
+    call_command(
+        "import_blog_json", path, "--tag_with=imported", *options, stdout=io.StringIO()
+    )
+
+    entry = Entry.objects.get(import_ref="test:1")
+    assert entry.body == IMPORT_ITEMS[0]["body"]
+    assert entry.metadata == IMPORT_ITEMS[0]
+    assert sorted(entry.tag_summary().split()) == ["imported", "one", "two"]
+    assert Blogmark.objects.get(import_ref="test:2").tag_summary().split() in (
+        ["two", "imported"],
+        ["imported", "two"],
+    )
+    assert Quotation.objects.get().tag_summary() == "imported"
+    # Search documents are built at the end of the import
+    assert searchable(Entry, "entry").exists()
+
+
+@pytest.mark.django_db
+def test_import_blog_json_updates_by_import_ref(tmp_path):
+    path = write_items(tmp_path / "items.json", IMPORT_ITEMS)
+    call_command("import_blog_json", path, stdout=io.StringIO())
+
+    changed = dict(IMPORT_ITEMS[0], title="Changed", tags=["three"])
+    path = write_items(tmp_path / "items.ndjson", [changed], ndjson=True)
+    call_command("import_blog_json", path, stdout=io.StringIO())
+
+    assert Entry.objects.count() == 1
+    entry = Entry.objects.get()
+    assert (entry.title, entry.tag_summary()) == ("Changed", "three")
+
+
+def test_iter_json_items_streams(monkeypatch):
+    monkeypatch.setattr(blog_json, "READ_SIZE", 7)
+    text = json.dumps(IMPORT_ITEMS, indent=2)
+    assert list(blog_json.iter_json_items(io.StringIO(text))) == IMPORT_ITEMS
+    assert list(blog_json.iter_json_items(io.StringIO("[]"))) == []
+    with pytest.raises(ValueError):
+        list(blog_json.iter_json_items(io.StringIO(text[:-20])))
+
+
+@pytest.mark.django_db
+def test_validate_entries_xml():
+    good = EntryFactory(body="<p>Fine</p>")
+    bad = EntryFactory(title="Broken")
+    # Bodies that skipped save() (e.g. imports) haven't been checked
+    Entry.objects.filter(pk=bad.pk).update(
+        body="<p>One</p>\n<p>Two</i>", body_valid=None
+    )
+
+    out = io.StringIO()
+    with pytest.raises(CommandError, match="1 entries have invalid XML"):
+        call_command("validate_entries_xml", "--workers=1", "--json", stdout=out)
+    report = json.loads(out.getvalue())
+    assert report["checked"] == 2
+    assert report["updated"] == 1
+    [invalid] = report["invalid"]
+    assert (invalid["pk"], invalid["title"]) == (bad.pk, "Broken")
+    assert (invalid["line"], invalid["column"]) == (2, 8)
+    assert invalid["error"] == "mismatched tag"
+
+    bad.refresh_from_db()
+    assert bad.body_valid is False
+    assert bad.body_error == "line 2, column 8: mismatched tag"
+    good.refresh_from_db()
+    assert good.body_valid is True
+
+    # Nothing's changed, so a second run has nothing to update
+    out = io.StringIO()
+    with pytest.raises(CommandError):
+        call_command("validate_entries_xml", "--workers=1", stdout=out)
+    assert "checked 2 entries: 1 invalid, 0 updated" in out.getvalue()
+
+
+def read_items(path):
+    with blog_json.open_json(str(path)) as fp:
+        return list(blog_json.iter_json_items(fp))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("filename", ["export.ndjson", "export.ndjson.gz"])
+def test_export_blog_json_round_trips(tmp_path, filename):
+    path = write_items(tmp_path / "items.json", IMPORT_ITEMS)
+    call_command("import_blog_json", path, stdout=io.StringIO())
+    series = Series.objects.create(slug="a-series", title="A series")
+    EntryFactory(
+        title="Not imported",
+        slug="not-imported",
+        body="<p>Local</p>",
+        summary="In short",
+        series=series,
+        latitude=51.5,
+        metadata={"from": "admin"},
+    ).tags.create(tag="local")
+
+    exported = tmp_path / filename
+    call_command("export_blog_json", str(exported), stdout=io.StringIO())
+    items = read_items(exported)
+    assert len(items) == 4
+    for original in IMPORT_ITEMS:
+        ref = original.get("import_ref")
+        [item] = [i for i in items if i["slug"] == original["slug"]]
+        expected = dict(original, import_ref=ref or item["import_ref"])
+        if original["type"] == "blogmark":
+            # Optional fields are exported empty
+            expected.update(via_url="", via_title="")
+        assert {key: item[key] for key in expected} == expected
+        assert item["metadata"] == original
+    [local] = [i for i in items if i["slug"] == "not-imported"]
+    assert local["series"] == {
+        "slug": "a-series",
+        "title": "A series",
+        "description": "",
+    }
+    assert (local["summary"], local["latitude"], local["metadata"]) == (
+        "In short",
+        51.5,
+        {"from": "admin"},
+    )
+
+    # Importing the export into an empty database and exporting again gives
+    # exactly the same items
+    for klass in (Entry, Blogmark, Quotation, Series):
+        klass.objects.all().delete()
+    call_command("import_blog_json", str(exported), stdout=io.StringIO())
+    again = tmp_path / ("again-" + filename)
+    call_command("export_blog_json", str(again), stdout=io.StringIO())
+    assert read_items(again) == items
+
+
+@pytest.mark.django_db
+def test_export_blog_json_reimports_without_duplicates(tmp_path):
+    local = EntryFactory(slug="local", title="Local")
+    exported = tmp_path / "export.ndjson"
+    call_command("export_blog_json", str(exported), stdout=io.StringIO())
+
+    # Back into the same database: the entry is matched by pk and slug...
+    Entry.objects.filter(pk=local.pk).update(title="Edited")
+    call_command("import_blog_json", str(exported), stdout=io.StringIO())
+    local.refresh_from_db()
+    assert (local.title, local.import_ref) == ("Local", f"entry:{local.pk}")
+    assert Entry.objects.count() == 1
+
+    # ...but a different entry that happens to have that pk isn't touched
+    Entry.objects.all().delete()
+    other = EntryFactory(pk=local.pk, slug="other", title="Other")
+    call_command("import_blog_json", str(exported), stdout=io.StringIO())
+    other.refresh_from_db()
+    assert other.title == "Other"
+    assert Entry.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_export_blog_json_since_and_type(tmp_path):
+    path = write_items(tmp_path / "items.json", IMPORT_ITEMS)
+    call_command("import_blog_json", path, stdout=io.StringIO())
+    EntryFactory(slug="old")
+    # --since picks out what's been changed since, whenever it was created
+    Entry.objects.update(updated=datetime.datetime(2009, 1, 1, tzinfo=utc))
+    BlogmarkFactory(slug="new", created=datetime.datetime(2001, 1, 1, tzinfo=utc))
+    out = io.StringIO()
+    call_command(
+        "export_blog_json", "--since=2011-01-01", "--type=blogmark", stdout=out
+    )
+    items = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [item["slug"] for item in items] == ["new", "a-link"]
+    out = io.StringIO()
+    call_command("export_blog_json", "--since=2011-01-01", stdout=out)
+    assert "entry" not in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_export_blog_json_zstd(tmp_path):
+    pytest.importorskip("zstandard")
+    EntryFactory()
+    exported = tmp_path / "export.ndjson.zst"
+    call_command("export_blog_json", str(exported), stdout=io.StringIO())
+    assert len(read_items(exported)) == 1
+
+
+@pytest.mark.django_db
+def test_build_static(tmp_path):
+    created = datetime.datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+    entry = EntryFactory(slug="first", created=created, body="<p>First</p>")
+    entry.tags.create(tag="python")
+    other = EntryFactory(
+        slug="second", created=created + datetime.timedelta(days=40), body="<p>2</p>"
+    )
+
+    def build(*args):
+        out = io.StringIO()
+        call_command("build_static", str(tmp_path), "--workers=1", *args, stdout=out)
+        return out.getvalue()
+
+    assert "(full build)" in build()
+    page = tmp_path / "2019/mar/4/first/index.html"
+    assert b"First" in page.read_bytes()
+    assert gzip.decompress((tmp_path / "2019/mar/4/first/index.html.gz").read_bytes())
+    for path in ("index.html", "tags/python/index.html"):
+        assert (tmp_path / path).exists(), path
+    # Feeds are left to Django
+    assert not (tmp_path / "atom").exists()
+
+    # Only pages showing the edited entry are rendered again
+    mtime = (tmp_path / "2019/apr/13/second/index.html").stat().st_mtime_ns
+    entry.body = "<p>Edited</p>"
+    entry.save()
+    assert "rendered 11 of 14 pages, removed 0, failed 0" in build()
+    assert b"Edited" in page.read_bytes()
+    assert (tmp_path / "2019/apr/13/second/index.html").stat().st_mtime_ns == mtime
+
+    # A deleted entry's page is removed
+    other.delete()
+    assert "removed 2" in build()
+    assert not (tmp_path / "2019/apr/13/second/index.html").exists()
+    assert not (tmp_path / "2019/apr/13/second/index.html.gz").exists()
+
+    # Pages whose files have gone are rendered again, changed or not
+    (tmp_path / "tags/python/index.html").unlink()
+    assert "rendered 3 of" in build()
+    assert (tmp_path / "tags/python/index.html").exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_content_changes_remove_built_pages(tmp_path, settings):
+    settings.STATIC_BUILD_ROOT = str(tmp_path)
+    created = datetime.datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+    entry = EntryFactory(slug="first", created=created, body="<p>First</p>")
+    call_command("build_static", "--workers=1", stdout=io.StringIO())
+    page = tmp_path / "2019/mar/4/first/index.html"
+    year = tmp_path / "2019/index.html"
+    assert page.exists() and year.exists()
+
+    entry.body = "<p>Edited</p>"
+    entry.save()
+    # Until the next build, nginx passes them to Django
+    assert not page.exists() and not year.exists()
+    assert not (tmp_path / "index.html").exists()
+    call_command("build_static", "--workers=1", stdout=io.StringIO())
+    assert b"Edited" in page.read_bytes()
+
+
+@pytest.mark.django_db
+def test_warm_caches(client, settings, tmp_path):
+    settings.SITE_URL = "https://example.com"
+    # Shared between processes, unlike the tests' usual LocMemCache
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": str(tmp_path),
+        }
+    }
+    popular_pages.pending.clear()
+    entry = EntryFactory(created=now())
+    entry.tags.create(tag="python")
+    entry.tags.create(tag="django")
+    for _ in range(2):
+        client.get("/search/?q=python")
+        client.get("/tags/django/")
+    client.get("/search/?q=other")
+    popular_pages.flush()
+
+    def warm(*args):
+        out = io.StringIO()
+        call_command("warm_caches", "--workers=1", *args, stdout=out)
+        return out.getvalue()
+
+    out = warm("--tags=1", "--searches=1")
+    for url in (
+        "/",
+        "/atom/everything/",
+        "/tags/",
+        "/tags/django/",
+        "/search/?q=python",
+    ):
+        assert f"\n{url}: 200 miss" in "\n" + out, url
+    assert now().strftime("/%Y/: 200 miss") in out
+    assert "/tags/python/" not in out
+    assert "q=other" not in out
+
+    num_urls = len(out.splitlines()) - 1
+
+    out = warm("--tags=1", "--searches=1")
+    assert "/tags/django/: 200 hit" in out
+    # Feeds aren't kept in the page cache, so are always warmed afresh
+    assert "3 warmed, %d already cached" % (num_urls - 3) in out
+
+    assert ", %d skipped" % num_urls in warm("--tags=1", "--searches=1", "--budget=0")
+    # Warming doesn't make pages any more popular
+    assert not popular_pages.pending
+
+    settings.CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    }
+    with pytest.raises(CommandError, match="isn't shared"):
+        warm()
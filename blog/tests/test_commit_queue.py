@@ -0,0 +1,58 @@
+import time
+import pytest
+from django.db import transaction
+from blog import metrics
+from blog.commit_queue import CommitQueue
+
+
+class RecordingQueue(CommitQueue):
+    title = "Test queue"
+    thread_name = "test-queue"
+    background_setting = "TEST_QUEUE_IN_BACKGROUND"
+    initial_stats = {"processed": 0}
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def process(self, batch):
+        if "fail" in batch:
+            raise ValueError("failed")
+        self.batches.append(batch)
+        self.count(processed=len(batch))
+
+
+@pytest.fixture
+def work_queue():
+    yield RecordingQueue()
+    del metrics.sources["Test queue"]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_work_done_once_transaction_commits(work_queue, settings):
+    settings.TEST_QUEUE_IN_BACKGROUND = False
+    with transaction.atomic():
+        work_queue.enqueue({1, 2})
+        work_queue.enqueue({2, 3})
+        assert work_queue.batches == []
+    assert work_queue.batches == [{1, 2, 3}]
+
+    work_queue.enqueue({4})
+    assert work_queue.batches[1:] == [{4}]
+    assert metrics.snapshot()["Test queue"] == {"processed": 4, "failures": 0}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_worker_thread_survives_failures(work_queue, settings):
+    settings.TEST_QUEUE_IN_BACKGROUND = True
+    work_queue.enqueue({"fail"})
+    wait_for(lambda: work_queue.stats["failures"] == 1)
+    work_queue.enqueue({1})
+    wait_for(lambda: work_queue.batches == [{1}])
@@ -0,0 +1,145 @@
+import datetime
+import pytest
+from django.utils.timezone import utc
+from blog.factories import EntryFactory
+from blog.models import Entry, Series, Tag
+
+CREATED = datetime.datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+
+
+@pytest.fixture
+def no_page_cache(settings):
+    settings.PAGE_CACHE_TIMEOUT = 0
+
+
+@pytest.mark.django_db
+def test_permalink_not_modified(client, no_page_cache, django_assert_num_queries):
+    entry = EntryFactory(slug="first", created=CREATED)
+    url = entry.get_absolute_url()
+    response = client.get(url)
+    etag, last_modified = response["ETag"], response["Last-Modified"]
+
+    # Answered by one query, without running the view
+    with django_assert_num_queries(1):
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 304
+
+    entry.title = "Edited"
+    entry.save()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+
+@pytest.mark.django_db
+def test_archives_change_with_their_content(client, no_page_cache):
+    entry = EntryFactory(slug="first", created=CREATED)
+    other = EntryFactory(slug="second", created=CREATED)
+    entry.tags.add(Tag.objects.create(tag="python"))
+    urls = ["/2019/", "/2019/mar/", "/2019/mar/4/", "/tags/python/"]
+    etags = {url: client.get(url)["ETag"] for url in urls}
+    for url in urls:
+        assert client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code == 304
+    # Archives don't send Last-Modified, which can't tell about deletions
+    assert not client.get("/2019/").has_header("Last-Modified")
+
+    # Elsewhere in time: nothing changes
+    EntryFactory(created=CREATED.replace(year=2018))
+    for url in urls[1:]:
+        assert client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code == 304
+
+    # Retagging changes the tag page and the archives
+    entry.tags.add(Tag.objects.create(tag="django"))
+    for url in urls:
+        assert client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code == 200
+        etags[url] = client.get(url)["ETag"]
+
+    # As does deleting
+    other.delete()
+    for url in urls[:3]:
+        assert client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_search_not_modified(client, no_page_cache):
+    EntryFactory(title="Python")
+    etag = client.get("/search/?q=python")["ETag"]
+    response = client.get("/search/?q=python", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    EntryFactory(title="More Python")
+    response = client.get("/search/?q=python", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+
+
+@pytest.mark.django_db(transaction=True)
+def test_page_cache_hits_not_modified(client, django_assert_num_queries):
+    EntryFactory(slug="first", created=CREATED)
+    etag = client.get("/2019/mar/")["ETag"]
+    # From the page cache, without even the view's validator query
+    with django_assert_num_queries(0):
+        response = client.get("/2019/mar/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response["ETag"] == etag
+    response = client.get("/2019/mar/")
+    assert response["X-Page-Cache"] == "hit"
+
+
+@pytest.mark.django_db
+def test_permalinks_change_with_their_series(client, no_page_cache):
+    series = Series.objects.create(title="Series", slug="series")
+    entry = EntryFactory(slug="first", created=CREATED, series=series)
+    other = EntryFactory(
+        slug="second", created=CREATED.replace(year=2020), series=series
+    )
+    url = entry.get_absolute_url()
+
+    def refresh():
+        response = client.get(url)
+        return response["ETag"], response["Last-Modified"]
+
+    def unchanged():
+        return [
+            client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304,
+            client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code == 304,
+        ]
+
+    etag, last_modified = refresh()
+    assert unchanged() == [True, True]
+
+    # Another entry in the series changes the sidebar (and Last-Modified only
+    # counts whole seconds)
+    other.updated += datetime.timedelta(seconds=2)
+    Entry.objects.filter(pk=other.pk).update(updated=other.updated)
+    assert unchanged() == [False, False]
+    etag, last_modified = refresh()
+
+    series.title = "Renamed"
+    series.save()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+    etag, last_modified = refresh()
+
+    other.series = None
+    other.save()
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+
+@pytest.mark.django_db
+def test_permalinks_change_when_their_tags_are_renamed(client, no_page_cache):
+    entry = EntryFactory(slug="first", created=CREATED)
+    tag = Tag.objects.create(tag="python")
+    entry.tags.add(tag)
+    url = entry.get_absolute_url()
+    updated = Entry.objects.get(pk=entry.pk).updated
+
+    tag.tag = "python3"
+    tag.save()
+    assert Entry.objects.get(pk=entry.pk).updated > updated
+    updated = Entry.objects.get(pk=entry.pk).updated
+    response = client.get(url)
+    assert b"python3" in response.content
+
+    tag.delete()
+    assert Entry.objects.get(pk=entry.pk).updated > updated
+    assert client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code == 200
@@ -0,0 +1,61 @@
+import json
+import pytest
+from constance import config
+from django.db.models.signals import post_save
+from blog import constance_backend, invalidation
+from blog.constance_backend import SnapshotBackend
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(constance_backend, "CHECK_INTERVAL", 0)
+    return config._backend
+
+
+@pytest.mark.django_db(transaction=True)
+def test_settings_read_from_snapshot(backend, django_assert_num_queries):
+    config.HOMEPAGE_NUM_ENTRIES = 3
+    config.HOMEPAGE_NUM_TALKS = 4
+    with django_assert_num_queries(1):
+        assert (config.HOMEPAGE_NUM_ENTRIES, config.HOMEPAGE_NUM_TALKS) == (3, 4)
+
+    # Reloaded once changes commit
+    config.HOMEPAGE_NUM_ENTRIES = 10
+    with django_assert_num_queries(1):
+        assert config.HOMEPAGE_NUM_ENTRIES == 10
+        assert config.HOMEPAGE_NUM_TALKS == 4
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_seen_by_other_processes(backend, monkeypatch, settings):
+    config.HOMEPAGE_NUM_ENTRIES = 3
+    # Another process, with its own snapshot, that doesn't see our saves
+    monkeypatch.setattr(invalidation, "handlers", list(invalidation.handlers))
+    other = SnapshotBackend()
+    post_save.disconnect(other.clear, sender=other._model)
+    assert other.get("HOMEPAGE_NUM_ENTRIES") == 3
+    loads = other.stats["loads"]
+
+    monkeypatch.setattr(constance_backend, "CHECK_INTERVAL", 60)
+    config.HOMEPAGE_NUM_ENTRIES = 8
+    # Not checked again yet
+    assert other.get("HOMEPAGE_NUM_ENTRIES") == 3
+    monkeypatch.setattr(constance_backend, "CHECK_INTERVAL", 0)
+    assert other.get("HOMEPAGE_NUM_ENTRIES") == 8
+    assert other.get("HOMEPAGE_NUM_TALKS") is None
+    assert other.stats["loads"] == loads + 1
+
+    # Or told straight away, by the invalidation bus
+    sent = []
+    monkeypatch.setattr(invalidation, "send", sent.append)
+    settings.INVALIDATION_BUS = "listen"
+    config.HOMEPAGE_NUM_ENTRIES = 9
+    assert [event["kind"] for event in sent] == ["save"]
+    other.get("HOMEPAGE_NUM_ENTRIES")
+    other.on_invalidation({"kind": "pages", "paths": ["/"]})
+    assert other.snapshot is not None
+    other.on_invalidation(json.loads(json.dumps(sent[0])))
+    assert other.snapshot is None
+    other.get("HOMEPAGE_NUM_ENTRIES")
+    other.on_invalidation({"kind": "reset"})
+    assert other.snapshot is None
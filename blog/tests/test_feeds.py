@@ -1,19 +1,82 @@
+import gzip
 import pytest
 from blog.factories import EntryFactory, BlogmarkFactory, QuotationFactory
-from blog.feeds import sitemap
+from django.utils import timezone
 from lxml import etree
 
 
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+
 @pytest.mark.django_db
-def test_sitemap_xml(rf):
+def test_sitemap_xml(client, rf):
     request = rf.get("/sitemap.xml")
     objects = [EntryFactory(), BlogmarkFactory(), QuotationFactory()]
     expected_urls = {request.build_absolute_uri(o.get_absolute_url()) for o in objects}
 
-    response = sitemap(request)
-    doc = etree.fromstring(response.content)
-    actual_urls = {
-        e.text
-        for e in doc.findall(".//{http://www.sitemaps.org/schemas/sitemap/0.9}loc")
-    }
+    response = client.get("/sitemap.xml")
+    index = etree.fromstring(response.content)
+    child_urls = [e.text for e in index.findall(f".//{SITEMAP_NS}loc")]
+    assert len(child_urls) == len({(o.type, o.created.year) for o in objects})
+
+    actual_urls = set()
+    for child_url in child_urls:
+        response = client.get(child_url)
+        doc = etree.fromstring(b"".join(response.streaming_content))
+        actual_urls.update(e.text for e in doc.findall(f".//{SITEMAP_NS}loc"))
     assert expected_urls == actual_urls
+
+
+@pytest.mark.django_db
+def test_sitemap_section_gzipped(client):
+    entry = EntryFactory()
+    year = timezone.localdate(entry.created).year
+    response = client.get(f"/sitemap-entry-{year}.xml.gz")
+    assert response["Content-Type"] == "application/x-gzip"
+    doc = etree.fromstring(gzip.decompress(response.content))
+    [loc] = doc.findall(f".//{SITEMAP_NS}loc")
+    assert loc.text.endswith(entry.get_absolute_url())
+
+    # Once cached, clients accepting gzip get the pre-compressed copy
+    response = client.get(f"/sitemap-entry-{year}.xml", HTTP_ACCEPT_ENCODING="gzip")
+    assert response["Content-Encoding"] == "gzip"
+    assert entry.get_absolute_url().encode() in gzip.decompress(response.content)
+
+
+@pytest.mark.django_db
+def test_everything_feed_mixes_types_newest_first(client):
+    objects = [EntryFactory(), BlogmarkFactory(), QuotationFactory()]
+    response = client.get("/atom/everything/")
+    doc = etree.fromstring(response.content)
+    links = [
+        e.attrib["href"]
+        for e in doc.findall(
+            "{http://www.w3.org/2005/Atom}entry/{http://www.w3.org/2005/Atom}link"
+        )
+    ]
+    objects.sort(key=lambda o: o.created, reverse=True)
+    assert [o.get_absolute_url() in link for o, link in zip(objects, links)] == [
+        True,
+        True,
+        True,
+    ]
+
+
+@pytest.mark.django_db
+def test_feed_conditional_get(client):
+    EntryFactory()
+    response = client.get("/atom/entries/")
+    assert response.status_code == 200
+    etag = response["ETag"]
+    last_modified = response["Last-Modified"]
+
+    response = client.get("/atom/entries/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    response = client.get("/atom/entries/", HTTP_IF_MODIFIED_SINCE=last_modified)
+    assert response.status_code == 304
+
+    # A new item changes the validators
+    EntryFactory(created=timezone.now())
+    response = client.get("/atom/entries/", HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
@@ -0,0 +1,124 @@
+import time
+import pytest
+from django.db import connection, transaction
+from blog import invalidation
+from blog.factories import EntryFactory
+from blog.models import Tag
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def events(settings, monkeypatch):
+    settings.INVALIDATION_BUS = "listen"
+    received = []
+    monkeypatch.setattr(invalidation, "handlers", [received.append])
+    monkeypatch.setattr(invalidation, "RECONNECT_MIN_DELAY", 0.01)
+    yield received
+
+
+def start_listener(mode, poll_interval=1):
+    listener = invalidation.Listener(mode, poll_interval).start()
+    wait_for(lambda: listener.version is not None)
+    return listener
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changes_are_announced_on_commit(events):
+    listener = start_listener("listen")
+    try:
+        with transaction.atomic():
+            entry = EntryFactory()
+            tag = Tag.objects.create(tag="python")
+            entry.tags.add(tag)
+            time.sleep(0.1)
+            assert events == []
+        wait_for(lambda: len(events) == 3)
+        assert events == [
+            {"model": "blog.entry", "pk": entry.pk, "kind": "save"},
+            {"model": "blog.tag", "pk": tag.pk, "kind": "save"},
+            {"model": "blog.entry", "pk": entry.pk, "kind": "tags"},
+        ]
+
+        with transaction.atomic():
+            EntryFactory()
+            transaction.set_rollback(True)
+        pk = entry.pk
+        entry.delete()
+        deleted = {"model": "blog.entry", "pk": pk, "kind": "delete"}
+        wait_for(lambda: deleted in events)
+        # Nothing from the rolled back transaction (though a heartbeat may
+        # have seen the counter move, and reset)
+        assert [e for e in events[3:] if e != {"kind": "reset"}] == [deleted]
+    finally:
+        listener.stop()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reconnects_and_resets(events):
+    listener = start_listener("listen")
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_terminate_backend(%s)", [listener.conn.get_backend_pid()]
+            )
+        # Changed while the listener was disconnected, so it can't know what
+        entry = EntryFactory()
+        wait_for(lambda: listener.stats["reconnects"] == 1)
+        wait_for(lambda: {"kind": "reset"} in events)
+        assert listener.stats["errors"] == 1
+
+        # And it's listening again
+        entry.save()
+        wait_for(
+            lambda: {"model": "blog.entry", "pk": entry.pk, "kind": "save"} in events
+        )
+    finally:
+        listener.stop()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_polling(events):
+    listener = start_listener("poll", poll_interval=0.05)
+    try:
+        time.sleep(0.1)
+        assert events == []
+        EntryFactory()
+        wait_for(lambda: events == [{"kind": "reset"}])
+    finally:
+        listener.stop()
+
+
+@pytest.mark.django_db
+def test_nothing_announced_when_off(settings):
+    settings.INVALIDATION_BUS = ""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT last_value FROM blog_invalidation_version")
+        version = cursor.fetchone()
+        EntryFactory()
+        cursor.execute("SELECT last_value FROM blog_invalidation_version")
+        assert cursor.fetchone() == version
+
+
+@pytest.mark.django_db(transaction=True)
+def test_changed_pages_announced_in_chunks(events, monkeypatch):
+    monkeypatch.setattr(invalidation, "MAX_PATHS_SIZE", 40)
+    listener = start_listener("listen")
+    try:
+        paths = ["/tags/tag-number-%d/" % i for i in range(5)]
+        with transaction.atomic():
+            invalidation.notify_pages(paths)
+        wait_for(
+            lambda: sum(len(e["paths"]) for e in events if e["kind"] == "pages") == 5
+        )
+        pages = [e for e in events if e["kind"] == "pages"]
+        assert len(pages) > 1
+        assert [path for e in pages for path in e["paths"]] == paths
+    finally:
+        listener.stop()
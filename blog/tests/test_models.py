@@ -1,5 +1,14 @@
+import io
+import operator
+from functools import reduce
 import pytest
-from blog.models import Entry
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import TextField, Value
+from django.test import override_settings
+from blog.models import Entry, Tag
+from blog.search import installed_triggers, reindex_queue, update_search_documents
 
 
 def test_entry_no_title():
@@ -14,3 +23,61 @@ def test_blog_save():
     e = Entry(id=1, body="foo")
     e.save()
     e.refresh_from_db()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_save_builds_search_document():
+    e = Entry.objects.create(title="Hello", body="<p>searchable</p>", slug="hi")
+    e.tags.add(Tag.objects.create(tag="tagged"))
+    for term in ("hello", "searchable", "tagged"):
+        assert Entry.objects.filter(search_document=SearchQuery(term)).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reindex_queue_batches_and_deduplicates():
+    entries = [Entry.objects.create(body="x", slug=f"e{i}") for i in range(5)]
+    tag = Tag.objects.create(tag="bulk")
+    with transaction.atomic():
+        for e in entries:
+            e.save()
+        tag.entry_set.add(*entries)
+        assert reindex_queue.depth == 5
+    assert reindex_queue.depth == 0
+    assert Entry.objects.filter(search_document=SearchQuery("bulk")).count() == 5
+
+
+@pytest.mark.django_db
+def test_update_search_documents_matches_search_vector():
+    e = Entry.objects.create(title="The title", body="the body", slug="e")
+    update_search_documents(Entry, [e])
+    vector = reduce(
+        operator.add,
+        [
+            SearchVector(Value(text, output_field=TextField()), weight=weight)
+            for weight, text in e.index_components().items()
+        ],
+    )
+    expected = Entry.objects.annotate(v=vector).values_list("v", flat=True).get()
+    assert Entry.objects.values_list("search_document", flat=True).get() == expected
+
+
+@pytest.mark.django_db
+@override_settings(SEARCH_DOCUMENT_TRIGGERS=True)
+def test_search_document_triggers():
+    call_command("search_triggers", "enable", stdout=io.StringIO())
+    e = Entry.objects.create(title="Hello", body="<p>searchable</p>", slug="hi")
+    tag = Tag.objects.create(tag="tagged")
+    e.tags.add(tag)
+    # No on_commit hooks run in this test, so this is all the database's work
+    for term in ("hello", "searchable", "tagged"):
+        assert Entry.objects.filter(search_document=SearchQuery(term)).exists()
+
+    # Changes that bypass signals are picked up too
+    Entry.objects.filter(pk=e.pk).update(title="Goodbye")
+    Tag.objects.filter(pk=tag.pk).update(tag="renamed")
+    for term in ("goodbye", "renamed"):
+        assert Entry.objects.filter(search_document=SearchQuery(term)).exists()
+    assert not Entry.objects.filter(search_document=SearchQuery("tagged")).exists()
+
+    call_command("search_triggers", "disable", stdout=io.StringIO())
+    assert installed_triggers() == []
@@ -0,0 +1,119 @@
+import datetime
+import gzip
+import pytest
+from django.utils.timezone import utc
+from blog.factories import EntryFactory
+from blog.models import Tag
+from blog.page_cache import invalidate
+
+CREATED = datetime.datetime(2019, 3, 4, 12, 0, tzinfo=utc)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pages_cached_until_content_changes(client):
+    entry = EntryFactory(slug="first", created=CREATED, title="Original")
+    response = client.get("/2019/mar/4/")
+    assert response["X-Page-Cache"] == "miss"
+    assert response["Surrogate-Key"] == "day:2019-03-04 site"
+    assert response["Cache-Control"] == "s-maxage=200"
+
+    response = client.get("/2019/mar/4/")
+    assert response["X-Page-Cache"] == "hit"
+    assert b"Original" in response.content
+
+    entry.title = "Edited"
+    entry.save()
+    response = client.get("/2019/mar/4/")
+    assert response["X-Page-Cache"] == "miss"
+    assert b"Edited" in response.content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_invalidation_by_key(client):
+    entry = EntryFactory(slug="first", created=CREATED)
+    entry.tags.add(Tag.objects.create(tag="python"))
+    response = client.get(entry.get_absolute_url())
+    assert response["Surrogate-Key"] == "day:2019-03-04 entry:%d site" % entry.pk
+    for url in ("/tags/python/", "/2019/", entry.get_absolute_url()):
+        client.get(url)
+
+    invalidate(["tag:python"])
+    assert client.get("/tags/python/")["X-Page-Cache"] == "miss"
+    assert client.get("/2019/")["X-Page-Cache"] == "hit"
+
+    # Untagging changes the tag page, and every page the entry is on
+    entry.tags.clear()
+    assert client.get("/tags/python/").status_code == 404
+    assert client.get(entry.get_absolute_url())["X-Page-Cache"] == "miss"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_tag_renames_invalidate_tagged_pages(client):
+    entry = EntryFactory(slug="first", created=CREATED)
+    tag = Tag.objects.create(tag="python")
+    entry.tags.add(tag)
+    for url in ("/tags/python/", entry.get_absolute_url()):
+        client.get(url)
+
+    tag.tag = "python3"
+    tag.save()
+    assert client.get("/tags/python/").status_code == 404
+    response = client.get(entry.get_absolute_url())
+    assert response["X-Page-Cache"] == "miss"
+    assert b"python3" in response.content
+
+    client.get(entry.get_absolute_url())
+    tag.delete()
+    response = client.get(entry.get_absolute_url())
+    assert response["X-Page-Cache"] == "miss"
+    assert b"python3" not in response.content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_pages_stored_gzipped(client):
+    EntryFactory(slug="first", created=CREATED)
+    miss = client.get("/2019/")
+    page = miss.content
+    assert miss["X-Page-Cache"] == "miss"
+    # The same validators and Vary, whether from the cache or not
+    assert "Accept-Encoding" in miss["Vary"]
+    assert miss["ETag"].startswith('W/"')
+
+    response = client.get("/2019/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+    assert response["X-Page-Cache"] == "hit"
+    assert response["Content-Encoding"] == "gzip"
+    assert response["Vary"] == miss["Vary"]
+    assert response["ETag"] == miss["ETag"]
+    assert gzip.decompress(response.content) == page
+
+    response = client.get("/2019/")
+    assert response["X-Page-Cache"] == "hit"
+    assert not response.has_header("Content-Encoding")
+    assert response["Vary"] == miss["Vary"]
+    assert response["ETag"] == miss["ETag"]
+    assert response.content == page
+    response = client.get("/2019/", HTTP_IF_NONE_MATCH=miss["ETag"])
+    assert response.status_code == 304
+
+
+@pytest.mark.django_db
+def test_not_cached(client, admin_client):
+    EntryFactory(slug="first", created=CREATED)
+    for _ in range(2):
+        # Feeds count subscribers, so always run
+        response = client.get("/atom/entries/")
+        assert response["X-Page-Cache"] == "miss"
+        assert "entries" in response["Surrogate-Key"].split()
+        assert response["Cache-Control"] == "s-maxage=120"
+        # Logged in users always see the page afresh
+        assert not admin_client.get("/2019/").has_header("X-Page-Cache")
+
+
+@pytest.mark.django_db
+def test_page_cache_off(client, settings):
+    settings.PAGE_CACHE_TIMEOUT = 0
+    EntryFactory(slug="first", created=CREATED)
+    client.get("/2019/")
+    response = client.get("/2019/")
+    assert not response.has_header("X-Page-Cache")
+    assert response["Surrogate-Key"] == "year:2019 site"
@@ -0,0 +1,27 @@
+import os
+import pytest
+from blog.models import Entry
+from blog.factories import EntryFactory
+from blog.parallel import run_chunks
+
+
+def count_entries(pks, offset):
+    return os.getpid(), Entry.objects.filter(pk__in=pks).count() + offset
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("workers", [1, 3])
+def test_run_chunks(workers):
+    pks = [EntryFactory().pk for _ in range(10)]
+    # A generator, as chunks streamed from a cursor would be
+    chunks = (tuple(pks[i : i + 2]) for i in range(0, len(pks), 2))
+    results = dict(run_chunks(count_entries, chunks, workers, 100))
+    assert sorted(results) == sorted(tuple(pks[i : i + 2]) for i in range(0, 10, 2))
+    assert {n for _, n in results.values()} == {102}
+    pids = {pid for pid, _ in results.values()}
+    if workers == 1:
+        assert pids == {os.getpid()}
+    else:
+        assert os.getpid() not in pids
+    # Our own connection still works afterwards
+    assert Entry.objects.count() == 10
@@ -0,0 +1,128 @@
+import io
+import pytest
+from django.core.management import CommandError, call_command
+from blog.fake_pinboard import FakePinboard
+from blog.factories import BlogmarkFactory
+from blog.models import Blogmark, PinboardCursor
+from blog.pinboard_sync import PinboardClient, TooManyDeletions, sync
+
+
+@pytest.fixture
+def pinboard(settings):
+    with FakePinboard() as fake:
+        settings.PINBOARD_API_URL = fake.url
+        settings.PINBOARD_API_KEY = "user:token"
+        yield fake
+
+
+def tags(blogmark):
+    return sorted(t.tag for t in blogmark.tags.all())
+
+
+@pytest.mark.django_db
+def test_sync_creates_updates_and_deletes(pinboard):
+    one = pinboard.add("https://one.example/", "One", tags=["a", "b"])
+    two = pinboard.add("https://two.example/", "Two", extended="Words", tags=["b"])
+    pinboard.add("https://secret.example/", "Secret", shared=False)
+
+    stats = sync(batch_size=1)
+    assert stats == dict(created=2, updated=0, deleted=0, unchanged=0, private=1)
+    blogmark = Blogmark.objects.get(import_ref=f"pinboard:{two}")
+    assert (blogmark.link_title, blogmark.commentary, blogmark.slug) == (
+        "Two",
+        "Words",
+        "two",
+    )
+    assert tags(Blogmark.objects.get(import_ref=f"pinboard:{one}")) == ["a", "b"]
+
+    pinboard.edit(one, description="One, edited", tags="c")
+    pinboard.delete(two)
+    three = pinboard.add("https://three.example/", "Three")
+    stats = sync()
+    assert stats == dict(created=1, updated=1, deleted=1, unchanged=0, private=1)
+    blogmark = Blogmark.objects.get(import_ref=f"pinboard:{one}")
+    assert blogmark.link_title == "One, edited"
+    assert tags(blogmark) == ["c"]
+    assert set(Blogmark.objects.values_list("import_ref", flat=True)) == {
+        f"pinboard:{one}",
+        f"pinboard:{three}",
+    }
+    assert set(PinboardCursor.objects.get().posts) == {one, three}
+
+
+@pytest.mark.django_db
+def test_sync_stops_early_without_updates(pinboard):
+    pinboard.add("https://one.example/", "One")
+    sync()
+    pinboard.requests.clear()
+    assert sync()["created"] == 0
+    assert pinboard.requests == ["/v1/posts/update"]
+
+
+@pytest.mark.django_db
+def test_sync_starts_from_existing_blogmarks(pinboard):
+    url_hash = pinboard.add("https://one.example/", "One")
+    meta = pinboard.posts[url_hash]["meta"]
+    BlogmarkFactory(import_ref=f"pinboard:{url_hash}", metadata={"pinboard_meta": meta})
+    BlogmarkFactory(import_ref="pinboard:gone", metadata={"pinboard_meta": "x"})
+    stats = sync(PinboardClient())
+    assert stats == dict(created=0, updated=0, deleted=1, unchanged=1, private=0)
+
+
+@pytest.mark.django_db
+def test_sync_refuses_to_delete_too_much(pinboard):
+    hashes = [pinboard.add(f"https://{i}.example/", f"Link {i}") for i in range(20)]
+    sync()
+
+    # An empty list would delete everything...
+    for url_hash in hashes:
+        pinboard.delete(url_hash)
+    with pytest.raises(TooManyDeletions):
+        sync()
+    # ...and so would losing more than a few of them
+    pinboard.add("https://new.example/", "New")
+    for i in range(8):
+        pinboard.add(f"https://{i}.example/", f"Link {i}")
+    with pytest.raises(TooManyDeletions):
+        sync()
+    # Nothing was written, and the cursor didn't move on
+    assert Blogmark.objects.count() == 20
+    assert len(PinboardCursor.objects.get().posts) == 20
+
+    with pytest.raises(CommandError):
+        call_command("import_pinboard", stdout=io.StringIO())
+    stats = sync(force=True)
+    assert (stats["created"], stats["deleted"]) == (1, 12)
+    assert Blogmark.objects.count() == 9
+
+
+@pytest.mark.django_db
+def test_import_pinboard_command(pinboard):
+    pinboard.add("https://one.example/", "One")
+    out = io.StringIO()
+    call_command("import_pinboard", stdout=out)
+    assert "1 created" in out.getvalue()
+    call_command("import_pinboard", "--force", stdout=out)
+    assert "1 updated" in out.getvalue()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sync_invalidates_cached_pages(pinboard, client):
+    one = pinboard.add("https://one.example/", "One")
+    two = pinboard.add("https://two.example/", "Two")
+    sync()
+    urls = [
+        Blogmark.objects.get(import_ref=f"pinboard:{url_hash}").get_absolute_url()
+        for url_hash in (one, two)
+    ]
+    for url in urls:
+        client.get(url)
+        assert client.get(url)["X-Page-Cache"] == "hit"
+
+    pinboard.edit(one, extended="New words")
+    pinboard.delete(two)
+    sync()
+    response = client.get(urls[0])
+    assert response["X-Page-Cache"] == "miss"
+    assert b"New words" in response.content
+    assert client.get(urls[1]).status_code == 404
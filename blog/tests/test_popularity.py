@@ -0,0 +1,23 @@
+import pytest
+from blog.factories import EntryFactory
+from blog.popularity import popular_pages
+
+
+@pytest.mark.django_db
+def test_popular_pages(client, admin_client):
+    popular_pages.pending.clear()
+    entry = EntryFactory()
+    for tag in ("python", "django"):
+        entry.tags.create(tag=tag)
+    for path in ["/tags/python/"] * 3 + ["/tags/django/"] * 2 + ["/tags/missing/"]:
+        client.get(path)
+    # Logged in visitors don't count
+    for _ in range(2):
+        admin_client.get("/tags/django/")
+    assert popular_pages.top("/tags/", 5) == ["/tags/python/", "/tags/django/"]
+
+    popular_pages.flush()
+    client.get("/tags/django/")
+    client.get("/tags/django/")
+    assert popular_pages.top("/tags/", 1) == ["/tags/django/"]
+    assert popular_pages.top("/search/", 5) == []
@@ -35,3 +35,23 @@ def test_entry_detail(name, factory, client):
     assert_template_used(response, f"{name}.html")
     assert name in response.context
     assert response.context[name] == obj
+
+
+@pytest.mark.django_db
+def test_homepage_skips_invalid_entry_bodies(client):
+    entry = EntryFactory(body="<p>Unclosed <b>tag</p>", summary="")
+    assert entry.body_valid is False
+    response = client.get("/")
+    assert response.status_code == 200
+    assert "Unclosed" in response.content.decode()
+
+
+@pytest.mark.django_db
+def test_tools_shows_process_stats(admin_client):
+    EntryFactory()
+    response = admin_client.get("/tools/")
+    stats = response.context["stats"]
+    assert stats["Search reindex queue"]["queued"] >= 1
+    assert "Search reindex queue" in response.content.decode()
+    assert set(stats["Cloudflare purge queue"]) == {"purged", "requests", "failures"}
+    assert set(stats["oEmbed fetch queue"]) == {"fetched", "failed", "failures"}
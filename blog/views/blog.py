@@ -7,11 +7,9 @@ import time
 from operator import attrgetter
 from collections import Counter
 
-import CloudFlare
 import requests
 from bs4 import BeautifulSoup as Soup
 from constance import config as constance_config
-from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
@@ -25,7 +23,12 @@ from django.utils.timezone import now
 from django.views.decorators.cache import never_cache
 
 from speaking_portfolio.models import Presentation
+from ..caching import cached, content_version
+from .. import metrics
+from ..cdn import purge_everything
+from ..conditional import content_condition, content_version_condition
 from ..models import Blogmark, Entry, Quotation, Tag, load_mixed_objects
+from ..page_cache import add_surrogate_keys, invalidate, surrogate_keys
 
 MONTHS_3_REV = {
     "jan": 1,
@@ -45,6 +48,19 @@ MONTHS_3_REV_REV = {value: key for key, value in list(MONTHS_3_REV.items())}
 BLACKLISTED_TAGS = ("quora", "flash", "resolved", "recovered")
 
 
+@surrogate_keys(
+    lambda year, month, day, slug: ["day:%d-%02d-%02d" % (year, month, day)]
+)
+@content_condition(
+    lambda year, month, day, slug: {
+        "created__year": year,
+        "created__month": month,
+        "created__day": day,
+        "slug": slug,
+    },
+    last_modified=True,
+    series=True,
+)
 def archive_item(request, year, month, day, slug):
     # This could be a quote OR link OR entry
     for content_type, model in (
@@ -63,6 +79,7 @@ def archive_item(request, year, month, day, slug):
         except Http404:
             continue
 
+        add_surrogate_keys(request, "%s:%d" % (content_type, obj.pk))
         return render(
             request,
             "%s.html" % content_type,
@@ -78,52 +95,62 @@ def archive_item(request, year, month, day, slug):
     raise Http404
 
 
+@surrogate_keys(["home"])
 def index(request):
-    entries = Entry.objects.prefetch_related("tags")[
-        : constance_config.HOMEPAGE_NUM_ENTRIES
-    ]
+    counts = (
+        constance_config.HOMEPAGE_NUM_ENTRIES,
+        constance_config.HOMEPAGE_NUM_ELSEWHERE,
+        constance_config.HOMEPAGE_NUM_TALKS,
+    )
+    # Served stale (for up to as long as Cloudflare caches it anyway) while
+    # one thread rebuilds it after a change
+    context = cached(
+        "homepage:%d:%d:%d" % counts,
+        lambda: homepage_context(*counts),
+        200,
+        version=content_version(),
+    )
+    response = render(request, "homepage.html", context)
+    response["Cache-Control"] = "s-maxage=200"
+    return response
+
+
+def homepage_context(num_entries, num_elsewhere, num_talks):
+    entries = list(Entry.objects.prefetch_related("tags")[:num_entries])
 
     blogmarks = Blogmark.objects.order_by("-created").prefetch_related("tags")[:50]
     quotations = Quotation.objects.order_by("-created").prefetch_related("tags")[:50]
     elsewhere = sorted(
         list(blogmarks) + list(quotations), key=attrgetter("created"), reverse=True
     )
-    elsewhere = list(elsewhere)[: constance_config.HOMEPAGE_NUM_ELSEWHERE]
+    elsewhere = list(elsewhere)[:num_elsewhere]
 
     # Massage elsewhere data into format suitable for {% blog_mixed_list %}
     elsewhere = [{"type": o.type, "obj": o, "date": o.created} for o in elsewhere]
 
-    nt = constance_config.HOMEPAGE_NUM_TALKS
-
     future_talks = (
         Presentation.objects.select_related("conference")
         .filter(date__gt=now().date())
         .order_by("date")
     )
-    future_talks = future_talks[:nt]
+    future_talks = future_talks[:num_talks]
 
     past_talks = (
         Presentation.objects.select_related("conference")
         .filter(date__lte=now().date())
         .order_by("-date")
     )
-    past_talks = past_talks[:nt]
+    past_talks = past_talks[:num_talks]
 
     talks = list(future_talks) + list(past_talks)
-    talks = talks[:nt]
+    talks = talks[:num_talks]
 
-    response = render(
-        request,
-        "homepage.html",
-        {
-            "entries": entries,
-            "talks": talks,
-            "elsewhere": elsewhere,
-            # 'current_tags': find_current_tags(5),
-        },
-    )
-    response["Cache-Control"] = "s-maxage=200"
-    return response
+    return {
+        "entries": entries,
+        "talks": talks,
+        "elsewhere": elsewhere,
+        # 'current_tags': find_current_tags(5),
+    }
 
 
 def find_current_tags(num=5):
@@ -151,6 +178,8 @@ def find_current_tags(num=5):
     return candidates[:num]
 
 
+@surrogate_keys(lambda year: ["year:%d" % year])
+@content_condition(lambda year: {"created__year": year})
 def archive_year(request, year):
     # Display list of months
     # each with count of blogmarks/entries/quotes
@@ -187,6 +216,8 @@ def archive_year(request, year):
     )
 
 
+@surrogate_keys(lambda year, month: ["month:%d-%02d" % (year, month)])
+@content_condition(lambda year, month: {"created__year": year, "created__month": month})
 def archive_month(request, year, month):
     def by_date(objs):
         lookup = {}
@@ -220,6 +251,14 @@ def archive_month(request, year, month):
     )
 
 
+@surrogate_keys(lambda year, month, day: ["day:%d-%02d-%02d" % (year, month, day)])
+@content_condition(
+    lambda year, month, day: {
+        "created__year": year,
+        "created__month": month,
+        "created__day": day,
+    }
+)
 def archive_day(request, year, month, day):
     context = {}
     context["date"] = datetime.date(year, month, day)
@@ -246,6 +285,8 @@ def archive_day(request, year, month, day):
     return render(request, "archive_day.html", context)
 
 
+@surrogate_keys(["tags"])
+@content_version_condition()
 def tag_index(request):
     return render(request, "tags.html")
 
@@ -263,6 +304,8 @@ INTERSECTION_SQL = """
 """
 
 
+@surrogate_keys(lambda tags: ["tag:%s" % tag for tag in tags.split("+")])
+@content_condition(lambda tags: {"tags__tag__in": tags.split("+")})
 def archive_tag(request, tags):
     tags = Tag.objects.filter(tag__in=tags.split("+")).values_list("tag", flat=True)[:3]
     if not tags:
@@ -322,6 +365,7 @@ def archive_tag(request, tags):
     )
 
 
+@surrogate_keys(["entries"])
 def entry_archive(request):
     entries = (
         Entry.objects.order_by("-created")
@@ -347,12 +391,8 @@ def write(request):
 @staff_member_required
 def tools(request):
     if request.POST.get("purge_all"):
-        cf = CloudFlare.CloudFlare(
-            email=settings.CLOUDFLARE_EMAIL, token=settings.CLOUDFLARE_TOKEN
-        )
-        cf.zones.purge_cache.delete(
-            settings.CLOUDFLARE_ZONE_ID, data={"purge_everything": True}
-        )
+        purge_everything()
+        invalidate(["site"])
         return Redirect(request.path + "?msg=Cache+purged")
     return render(
         request,
@@ -360,6 +400,7 @@ def tools(request):
         {
             "msg": request.GET.get("msg"),
             "deployed_hash": os.environ.get("HEROKU_SLUG_COMMIT"),
+            "stats": metrics.snapshot(),
         },
     )
 
@@ -378,6 +419,8 @@ def tools_extract_title(request):
     return JsonResponse({})
 
 
+@surrogate_keys(["search"])
+@content_version_condition()
 def search(request):
     q = request.GET.get("q", "").strip()
     start = time.time()
@@ -588,9 +631,11 @@ def tools_search_tags(request):
 
 # Redirects for old patterns
 # /writing/<slug>/ --> /YYYY/mmm/ddd/slug
+@surrogate_keys(["entries"])
 def redirect_old_blog_urls(request, slug):
     return redirect(to=get_object_or_404(Entry, slug=slug), permanent=True)
 
 
+@surrogate_keys()
 def redirect_old_feed(request):
     return redirect(to="blog_feed", permanent=True)
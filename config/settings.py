@@ -2,7 +2,17 @@ import os
 import urllib.parse
 import environ
 
-env = environ.Env(DEBUG=(bool, False), STAGING=(bool, False))
+env = environ.Env(
+    DEBUG=(bool, False),
+    STAGING=(bool, False),
+    SEARCH_REINDEX_IN_BACKGROUND=(bool, False),
+    SEARCH_DOCUMENT_TRIGGERS=(bool, False),
+    OEMBED_FETCH_IN_BACKGROUND=(bool, True),
+    CLOUDFLARE_PURGE_IN_BACKGROUND=(bool, True),
+    PAGE_CACHE_TIMEOUT=(int, 60 * 60),
+    INVALIDATION_BUS=(str, ""),
+    INVALIDATION_POLL_INTERVAL=(float, 5.0),
+)
 env.read_env(os.environ.get("ENV_FILE", ".env"))
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -25,6 +35,13 @@ STAGING = env("STAGING")
 CLOUDFLARE_EMAIL = os.environ.get("CLOUDFLARE_EMAIL", "")
 CLOUDFLARE_TOKEN = os.environ.get("CLOUDFLARE_TOKEN", "")
 CLOUDFLARE_ZONE_ID = os.environ.get("CLOUDFLARE_ZONE_ID", "")
+CLOUDFLARE_API_URL = os.environ.get(
+    "CLOUDFLARE_API_URL", "https://api.cloudflare.com/client/v4"
+)
+# Pages affected by a content change are purged (when CLOUDFLARE_ZONE_ID is
+# set) after the change commits; by default in a background thread. See
+# blog.cdn.
+CLOUDFLARE_PURGE_IN_BACKGROUND = env("CLOUDFLARE_PURGE_IN_BACKGROUND")
 
 # Google Analytics
 GOOGLE_ANALYTICS_ID = os.environ.get("GOOGLE_ANALYTICS_ID")
@@ -58,6 +75,9 @@ MIDDLEWARE = (
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
+    "blog.popularity.PopularPagesMiddleware",
+    "blog.page_cache.PageCacheMiddleware",
+    "blog.coalescing.RequestCoalescingMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 )
 if DEBUG:
@@ -149,25 +169,81 @@ CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"
 REDIS_URL = os.environ.get("REDIS_URL")
 if REDIS_URL:
     redis_url = urllib.parse.urlparse(REDIS_URL)
-    CACHES["default"] = {
+    CACHES["shared"] = {
         "BACKEND": "redis_cache.RedisCache",
         "LOCATION": "{0}:{1}".format(redis_url.hostname, redis_url.port),
         "OPTIONS": {"PASSWORD": redis_url.password, "DB": 0},
         "VERSION": 2,
     }
+    # Hot keys (the content version, surrogate key generations, ...) are read
+    # on every request, so keep them in-process too; and compress big values
+    # (pages, feeds) in Redis. See blog.cache_backends.
+    CACHES["default"] = {
+        "BACKEND": "blog.cache_backends.TwoTierCache",
+        "LOCATION": "default",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOCAL_MAX_ENTRIES": env.int("CACHE_LOCAL_MAX_ENTRIES", 1000),
+            "LOCAL_TIMEOUT": env.int("CACHE_LOCAL_TIMEOUT", 60),
+            "CHECK_INTERVAL": env.float("CACHE_CHECK_INTERVAL", 1.0),
+            "COMPRESS_MIN_SIZE": env.int("CACHE_COMPRESS_MIN_SIZE", 1024),
+        },
+    }
+
+# Content changes are announced to every process over Postgres LISTEN/NOTIFY,
+# so they can evict in-process caches at once: "listen" to turn that on, or
+# "poll" to only check a version counter every INVALIDATION_POLL_INTERVAL
+# seconds (for when LISTEN isn't available). See blog.invalidation.
+INVALIDATION_BUS = env("INVALIDATION_BUS")
+INVALIDATION_POLL_INTERVAL = env("INVALIDATION_POLL_INTERVAL")
 
 SITE_ID = 1
 
+# Search documents are rebuilt in batches when a transaction commits; set this
+# to do that work in a background thread instead of the request thread.
+SEARCH_REINDEX_IN_BACKGROUND = env("SEARCH_REINDEX_IN_BACKGROUND")
+
+# Or, let Postgres maintain search documents with triggers; turn this on after
+# running `./manage.py search_triggers enable`.
+SEARCH_DOCUMENT_TRIGGERS = env("SEARCH_DOCUMENT_TRIGGERS")
+
+# oEmbed data for speaking coverage is fetched after a save commits; by default
+# in a background thread (see speaking_portfolio.oembed.FetchQueue).
+OEMBED_FETCH_IN_BACKGROUND = env("OEMBED_FETCH_IN_BACKGROUND")
+
+# Feed subscriber counts are buffered in memory and written in batches; see
+# feedstats.utils.SubscriberCountBuffer.
+FEEDSTATS_FLUSH_INTERVAL = 60
+FEEDSTATS_BUFFER_SIZE = 100
+
+# Rendered public pages are cached for anonymous visitors for this many seconds
+# (0 turns the page cache off), or until a change invalidates them; see
+# blog.page_cache.
+PAGE_CACHE_TIMEOUT = env("PAGE_CACHE_TIMEOUT")
+
+# Identical concurrent anonymous GETs for these paths run the view once, and
+# share the response; followers wait this many seconds for it before giving up
+# and running the view themselves. See blog.coalescing.
+REQUEST_COALESCING_PATHS = ["/search/", "/tags/", "/atom/everything/"]
+REQUEST_COALESCING_TIMEOUT = 10
+
+# Where the site lives; build_static renders pages as if served from here.
+SITE_URL = os.environ.get("SITE_URL", "https://jacobian.org")
+
+# Where build_static writes pages, for nginx to serve; pages are removed from
+# here when their content changes. See blog.static_build.
+STATIC_BUILD_ROOT = os.environ.get("STATIC_BUILD_ROOT", "")
+
 PINBOARD_API_KEY = os.environ.get("PINBOARD_API_KEY", "")
+PINBOARD_API_URL = os.environ.get("PINBOARD_API_URL", "https://api.pinboard.in/v1/")
 
-CONSTANCE_BACKEND = "constance.backends.database.DatabaseBackend"
+# Settings are read from an in-process snapshot; see blog.constance_backend.
+CONSTANCE_BACKEND = "blog.constance_backend.SnapshotBackend"
 CONSTANCE_CONFIG = {
     "HOMEPAGE_NUM_ENTRIES": (5, "Number of blog entries on the home page"),
     "HOMEPAGE_NUM_ELSEWHERE": (7, "Number of 'elsewhere' links on the home page"),
     "HOMEPAGE_NUM_TALKS": (6, "Number of talks on the home page"),
 }
-if REDIS_URL:
-    CONSTANCE_DATABASE_CACHE_BACKEND = "default"
 
 LOGGING = {
     "version": 1,
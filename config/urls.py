@@ -4,7 +4,9 @@ from django.conf import settings
 from blog.views import blog as blog_views
 from blog.views import micropub as micropub_views
 from blog import feeds
+from blog.page_cache import surrogate_keys
 from feedstats.utils import count_subscribers
+from feedstats import views as feedstats_views
 from . import url_converters
 
 url_converters.register_all()
@@ -30,15 +32,42 @@ urlpatterns = [
     path("search/", blog_views.search, name="search"),
     path("tags/", blog_views.tag_index, name="tag_index"),
     path("tags/<tags>/", blog_views.archive_tag, name="tag_detail"),
+    # Feeds and sitemaps do their own caching; feeds also count subscribers,
+    # so they mustn't be answered from the page cache.
     path(
-        "atom/entries/", count_subscribers(feeds.Entries().__call__), name="blog_feed"
+        "atom/entries/",
+        surrogate_keys(["entries"], cache_page=False)(
+            count_subscribers(feeds.Entries().__call__)
+        ),
+        name="blog_feed",
+    ),
+    path(
+        "atom/links/",
+        surrogate_keys(["blogmarks"], cache_page=False)(
+            count_subscribers(feeds.Blogmarks().__call__)
+        ),
+    ),
+    path(
+        "atom/everything/",
+        surrogate_keys(["entries", "blogmarks", "quotations"], cache_page=False)(
+            count_subscribers(feeds.Everything().__call__)
+        ),
+    ),
+    path("sitemap.xml", surrogate_keys(["sitemap"], cache_page=False)(feeds.sitemap)),
+    path(
+        "sitemap-<slug:section>-<year:year>.xml",
+        surrogate_keys(["sitemap"], cache_page=False)(feeds.sitemap_section),
+        name="sitemap_section",
+    ),
+    path(
+        "sitemap-<slug:section>-<year:year>.xml.gz",
+        surrogate_keys(["sitemap"], cache_page=False)(feeds.sitemap_section),
+        {"gzipped": True},
     ),
-    path("atom/links/", count_subscribers(feeds.Blogmarks().__call__)),
-    path("atom/everything/", count_subscribers(feeds.Everything().__call__)),
-    path("sitemap.xml", feeds.sitemap),
     path("tools/", blog_views.tools),
     path("tools/extract-title/", blog_views.tools_extract_title),
     path("tools/search-tags/", blog_views.tools_search_tags),
+    path("tools/feed-trends/", feedstats_views.trends),
     path("write/", blog_views.write),
     path("admin/", admin.site.urls),
     path("speaking/", include("speaking_portfolio.urls")),
@@ -6,3 +6,7 @@ from django.core.wsgi import get_wsgi_application
 
 
 application = get_wsgi_application()
+
+from blog import invalidation
+
+invalidation.start()
@@ -0,0 +1,9 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Views cache aggressively, so don't let cached pages leak between tests.
+    cache.clear()
+    yield
@@ -1,6 +1,16 @@
 from django.contrib import admin
-from .models import SubscriberCount
+from .models import SubscriberCount, DailySubscriberCount, MonthlySubscriberCount
 
 admin.site.register(
     SubscriberCount, list_display=("path", "user_agent", "count", "created")
 )
+admin.site.register(
+    DailySubscriberCount,
+    list_display=("day", "path", "user_agent", "subscribers"),
+    list_filter=("path",),
+)
+admin.site.register(
+    MonthlySubscriberCount,
+    list_display=("month", "path", "user_agent", "subscribers"),
+    list_filter=("path",),
+)
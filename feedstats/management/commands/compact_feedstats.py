@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from ...rollups import compact
+
+
+class Command(BaseCommand):
+    help = """
+        Rolls raw subscriber counts up into daily and monthly totals, and
+        deletes raw counts older than --keep-days. Meant to be run daily.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--keep-days",
+            type=int,
+            default=30,
+            help="Keep raw subscriber counts for this many days (default 30)",
+        )
+
+    def handle(self, *args, **kwargs):
+        daily_rows, deleted = compact(kwargs["keep_days"])
+        self.stdout.write(
+            f"rolled up {daily_rows} daily counts, deleted {deleted} raw counts"
+        )
@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def populate_day(apps, schema_editor):
+    # Days are local days, matching how counts were de-duplicated before.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE feedstats_subscribercount SET day = (created AT TIME ZONE %s)::date",
+            [settings.TIME_ZONE],
+        )
+
+
+DELETE_DUPLICATES_SQL = """
+    DELETE FROM feedstats_subscribercount a
+        USING feedstats_subscribercount b
+    WHERE a.id > b.id
+        AND a.path = b.path
+        AND a.user_agent = b.user_agent
+        AND a.count = b.count
+        AND a.day = b.day
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("feedstats", "0002_longer_user_agent_field")]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscribercount",
+            name="day",
+            field=models.DateField(null=True),
+        ),
+        migrations.RunPython(populate_day, migrations.RunPython.noop),
+        migrations.RunSQL(DELETE_DUPLICATES_SQL, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name="subscribercount",
+            name="day",
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AlterIndexTogether(name="subscribercount", index_together=set()),
+        migrations.AddConstraint(
+            model_name="subscribercount",
+            constraint=models.UniqueConstraint(
+                fields=["path", "user_agent", "count", "day"],
+                name="feedstats_one_count_per_day",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 3.0.14 on 2026-10-19 18:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("feedstats", "0003_subscribercount_day"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailySubscriberCount",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("path", models.CharField(max_length=128)),
+                ("user_agent", models.CharField(max_length=256)),
+                ("subscribers", models.IntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="MonthlySubscriberCount",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("path", models.CharField(max_length=128)),
+                ("user_agent", models.CharField(max_length=256)),
+                ("subscribers", models.IntegerField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="monthlysubscribercount",
+            constraint=models.UniqueConstraint(
+                fields=("month", "path", "user_agent"), name="feedstats_monthly_rollup"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="dailysubscribercount",
+            constraint=models.UniqueConstraint(
+                fields=("day", "path", "user_agent"), name="feedstats_daily_rollup"
+            ),
+        ),
+    ]
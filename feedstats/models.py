@@ -1,11 +1,56 @@
 from django.db import models
+from django.utils import timezone
 
 
 class SubscriberCount(models.Model):
     path = models.CharField(max_length=128)
     count = models.IntegerField()
     created = models.DateTimeField(auto_now_add=True)
+    day = models.DateField(default=timezone.localdate)
     user_agent = models.CharField(max_length=256, db_index=True)
 
     class Meta:
-        index_together = [["path", "user_agent", "count", "created"]]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["path", "user_agent", "count", "day"],
+                name="feedstats_one_count_per_day",
+            )
+        ]
+
+
+class DailySubscriberCount(models.Model):
+    """
+    Rollup of SubscriberCount: the most subscribers each aggregator reported
+    for each feed on each day. Maintained by the compact_feedstats command.
+    """
+
+    day = models.DateField()
+    path = models.CharField(max_length=128)
+    user_agent = models.CharField(max_length=256)
+    subscribers = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["day", "path", "user_agent"], name="feedstats_daily_rollup"
+            )
+        ]
+
+
+class MonthlySubscriberCount(models.Model):
+    """
+    Rollup of DailySubscriberCount by month (`month` is the first of the month).
+    """
+
+    month = models.DateField()
+    path = models.CharField(max_length=128)
+    user_agent = models.CharField(max_length=256)
+    subscribers = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["month", "path", "user_agent"],
+                name="feedstats_monthly_rollup",
+            )
+        ]
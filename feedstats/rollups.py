@@ -0,0 +1,120 @@
+"""
+Rollups of the raw SubscriberCount table.
+
+The raw table gets a row per feed, aggregator and subscriber count per day,
+which is far more detail than we ever want to look at. rollup() condenses
+it into daily and monthly tables keeping only the highest count each
+aggregator reported, compact() then throws away old raw rows, and trends()
+reads total subscribers per feed over time out of the rollups.
+"""
+
+import datetime
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+TRENDS_VERSION_KEY = "feedstats-trends-version"
+TREND_PERIODS = {
+    "day": ("feedstats_dailysubscribercount", "day"),
+    "month": ("feedstats_monthlysubscribercount", "month"),
+}
+
+ROLLUP_DAILY_SQL = """
+    INSERT INTO feedstats_dailysubscribercount (day, path, user_agent, subscribers)
+        SELECT day, path, user_agent, MAX(count)
+            FROM feedstats_subscribercount
+        GROUP BY day, path, user_agent
+    ON CONFLICT (day, path, user_agent) DO UPDATE
+        SET subscribers = GREATEST(
+            feedstats_dailysubscribercount.subscribers, EXCLUDED.subscribers
+        )
+"""
+
+ROLLUP_MONTHLY_SQL = """
+    INSERT INTO feedstats_monthlysubscribercount (month, path, user_agent, subscribers)
+        SELECT date_trunc('month', day)::date, path, user_agent, MAX(subscribers)
+            FROM feedstats_dailysubscribercount
+        WHERE day >= %s
+        GROUP BY 1, path, user_agent
+    ON CONFLICT (month, path, user_agent) DO UPDATE
+        SET subscribers = EXCLUDED.subscribers
+"""
+
+# Total subscribers per feed per period (the sum over aggregators), plus the
+# change since the previous period, computed with a window over the totals.
+TREND_SQL = """
+    SELECT %(period)s, path, total,
+        total - LAG(total) OVER (PARTITION BY path ORDER BY %(period)s)
+    FROM (
+        SELECT %(period)s, path, SUM(subscribers) AS total
+            FROM %(table)s
+        WHERE %(period)s >= %%s
+        GROUP BY %(period)s, path
+    ) totals
+    ORDER BY path, %(period)s
+"""
+
+
+def rollup():
+    """
+    Folds every raw SubscriberCount row into the daily and monthly rollups.
+    Safe to run repeatedly. Returns the number of daily rows touched.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(day) FROM feedstats_subscribercount")
+        earliest = cursor.fetchone()[0]
+        if earliest is None:
+            return 0
+        cursor.execute(ROLLUP_DAILY_SQL)
+        daily_rows = cursor.rowcount
+        cursor.execute(ROLLUP_MONTHLY_SQL, [earliest.replace(day=1)])
+    clear_trends_cache()
+    return daily_rows
+
+
+def compact(keep_days):
+    """
+    Rolls up the raw table, then deletes raw rows older than `keep_days` days.
+    Returns (daily rows touched, raw rows deleted).
+    """
+    cutoff = timezone.localdate() - datetime.timedelta(days=keep_days)
+    with transaction.atomic():
+        daily_rows = rollup()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM feedstats_subscribercount WHERE day < %s", [cutoff]
+            )
+            deleted = cursor.rowcount
+    return daily_rows, deleted
+
+
+def trends(period="day", since=None):
+    """
+    Returns {path: [{period, total, change}, ...]}: total subscribers to each
+    feed over time. Cached until the next rollup.
+    """
+    table, column = TREND_PERIODS[period]
+    since = since or datetime.date.min
+    cache_key = "feedstats-trends:%s:%s:%s" % (
+        cache.get_or_set(TRENDS_VERSION_KEY, 0, None),
+        period,
+        since.isoformat(),
+    )
+    result = cache.get(cache_key)
+    if result is None:
+        result = {}
+        with connection.cursor() as cursor:
+            cursor.execute(TREND_SQL % {"table": table, "period": column}, [since])
+            for when, path, total, change in cursor.fetchall():
+                result.setdefault(path, []).append(
+                    {period: when.isoformat(), "total": total, "change": change}
+                )
+        cache.set(cache_key, result, 24 * 60 * 60)
+    return result
+
+
+def clear_trends_cache():
+    try:
+        cache.incr(TRENDS_VERSION_KEY)
+    except ValueError:
+        pass
@@ -1,27 +1,126 @@
-from django.test import TestCase
-from .models import SubscriberCount
+import datetime
+import io
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from .models import SubscriberCount, DailySubscriberCount, MonthlySubscriberCount
+from .rollups import rollup, trends
+from . import utils
+from .utils import buffer
 from django.utils import timezone
 
 
+@override_settings(FEEDSTATS_FLUSH_INTERVAL=None, FEEDSTATS_BUFFER_SIZE=100)
 class FeedstatsTests(TestCase):
+    def setUp(self):
+        buffer.pending.clear()
+        buffer.flushed.clear()
+
     def test_feedstats_records_subscriber_numbers(self):
         self.assertEqual(0, SubscriberCount.objects.count())
         # If no \d+ subscribers, we don't record anything
         self.client.get("/atom/everything/", HTTP_USER_AGENT="Blah")
+        buffer.flush()
         self.assertEqual(0, SubscriberCount.objects.count())
         self.client.get("/atom/everything/", HTTP_USER_AGENT="Blah (10 subscribers)")
+        buffer.flush()
         self.assertEqual(1, SubscriberCount.objects.count())
         row = SubscriberCount.objects.all()[0]
         self.assertEqual("/atom/everything/", row.path)
         self.assertEqual(10, row.count)
         self.assertEqual(timezone.now().date(), row.created.date())
+        self.assertEqual(timezone.localdate(), row.day)
         self.assertEqual("Blah (X subscribers)", row.user_agent)
         # If we hit again with the same number, no new record is recorded
         self.client.get("/atom/everything/", HTTP_USER_AGENT="Blah (10 subscribers)")
+        buffer.flush()
         self.assertEqual(1, SubscriberCount.objects.count())
         # If we hit again with a different number, we record a new row
         self.client.get("/atom/everything/", HTTP_USER_AGENT="Blah (11 subscribers)")
+        buffer.flush()
         self.assertEqual(2, SubscriberCount.objects.count())
-        row = SubscriberCount.objects.all()[1]
+        row = SubscriberCount.objects.order_by("id")[1]
         self.assertEqual(11, row.count)
         self.assertEqual("Blah (X subscribers)", row.user_agent)
+
+    def test_feedstats_are_buffered(self):
+        for count in (10, 10, 11, 10):
+            self.client.get(
+                "/atom/entries/", HTTP_USER_AGENT=f"Blah ({count} subscribers)"
+            )
+        # Nothing is written until the buffer is flushed...
+        self.assertEqual(0, SubscriberCount.objects.count())
+        # ...and then duplicates are written just once.
+        with self.assertNumQueries(1):
+            self.assertEqual(2, buffer.flush())
+        self.assertEqual(2, SubscriberCount.objects.count())
+
+    @override_settings(FEEDSTATS_BUFFER_SIZE=2)
+    def test_feedstats_flushes_when_buffer_fills(self):
+        self.client.get("/atom/entries/", HTTP_USER_AGENT="Blah (1 subscribers)")
+        self.assertEqual(0, SubscriberCount.objects.count())
+        self.client.get("/atom/entries/", HTTP_USER_AGENT="Blah (2 subscribers)")
+        self.assertEqual(2, SubscriberCount.objects.count())
+
+    @override_settings(FEEDSTATS_BUFFER_SIZE=1)
+    def test_feedstats_write_failures_dont_fail_feeds(self):
+        with mock.patch.object(
+            SubscriberCount.objects, "bulk_create", side_effect=Exception("down")
+        ), mock.patch.object(utils, "MAX_PENDING", 2), self.assertLogs(
+            "feedstats.utils", "ERROR"
+        ):
+            for count in (1, 2, 3):
+                response = self.client.get(
+                    "/atom/entries/", HTTP_USER_AGENT=f"Blah ({count} subscribers)"
+                )
+                self.assertEqual(200, response.status_code)
+            # Kept for the next flush, but no more than MAX_PENDING
+            self.assertEqual(2, len(buffer.pending))
+            self.assertEqual(0, buffer.flush_quietly())
+        self.assertEqual(2, buffer.flush())
+        self.assertEqual(2, SubscriberCount.objects.count())
+
+
+class FeedstatsRollupTests(TestCase):
+    def setUp(self):
+        today = timezone.localdate()
+        self.old = today - datetime.timedelta(days=60)
+        for day, user_agent, count in [
+            (self.old, "Reader (X subscribers)", 10),
+            (self.old, "Reader (X subscribers)", 12),
+            (self.old, "Other (X subscribers)", 3),
+            (today, "Reader (X subscribers)", 11),
+        ]:
+            SubscriberCount.objects.create(
+                path="/atom/everything/", user_agent=user_agent, count=count, day=day
+            )
+
+    def test_compact_feedstats(self):
+        call_command("compact_feedstats", "--keep-days=30", stdout=io.StringIO())
+        # Old raw rows are gone, recent ones stay
+        self.assertEqual(1, SubscriberCount.objects.count())
+        # The daily rollup keeps the max per aggregator per day
+        self.assertEqual(
+            [("Other (X subscribers)", 3), ("Reader (X subscribers)", 12)],
+            list(
+                DailySubscriberCount.objects.filter(day=self.old)
+                .order_by("user_agent")
+                .values_list("user_agent", "subscribers")
+            ),
+        )
+        self.assertEqual(
+            12,
+            MonthlySubscriberCount.objects.get(
+                month=self.old.replace(day=1), user_agent="Reader (X subscribers)"
+            ).subscribers,
+        )
+
+    def test_trends(self):
+        rollup()
+        [older, newer] = trends("day")["/atom/everything/"]
+        self.assertEqual((15, None), (older["total"], older["change"]))
+        self.assertEqual((11, -4), (newer["total"], newer["change"]))
+
+    def test_trends_view_is_staff_only(self):
+        response = self.client.get("/tools/feed-trends/")
+        self.assertEqual(302, response.status_code)
@@ -1,9 +1,140 @@
 from functools import wraps
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 from .models import SubscriberCount
-import datetime
+import atexit
+import logging
 import re
+import threading
 
-subscribers_re = re.compile("(\d+) subscribers")
+log = logging.getLogger(__name__)
+
+subscribers_re = re.compile(r"(\d+) subscribers")
+
+# Counts held in memory, at most, while the database can't be written to;
+# past that new counts are dropped.
+MAX_PENDING = 10000
+
+
+class SubscriberCountBuffer:
+    """
+    Collects subscriber counts in memory and writes them to the database in
+    batches, so that feed requests never wait on feedstats writes.
+
+    Counts are de-duplicated as (path, simplified user agent, count, day)
+    tuples, and a tuple that's already been written today is never written
+    again. Pending counts are flushed by a background thread every
+    FEEDSTATS_FLUSH_INTERVAL seconds, or sooner if FEEDSTATS_BUFFER_SIZE
+    counts pile up. If FEEDSTATS_FLUSH_INTERVAL is None there's no background
+    thread, and counts are flushed inline once the buffer fills up (or when
+    flush() is called).
+
+    A failed write never fails the feed request: the counts are kept for the
+    next flush, up to MAX_PENDING of them, and the error is logged.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.flushed = set()
+        self.flushed_day = None
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.dropped = 0
+
+    def add(self, path, user_agent, count, day):
+        row = (path, user_agent, count, day)
+        with self.lock:
+            if row in self.flushed or row in self.pending:
+                return
+            if len(self.pending) >= MAX_PENDING:
+                self.dropped += 1
+                return
+            self.pending.add(row)
+            full = len(self.pending) >= settings.FEEDSTATS_BUFFER_SIZE
+
+        if settings.FEEDSTATS_FLUSH_INTERVAL is None:
+            if full:
+                self.flush_quietly()
+        else:
+            self.start()
+            if full:
+                self.wakeup.set()
+
+    def flush(self):
+        """
+        Writes all pending counts with a single INSERT ... ON CONFLICT DO
+        NOTHING. Returns the number of counts written.
+        """
+        with self.lock:
+            rows, self.pending = self.pending, set()
+        if not rows:
+            return 0
+        try:
+            SubscriberCount.objects.bulk_create(
+                [
+                    SubscriberCount(path=path, user_agent=ua, count=count, day=day)
+                    for (path, ua, count, day) in rows
+                ],
+                ignore_conflicts=True,
+            )
+        except Exception:
+            # Put them back so the next flush can try again, as long as
+            # there's room.
+            with self.lock:
+                room = max(MAX_PENDING - len(self.pending), 0)
+                kept = set(list(rows)[:room])
+                self.dropped += len(rows) - len(kept)
+                self.pending |= kept
+            raise
+
+        today = timezone.localdate()
+        with self.lock:
+            if self.flushed_day != today:
+                self.flushed = set()
+                self.flushed_day = today
+            self.flushed.update(row for row in rows if row[3] == today)
+        return len(rows)
+
+    def flush_quietly(self):
+        """
+        flush(), but logging errors rather than raising them: for the feed
+        request, the background thread, and exit.
+        """
+        try:
+            return self.flush()
+        except Exception:
+            log.exception(
+                "couldn't flush subscriber counts (%d pending, %d dropped)",
+                len(self.pending),
+                self.dropped,
+            )
+            return 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name="feedstats-flush", daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(settings.FEEDSTATS_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.flush_quietly()
+            finally:
+                # This thread's connection would otherwise sit open forever
+                connection.close()
+
+
+buffer = SubscriberCountBuffer()
+atexit.register(buffer.flush_quietly)
 
 
 def count_subscribers(view_fn):
@@ -12,21 +143,12 @@ def count_subscribers(view_fn):
         user_agent = request.META.get("HTTP_USER_AGENT", "")
         match = subscribers_re.search(user_agent)
         if match:
-            count = int(match.group(1))
-            today = datetime.date.today()
-            simplified_user_agent = subscribers_re.sub("X subscribers", user_agent)
-            # Do we have this one yet?
-            if not SubscriberCount.objects.filter(
+            buffer.add(
                 path=request.path,
-                count=count,
-                user_agent=simplified_user_agent,
-                created__year=today.year,
-                created__month=today.month,
-                created__day=today.day,
-            ).exists():
-                SubscriberCount.objects.create(
-                    path=request.path, count=count, user_agent=simplified_user_agent
-                )
+                user_agent=subscribers_re.sub("X subscribers", user_agent),
+                count=int(match.group(1)),
+                day=timezone.localdate(),
+            )
         return view_fn(request, *args, **kwargs)
 
     return inner_fn
@@ -0,0 +1,25 @@
+import datetime
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, JsonResponse
+from django.views.decorators.cache import never_cache
+from .rollups import TREND_PERIODS, trends as get_trends
+
+
+@never_cache
+@staff_member_required
+def trends(request):
+    """
+    Total subscribers per feed over time, as JSON.
+
+    ?period=day (default) or month; ?since=YYYY-MM-DD to limit the range.
+    """
+    period = request.GET.get("period", "day")
+    if period not in TREND_PERIODS:
+        raise Http404
+    since = None
+    if request.GET.get("since"):
+        try:
+            since = datetime.date.fromisoformat(request.GET["since"])
+        except ValueError:
+            raise Http404
+    return JsonResponse({"period": period, "feeds": get_trends(period, since)})
@@ -2,16 +2,40 @@ import requests
 import json
 from django.utils.text import slugify
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.signals import bulk_pages_changed
+from ... import oembed
 from ...models import Presentation, Coverage, Conference
 
 
 class Command(BaseCommand):
-    help = "load coverage data scraped from lanyrd into json"
+    help = """
+        load coverage data scraped from lanyrd into json
+
+        Everything the import needs to look up is loaded up front, and new
+        conferences, presentations and coverage are bulk-created in one
+        transaction, after which the pages of every presentation it touched
+        are purged and invalidated (see blog.signals). oEmbed data is fetched
+        afterwards, concurrently (see speaking_portfolio.oembed), unless
+        --skip-oembed is given.
+    """
 
     def add_arguments(self, parser):
         parser.add_argument(
             "url_or_path_to_json", type=str, help="URL or path to JSON to import"
         )
+        parser.add_argument(
+            "--skip-oembed",
+            action="store_true",
+            help="Don't fetch oEmbed data for the new coverage "
+            "(refresh_coverage_oembed can do it later)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=oembed.WORKERS,
+            help="Concurrent oEmbed requests",
+        )
 
     def handle(self, url_or_path_to_json, *args, **kwargs):
 
@@ -22,45 +46,98 @@ class Command(BaseCommand):
         if is_url:
             data = requests.get(url_or_path_to_json).json()
         else:
-            data = json.load(open(url_or_path_to_json))
+            with open(url_or_path_to_json) as fp:
+                data = json.load(fp)
+
+        with transaction.atomic():
+            coverage = self.import_coverage(data)
+
+        if coverage and not kwargs["skip_oembed"]:
+            fetched, failed = oembed.refresh(coverage, workers=kwargs["workers"])
+            self.stdout.write(
+                f"Fetched oembed data: {fetched} fetched, {failed} failed"
+            )
+
+    def import_coverage(self, data):
+        existing_urls = set(Coverage.objects.values_list("url", flat=True))
+        conferences = {c.title: c for c in Conference.objects.all()}
+        presentations = {
+            (p.slug, p.conference.title): p
+            for p in Presentation.objects.select_related("conference")
+        }
 
+        new_conferences, updated_conferences = {}, {}
+        new_presentations = {}
+        rows = []
         for coverage_url, coverage_detail in data.items():
             # Skip existing coverage
-            if Coverage.objects.filter(url=coverage_url).exists():
+            if coverage_url in existing_urls:
                 continue
 
             # Skip coverage that was scraped with an error
             if "error" in coverage_detail["conference"]:
                 continue
 
-            # Look for an existing presentation
-            talk_slug = slugify(coverage_detail["talk_title"])[:50]
-            try:
-                presentation = Presentation.objects.get(
-                    slug=talk_slug,
-                    conference__title=coverage_detail["conference"]["title"],
-                )
-            except Presentation.DoesNotExist:
-                conference, created = Conference.objects.update_or_create(
-                    title=coverage_detail["conference"]["title"],
-                    defaults={
-                        "link": coverage_detail["conference"]["link"],
-                        "start_date": coverage_detail["start_date"],
-                        "end_date": coverage_detail["end_date"],
-                    },
-                )
-                if created:
-                    print(f"Created {conference.title}")
-
-                presentation = Presentation.objects.create(
-                    conference=conference,
+            # Look for an existing (or already seen) presentation; if there
+            # isn't one, create it, and create or update its conference.
+            title = coverage_detail["conference"]["title"]
+            key = (slugify(coverage_detail["talk_title"])[:50], title)
+            if key not in presentations and key not in new_presentations:
+                details = {
+                    "link": coverage_detail["conference"]["link"],
+                    "start_date": coverage_detail["start_date"],
+                    "end_date": coverage_detail["end_date"],
+                }
+                if title in conferences:
+                    conference = conferences[title]
+                    for field, value in details.items():
+                        setattr(conference, field, value)
+                    updated_conferences[title] = conference
+                else:
+                    conference = new_conferences.setdefault(
+                        title, Conference(title=title)
+                    )
+                    for field, value in details.items():
+                        setattr(conference, field, value)
+                new_presentations[key] = Presentation(
                     title=coverage_detail["talk_title"],
-                    slug=talk_slug,
+                    slug=key[0],
                     date=coverage_detail["start_date"],
                 )
-                print(f"Created {presentation.title}")
+            rows.append((key, coverage_detail["type"], coverage_url))
+            existing_urls.add(coverage_url)
+
+        Conference.objects.bulk_create(new_conferences.values())
+        Conference.objects.bulk_update(
+            updated_conferences.values(), ["link", "start_date", "end_date"]
+        )
+        conferences.update(new_conferences)
+        for title in new_conferences:
+            self.stdout.write(f"Created {title}")
+
+        for (_, title), presentation in new_presentations.items():
+            presentation.conference = conferences[title]
+        Presentation.objects.bulk_create(new_presentations.values())
+        presentations.update(new_presentations)
+        for presentation in new_presentations.values():
+            self.stdout.write(f"Created {presentation.title}")
+
+        # oembed=None marks the coverage as not fetched yet
+        coverage = Coverage.objects.bulk_create(
+            Coverage(presentation=presentations[key], type=type, url=url, oembed=None)
+            for key, type, url in rows
+        )
+        for c in coverage:
+            self.stdout.write(f"Created {c}")
 
-            coverage = presentation.coverage.create(
-                type=coverage_detail["type"], url=coverage_url
+        # bulk_create skips the signals that would purge pages. Presentations
+        # show their conference, so updated conferences change theirs too.
+        changed = {c.presentation_id for c in coverage}
+        if updated_conferences:
+            changed.update(
+                Presentation.objects.filter(
+                    conference__in=updated_conferences.values()
+                ).values_list("pk", flat=True)
             )
-            print(f"Created {coverage}")
+        bulk_pages_changed(Presentation, changed)
+        return coverage
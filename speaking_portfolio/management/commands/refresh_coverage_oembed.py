@@ -1,10 +1,62 @@
-from django.core.management.base import BaseCommand
+import datetime
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ... import oembed
 from ...models import Coverage
 
 
 class Command(BaseCommand):
-    help = "Re-fetch oembed data for all coverage"
+    help = """
+        Re-fetch oembed data for coverage: by default all of it, or with
+        --stale-after only coverage that's never been fetched or was last
+        fetched more than that many days ago. Requests are made concurrently,
+        rate-limited per provider; see speaking_portfolio.oembed.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stale-after",
+            type=float,
+            help="Only refetch embeds older than this many days",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=oembed.WORKERS,
+            help=f"Concurrent requests (default {oembed.WORKERS})",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=oembed.RATE_LIMIT,
+            help=f"Requests per second to any one provider "
+            f"(default {oembed.RATE_LIMIT})",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=oembed.BATCH_SIZE,
+            help=f"Rows per bulk update (default {oembed.BATCH_SIZE})",
+        )
 
     def handle(self, *args, **kwargs):
-        for c in Coverage.objects.all():
-            c.save()
+        if kwargs["workers"] < 1 or kwargs["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive")
+        stale_after = kwargs["stale_after"]
+        if stale_after is None:
+            coverage = Coverage.objects.all()
+        else:
+            coverage = oembed.stale(datetime.timedelta(days=stale_after))
+
+        start = time.perf_counter()
+        fetched, failed = oembed.refresh(
+            coverage,
+            workers=kwargs["workers"],
+            rate=kwargs["rate"],
+            batch_size=kwargs["batch_size"],
+            cached=False,
+        )
+        self.stdout.write(
+            f"{fetched} fetched, {failed} failed "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("speaking_portfolio", "0009_remove_pres_link_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="coverage",
+            name="oembed_fetched",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
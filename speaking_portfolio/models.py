@@ -1,12 +1,9 @@
-import micawber
-import logging
 from django.db import models
 from django_postgres_unlimited_varchar import UnlimitedCharField
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.postgres.fields import JSONField
-
-log = logging.getLogger(__name__)
+from . import oembed
 
 
 class Conference(models.Model):
@@ -75,7 +72,10 @@ class Coverage(models.Model):
     )
     type = UnlimitedCharField(choices=COVERAGE_TYPE_CHOICES)
     url = models.URLField()
+    # None ("pending") until oEmbed data has been fetched, which happens in
+    # the background after a save; see speaking_portfolio.oembed
     oembed = JSONField(blank=True, null=True)
+    oembed_fetched = models.DateTimeField(blank=True, null=True, editable=False)
 
     def __str__(self):
         return f"{self.presentation} - {self.type}"
@@ -83,14 +83,28 @@ class Coverage(models.Model):
     class Meta:
         verbose_name_plural = "coverage"
 
+    _loaded_url = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_url = instance.__dict__.get("url")
+        return instance
+
     def save(self, *args, **kwargs):
-        providers = micawber.bootstrap_basic()
-        try:
-            self.oembed = providers.request(self.url)
-        except micawber.ProviderException as e:
-            log.warn(f"error saving oembed for {self}: {e}")
-            self.oembed = {}
+        # New and changed URLs need (new) oEmbed data, but saving doesn't wait
+        # for it: it's fetched after the transaction commits.
+        fetch = self.oembed is None or self.url != self._loaded_url
+        if fetch:
+            self.oembed = self.oembed_fetched = None
         super().save(*args, **kwargs)
+        self._loaded_url = self.url
+        if fetch:
+            oembed.fetch_queue.add([self.pk])
+
+    @property
+    def oembed_pending(self):
+        return self.oembed is None
 
     @property
     def icon_class(self):
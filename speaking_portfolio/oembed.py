@@ -0,0 +1,182 @@
+"""
+oEmbed lookups for coverage.
+
+Fetching oEmbed data means an HTTP request per coverage URL, so it's kept out
+of saves and bulk work like imports: coverage is saved with `oembed=None`
+("pending") and filled in afterwards by `refresh()`, which makes the requests
+from a thread pool -- no faster than RATE_LIMIT requests a second to any one
+provider -- and writes the results with bulk_update, and then has the pages
+showing that coverage purged and invalidated (see blog.signals), since
+bulk_update skips the model signals. Coverage.save() queues new and changed
+coverage on `fetch_queue`, which calls refresh() once the transaction commits.
+
+Responses are cached by URL, since the same video or slides are often linked
+from more than one talk.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import micawber
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from blog.commit_queue import CommitQueue
+from . import models
+
+log = logging.getLogger(__name__)
+
+WORKERS = 8
+TIMEOUT = 5
+RATE_LIMIT = 5
+BATCH_SIZE = 100
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+_providers = None
+
+
+def providers():
+    """Returns the provider registry, shared by every lookup."""
+    global _providers
+    if _providers is None:
+        _providers = micawber.bootstrap_basic()
+        for _, provider in _providers:
+            provider.socket_timeout = TIMEOUT
+    return _providers
+
+
+class RateLimiter:
+    """
+    Spaces out requests to each host so that there are no more than `rate` a
+    second, by making callers wait their turn.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        time.sleep(slot - now)
+
+
+def request(url, limiter=None, cached=True):
+    """
+    Returns oEmbed data for `url`: {} if no provider knows about it, or None
+    if the provider couldn't be reached or returned an error. Responses are
+    cached; with `cached=False` the provider is asked again regardless.
+    """
+    provider = providers().provider_for_url(url)
+    if provider is None:
+        return {}
+    key = "oembed:%s" % hashlib.md5(url.encode("utf8")).hexdigest()
+    if cached:
+        data = cache.get(key)
+        if data is not None:
+            return data
+    if limiter:
+        limiter.wait(urllib.parse.urlsplit(provider.endpoint).netloc)
+    try:
+        data = provider.request(url)
+    except micawber.ProviderException as e:
+        log.warning(f"error fetching oembed for {url}: {e}")
+        return None
+    cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def stale(stale_after=None):
+    """
+    Returns the coverage whose oEmbed data needs fetching: never fetched,
+    or (with `stale_after`, a timedelta) last fetched longer ago than that.
+    """
+    q = Q(oembed__isnull=True) | Q(oembed_fetched__isnull=True)
+    if stale_after is not None:
+        q |= Q(oembed_fetched__lt=timezone.now() - stale_after)
+    return models.Coverage.objects.filter(q)
+
+
+def refresh(
+    coverage=None,
+    workers=WORKERS,
+    rate=RATE_LIMIT,
+    batch_size=BATCH_SIZE,
+    cached=True,
+):
+    """
+    Fetches and saves oEmbed data for `coverage` (a queryset or list), by
+    default all coverage that's never been fetched. Each distinct URL is
+    requested once (and, with `cached`, only if it's not in the cache), and
+    results are saved in batches as they arrive. If a fetch fails, what's
+    already there is kept and oembed_fetched isn't set, so it's tried again
+    next time.
+
+    Returns a (fetched, failed) tuple of counts of coverage objects.
+    """
+    # Imported here, since blog.signals needs our models
+    from blog.signals import bulk_pages_changed
+
+    def save(batch):
+        models.Coverage.objects.bulk_update(batch, ["oembed", "oembed_fetched"])
+        bulk_pages_changed(models.Presentation, {c.presentation_id for c in batch})
+
+    if coverage is None:
+        coverage = stale()
+    by_url = {}
+    for c in coverage:
+        by_url.setdefault(c.url, []).append(c)
+    limiter = RateLimiter(rate)
+    fetched = failed = 0
+    batch = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda url: request(url, limiter, cached), by_url)
+        for url, data in zip(by_url, results):
+            for c in by_url[url]:
+                if data is None:
+                    failed += 1
+                    if c.oembed is not None:
+                        continue
+                    c.oembed = {}
+                else:
+                    fetched += 1
+                    c.oembed, c.oembed_fetched = data, timezone.now()
+                batch.append(c)
+            if len(batch) >= batch_size:
+                save(batch)
+                batch = []
+    save(batch)
+    return fetched, failed
+
+
+class FetchQueue(CommitQueue):
+    """
+    Coverage waiting for its oEmbed data, fetched once the transaction that
+    saved it commits. Unless OEMBED_FETCH_IN_BACKGROUND is turned off, that's
+    done by a worker thread, so saves never wait on a provider.
+    """
+
+    title = "oEmbed fetch queue"
+    thread_name = "oembed-fetch"
+    background_setting = "OEMBED_FETCH_IN_BACKGROUND"
+    initial_stats = {"fetched": 0, "failed": 0}
+
+    def add(self, pks):
+        self.enqueue(pks)
+
+    def process(self, pks):
+        # Anything fetched (or re-saved) since it was queued is skipped
+        fetched, failed = refresh(
+            models.Coverage.objects.filter(pk__in=pks, oembed__isnull=True)
+        )
+        self.count(fetched=fetched, failed=failed)
+
+
+fetch_queue = FetchQueue()
@@ -1,3 +1,256 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from micawber import Provider
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import oembed
+from .models import Conference, Coverage, Presentation
 
-# Create your tests here.
+
+def lanyrd_row(talk_title, conference_title, type="video"):
+    return {
+        "talk_title": talk_title,
+        "conference": {"title": conference_title, "link": "https://conf.example/"},
+        "start_date": "2019-06-01",
+        "end_date": "2019-06-03",
+        "type": type,
+    }
+
+
+def import_json(data, *args):
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as fp:
+        json.dump(data, fp)
+        fp.flush()
+        call_command(
+            "import_lanyrd_coverage_json", fp.name, *args, stdout=io.StringIO()
+        )
+
+
+class ImportCoverageTests(TestCase):
+    def test_import_batches_queries_and_defers_oembed(self):
+        conference = Conference.objects.create(title="ExistingConf")
+        Presentation.objects.create(
+            title="Old talk", slug="old-talk", date="2018-01-01", conference=conference
+        )
+        data = {
+            f"https://video.example/{i}": lanyrd_row(f"Talk {i % 5}", f"Conf {i % 2}")
+            for i in range(20)
+        }
+        data["https://slides.example/old"] = lanyrd_row(
+            "Old talk", "ExistingConf", "slides"
+        )
+        # A new talk at an existing conference updates the conference
+        data["https://slides.example/new"] = lanyrd_row(
+            "New talk", "ExistingConf", "slides"
+        )
+        data["https://broken.example/"] = {"conference": {"error": "404"}}
+
+        # Three preloads, three bulk_creates, a bulk_update, the savepoint,
+        # and finding the presentations whose pages changed
+        with self.assertNumQueries(11):
+            import_json(data, "--skip-oembed")
+
+        self.assertEqual(Coverage.objects.count(), 22)
+        self.assertEqual(Conference.objects.count(), 3)
+        self.assertEqual(Presentation.objects.count(), 12)
+        self.assertFalse(Coverage.objects.filter(oembed__isnull=False).exists())
+        self.assertEqual(
+            Conference.objects.get(title="ExistingConf").link, "https://conf.example/"
+        )
+
+        # Importing again skips everything that's already there
+        with self.assertNumQueries(5):
+            import_json(data, "--skip-oembed")
+        self.assertEqual(Coverage.objects.count(), 22)
+
+    def test_import_fetches_oembed_afterwards(self):
+        with mock.patch.object(oembed, "request", return_value={"html": "x"}):
+            import_json({"https://video.example/": lanyrd_row("Talk", "Conf")})
+        coverage = Coverage.objects.get()
+        self.assertEqual(coverage.oembed, {"html": "x"})
+        self.assertIsNotNone(coverage.oembed_fetched)
+
+
+class OEmbedHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in oEmbed provider for http://video.test/ URLs: /broken/ URLs get
+    a 500, and everything else a video embed.
+    """
+
+    def do_GET(self):
+        url = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)["url"][0]
+        self.server.requests.append((time.monotonic(), url))
+        if "/broken/" in url:
+            self.send_error(500)
+            return
+        body = json.dumps({"type": "video", "html": f'<iframe src="{url}">'})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body.encode("utf8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class OEmbedServerMixin:
+    pattern = r"http://video\.test/\S+"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), OEmbedHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        endpoint = "http://127.0.0.1:%d/oembed" % cls.server.server_address[1]
+        oembed.providers().register(cls.pattern, Provider(endpoint, timeout=2))
+
+    @classmethod
+    def tearDownClass(cls):
+        oembed.providers().unregister(cls.pattern)
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests = []
+        conference = Conference.objects.create(title="Conf")
+        self.presentation = Presentation.objects.create(
+            title="Talk", slug="talk", date="2019-01-01", conference=conference
+        )
+
+    def coverage(self, path, **kwargs):
+        return Coverage.objects.bulk_create(
+            [
+                Coverage(
+                    presentation=self.presentation,
+                    type="video",
+                    url=f"http://video.test/{path}",
+                    **kwargs,
+                )
+            ]
+        )[0]
+
+
+class RefreshTests(OEmbedServerMixin, TestCase):
+    def test_refresh_fetches_and_keeps_old_data_on_failure(self):
+        new = self.coverage("new", oembed=None)
+        old = self.coverage("broken/old", oembed={"html": "old"})
+        unfetched = self.coverage("broken/never", oembed=None)
+
+        self.assertEqual(oembed.refresh(Coverage.objects.all()), (1, 2))
+        new.refresh_from_db()
+        self.assertEqual(new.oembed["html"], '<iframe src="http://video.test/new">')
+        self.assertIsNotNone(new.oembed_fetched)
+        old.refresh_from_db()
+        self.assertEqual((old.oembed, old.oembed_fetched), ({"html": "old"}, None))
+        unfetched.refresh_from_db()
+        self.assertEqual((unfetched.oembed, unfetched.oembed_fetched), ({}, None))
+
+    def test_refresh_command_only_refetches_stale_embeds(self):
+        now = timezone.now()
+        self.coverage("fresh", oembed={}, oembed_fetched=now)
+        self.coverage("stale", oembed={}, oembed_fetched=now - datetime.timedelta(40))
+        self.coverage("pending", oembed=None)
+
+        out = io.StringIO()
+        call_command("refresh_coverage_oembed", "--stale-after=30", stdout=out)
+        self.assertIn("2 fetched, 0 failed", out.getvalue())
+        self.assertEqual(
+            sorted(url for _, url in self.server.requests),
+            ["http://video.test/pending", "http://video.test/stale"],
+        )
+
+    def test_refresh_rate_limits_per_provider(self):
+        for i in range(4):
+            self.coverage(i, oembed=None)
+        oembed.refresh(workers=4, rate=20)
+        times = sorted(t for t, _ in self.server.requests)
+        self.assertEqual(len(times), 4)
+        # Four requests at 20/sec are spread over at least 150ms
+        self.assertGreaterEqual(times[-1] - times[0], 0.14)
+
+    def test_same_url_is_fetched_once_and_cached(self):
+        for _ in range(3):
+            self.coverage("shared", oembed=None)
+        self.assertEqual(oembed.refresh(), (3, 0))
+        self.assertEqual(len(self.server.requests), 1)
+
+        Coverage.objects.update(oembed=None)
+        self.assertEqual(oembed.refresh(), (3, 0))
+        self.assertEqual(len(self.server.requests), 1)
+        oembed.refresh(Coverage.objects.all(), cached=False)
+        self.assertEqual(len(self.server.requests), 2)
+
+    @override_settings(OEMBED_FETCH_IN_BACKGROUND=False)
+    def test_save_does_not_wait_for_oembed(self):
+        coverage = Coverage(
+            presentation=self.presentation, type="video", url="http://video.test/a"
+        )
+        coverage.save()
+        self.assertTrue(coverage.oembed_pending)
+        self.assertEqual(self.server.requests, [])
+        response = self.client.get(self.presentation.get_absolute_url())
+        self.assertContains(response, "coverage-pending")
+
+        # The fetch happens when the transaction commits
+        oembed.fetch_queue.flush()
+        coverage.refresh_from_db()
+        self.assertIn("iframe", coverage.oembed["html"])
+        self.assertEqual(len(self.server.requests), 1)
+
+        # Saving without changing the URL doesn't refetch
+        coverage.type = "slides"
+        coverage.save()
+        self.assertFalse(coverage.oembed_pending)
+        oembed.fetch_queue.flush()
+        self.assertEqual(len(self.server.requests), 1)
+
+
+class RefreshInvalidationTests(OEmbedServerMixin, TransactionTestCase):
+    @override_settings(OEMBED_FETCH_IN_BACKGROUND=False)
+    def test_fetched_oembed_replaces_cached_pages(self):
+        cache.clear()
+        coverage = self.coverage("a", oembed=None)
+        url = self.presentation.get_absolute_url()
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "hit")
+        self.assertContains(response, "coverage-pending")
+
+        oembed.fetch_queue.add([coverage.pk])
+        response = self.client.get(url)
+        self.assertEqual(response["X-Page-Cache"], "miss")
+        self.assertContains(response, '<iframe src="http://video.test/a">')
+
+
+class ImportInvalidationTests(TransactionTestCase):
+    def test_import_invalidates_cached_pages(self):
+        cache.clear()
+        conference = Conference.objects.create(title="Conf")
+        presentation = Presentation.objects.create(
+            title="Talk", slug="talk", date="2019-06-01", conference=conference
+        )
+        urls = [presentation.get_absolute_url(), "/speaking/"]
+        for url in urls:
+            self.client.get(url)
+            self.assertEqual(self.client.get(url)["X-Page-Cache"], "hit")
+
+        import_json(
+            {
+                "https://slides.example/talk": lanyrd_row("Talk", "Conf", "slides"),
+                "https://video.example/new": lanyrd_row("New talk", "Conf"),
+            },
+            "--skip-oembed",
+        )
+        for url in urls:
+            self.assertEqual(self.client.get(url)["X-Page-Cache"], "miss")
+        self.assertContains(self.client.get("/speaking/"), "New talk")
@@ -1,8 +1,10 @@
 from django.shortcuts import render, get_object_or_404
 from .models import Presentation
 from django.utils import timezone
+from blog.page_cache import surrogate_keys
 
 
+@surrogate_keys(["speaking"])
 def index(request):
     talks = Presentation.objects.order_by("-date").select_related("conference")
     return render(
@@ -15,6 +17,7 @@ def index(request):
     )
 
 
+@surrogate_keys(lambda slug: ["presentation:%s" % slug])
 def detail(request, slug):
     qs = Presentation.objects.select_related("conference").prefetch_related("coverage")
     return render(